@@ -1,66 +1,160 @@
+from dataclasses import dataclass
+import numpy as np
 import pm4py
-from pm4py.objects.transition_system.obj import TransitionSystem 
+from pm4py.objects.petri_net.obj import PetriNet, Marking
+from pm4py.objects.transition_system.obj import TransitionSystem
 import pandas
-from pm4py.algo.conformance.alignments.petri_net.algorithm import Variants
-
-def generate_translucent_log(log: pandas.DataFrame) -> pandas.DataFrame:
+from .alignment_cache import VariantAlignments, align_variants
+from .artifact_cache import ALIGNMENTS_ARTIFACT, PETRI_NET_ARTIFACT, artifact_path, load_artifact, log_content_hash, save_artifact
+from .compiled_petri_net import CompiledPetriNet
+from .instrumentation import RunMetrics
+from .preprocessor import ColumnMapping, fetch_dataframe, positions_by_variant
+
+ACTIVITY_COLUMN = "concept:name"
+CASE_COLUMN = "case:concept:name"
+
+
+@dataclass
+class IndexedReachabilityGraph(object):
+    '''
+    Reachability graph with integer states, built once so that replaying a trace does not scan the states or
+    parse transition names at every step.
+    e.g.: successors[0] = {"a": 1, "None": 2} means that state 0 reaches state 1 with activity a and state 2 silently.
+    '''
+    start_state: int
+    # Successor of every state per activity label, silent transitions are labelled "None"
+    successors: list[dict[str, int]]
+    # Labels of the visible transitions enabled in every state
+    enabled_labels: list[frozenset[str]]
+
+
+def transition_label(transition: TransitionSystem.Transition) -> str:
+    # Reachability graph transitions are named after the Petri net transition, e.g. "(t1, 'a')" or "(t2, None)"
+    return transition.name.strip("()").split(",")[1].strip().strip("'")
+
+
+def index_reachability_graph(reachability_graph: TransitionSystem) -> IndexedReachabilityGraph:
+    '''
+    Builds the state index and the successor and enabled label lookups of a reachability graph.
+    The start state is the state named "source1", or a state without incoming transitions if there is none.
+
+    :param reachability_graph: The reachability graph of a Petri net.
+    '''
+    states = list(reachability_graph.states)
+    state_index = {id(state): index for index, state in enumerate(states)}
+    start_state = next((index for index, state in enumerate(states) if state.name == "source1"), None)
+    if start_state is None:
+        start_state = next((index for index, state in enumerate(states) if not state.incoming), 0)
+
+    successors: list[dict[str, int]] = []
+    for state in states:
+        state_successors: dict[str, int] = {}
+        for transition in state.outgoing:
+            state_successors.setdefault(transition_label(transition), state_index[id(transition.to_state)])
+        successors.append(state_successors)
+
+    return IndexedReachabilityGraph(start_state, successors, [frozenset(labels) - {"None"} for labels in successors])
+
+
+def generate_translucent_log(log: pandas.DataFrame, petri_net: tuple[PetriNet, Marking, Marking] | None = None, alignments: VariantAlignments | None = None, workers: int = 1) -> pandas.DataFrame:
+    '''
+    Adds the activities enabled in the reachability graph of the net at every event. Every variant is aligned and
+    replayed once, and the result is copied to all cases of the variant.
+
+    :param log: The event log.
+    :param petri_net: The Petri net tuple. Discovered with the inductive miner if not given.
+    :param alignments: The alignment of every variant of the log. Computed if not given.
+    :param workers: The number of processes used to align the variants.
+    '''
 
     # Discover the petri net
-    net, im, fm = pm4py.discover_petri_net_inductive(log)
+    if petri_net is None:
+        petri_net = pm4py.discover_petri_net_inductive(log)
+    net, im, fm = petri_net
 
     # Discover the reachability graph
-    reach_graph = pm4py.convert_to_reachability_graph(net, im, fm)
-
-    # Create alignments and replay the alignment on the reachability graph
-    alignments_diagnostics = pm4py.conformance_diagnostics_alignments(log, net, im, fm, variant_str=Variants.VERSION_TWEAKED_STATE_EQUATION_A_STAR)
-    alignments = [alignment["alignment"] for alignment in alignments_diagnostics]
-
-    # Create dictionary of traces with log traces as keys and model alignments as values
-    unique_traces = set(tuple(trace) for trace in alignments)
-
-    trace_dict: dict[tuple[str], tuple[str]] = {}
-    for trace in unique_traces:
-        trace_dict[tuple(t[0] for t in trace if t[0] != '>>')] = tuple(t[1] for t in trace)
+    reach_graph = index_reachability_graph(pm4py.convert_to_reachability_graph(net, im, fm))
 
-    # Add enabled_activities column to DataFrame
-    log["enabled__activities"] = None
+    # Align every variant once and replay the model moves of the alignment on the reachability graph
+    if alignments is None:
+        alignments = align_variants(log, petri_net, workers=workers)
 
-    # Add the enabled activites to each trace
-    def add_enabled_activities(group: pandas.DataFrame):
+    enabled_activities_column = np.full(len(log), None, dtype=object)
+    for variant, positions in positions_by_variant(log).items():
+        aligned_trace = tuple(model_label for _, (_, model_label) in alignments[variant])
+        tuple_enabled_activities = get_enabled_activities(aligned_trace, reach_graph)
 
-        trace = tuple(group["concept:name"].values)
-        print(f"Trace: {trace}")
-        aligned_trace = trace_dict[trace]
+        # Every case of the variant gets the same enabled activities, event by event
+        number_of_events = min(len(variant), len(tuple_enabled_activities))
+        variant_enabled_activities = np.empty(number_of_events, dtype=object)
+        for index, enabled_activities in enumerate(tuple_enabled_activities[:number_of_events]):
+            variant_enabled_activities[index] = tuple(sorted(enabled_activities, key=str.lower))
+        enabled_activities_column[positions[:, :number_of_events]] = variant_enabled_activities[np.newaxis, :]
 
-        tuple_enabled_activities = get_enabled_activities(aligned_trace, reach_graph)
+    print(f"Replayed {len(alignments)} variants on a reachability graph with {len(reach_graph.successors)} states")
 
-        # Add enabled activites to log
-        for (index, row), enabled_activities in zip(group.iterrows(), tuple_enabled_activities):
-             group.at[index, 'enabled__activities'] = tuple(sorted(enabled_activities, key=str.lower))
-        
-        return group
+    # Add enabled_activities column to DataFrame, the events keep their order
+    log["enabled__activities"] = enabled_activities_column
+    return log.reset_index()
 
-    return log.groupby("case:concept:name", group_keys=False).apply(add_enabled_activities).reset_index()
+def get_enabled_activities(trace: tuple[str], reachability_graph: TransitionSystem | IndexedReachabilityGraph) -> tuple[frozenset[str]]:
 
-def get_enabled_activities(trace: tuple[str], reachability_graph: TransitionSystem) -> tuple[set[str]]:
+    if isinstance(reachability_graph, TransitionSystem):
+        reachability_graph = index_reachability_graph(reachability_graph)
 
     # Init list of enabled activities
     list_enabled_activities = []
 
     # Init state: Start from the source state of reachability graph
-    current_state = next((state for state in reachability_graph.states if state.name == "source1"), 'No match found')
+    current_state = reachability_graph.start_state
 
     # Iterate over the trace
     for activity in trace:
 
-        # Get all reachable transitions from current state
-        reachable_activities = set(transition.name.strip("()").split(",")[1].strip().strip("'") for transition in current_state.outgoing)
-
         # Add enabled activities (except the current activity) to dictionary if transition is not silent
-        if activity is not None: list_enabled_activities.append(reachable_activities - {"None"})
-
-        # Update current state
-        current_transition = next((transition for transition in current_state.outgoing if transition.name.strip("()").split(",")[1].strip().strip("'") == activity), "END")
-        if current_transition != "END": current_state = current_transition.to_state
-    
-    return tuple(list_enabled_activities)
\ No newline at end of file
+        if activity is not None: list_enabled_activities.append(reachability_graph.enabled_labels[current_state])
+
+        # Update current state, or stay if no transition with the activity is enabled
+        current_state = reachability_graph.successors[current_state].get(activity, current_state)
+
+    return tuple(list_enabled_activities)
+
+def translucify_alignments(log_filepath: str, workers: int = 1, metrics: RunMetrics | None = None, column_mapping: ColumnMapping | None = None) -> pandas.DataFrame:
+    '''
+    Generates a translucent log by replaying the alignments of a log file on the reachability graph of its
+    discovered Petri net. The net and the alignments are shared with the Petri net pipeline through the artifact cache.
+
+    :param log_filepath: The file path of the log file.
+    :param workers: The number of processes used to align the variants of the log.
+    :param metrics: Collects the duration, memory usage and item counts of every stage.
+    :param column_mapping: The original column of the case ID, activity and timestamp, if they are not named by the XES standard.
+    '''
+    if metrics is None:
+        metrics = RunMetrics("alignments")
+
+    with metrics.stage("read_log"):
+        # Read from the typed columnar copy of the log, the timestamp columns are already converted there
+        if log_filepath.endswith(".csv"):
+            log = fetch_dataframe(log_filepath, "CSV", categorical=False, column_mapping=column_mapping)
+            log[CASE_COLUMN] = log[CASE_COLUMN].astype("string")
+            log[ACTIVITY_COLUMN] = log[ACTIVITY_COLUMN].astype("string")
+        else:
+            log = fetch_dataframe(log_filepath, "XES", categorical=False, column_mapping=column_mapping)
+    metrics.count("events", len(log))
+    metrics.count("cases", log[CASE_COLUMN].nunique())
+
+    with metrics.stage("discovery"):
+        log_hash = log_content_hash(log_filepath, column_mapping)
+        cached_petri_net = load_artifact(log_hash, PETRI_NET_ARTIFACT)
+        if cached_petri_net is not None:
+            petri_net, _ = cached_petri_net
+        else:
+            petri_net = pm4py.discover_petri_net_inductive(log)
+            save_artifact(log_hash, PETRI_NET_ARTIFACT, (petri_net, CompiledPetriNet(petri_net)), log_filepath)
+
+    with metrics.stage("alignment"):
+        alignments = align_variants(log, petri_net, artifact_path(log_hash, ALIGNMENTS_ARTIFACT, log_filepath), workers)
+    metrics.count("variants", len(alignments))
+
+    with metrics.stage("enabled_activities"):
+        return generate_translucent_log(log, petri_net, alignments)
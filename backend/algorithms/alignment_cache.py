@@ -0,0 +1,164 @@
+import hashlib
+import os
+import pickle
+import tempfile
+from billiard import Pool
+from pandas import DataFrame
+from pm4py.objects.log.obj import Trace
+from pm4py.objects.petri_net.obj import PetriNet, Marking
+from pm4py.algo.conformance.alignments.petri_net.variants import dijkstra_less_memory
+
+ACTIVITY_COLUMN = "concept:name"
+CASE_COLUMN = "case:concept:name"
+
+Variant = tuple[str, ...]
+# A sync-product-aware alignment: [((log move name, model move name), (log label, model label)), ...]
+Alignment = list[tuple[tuple[str, str], tuple[str | None, str | None]]]
+VariantAlignments = dict[Variant, Alignment]
+
+
+def net_fingerprint(petri_net: tuple[PetriNet, Marking, Marking]) -> str:
+    '''
+    Hashes the structure of a Petri net (places, transitions, arcs and markings) so that cached alignments
+    are only reused for the exact net they were computed on.
+
+    :param petri_net: The Petri net tuple.
+    '''
+    net, im, fm = petri_net
+    structure = (
+        sorted(place.name for place in net.places),
+        sorted((transition.name, str(transition.label)) for transition in net.transitions),
+        sorted((arc.source.name, arc.target.name, arc.weight) for arc in net.arcs),
+        sorted((place.name, count) for place, count in im.items()),
+        sorted((place.name, count) for place, count in fm.items()),
+    )
+    return hashlib.sha256(repr(structure).encode()).hexdigest()
+
+
+def get_variants(log: DataFrame) -> list[Variant]:
+    '''
+    Returns the unique activity sequences (variants) of a log in order of first appearance.
+
+    :param log: The log DataFrame.
+    '''
+    traces = log.groupby(CASE_COLUMN, sort=False)[ACTIVITY_COLUMN].agg(tuple)
+    return list(dict.fromkeys(traces))
+
+
+def align_variant(variant: Variant, petri_net: tuple[PetriNet, Marking, Marking]) -> Alignment:
+    '''
+    Computes the sync-product-aware optimal alignment of a single variant.
+
+    :param variant: The activity sequence.
+    :param petri_net: The Petri net tuple.
+    '''
+    net, im, fm = petri_net
+    trace = Trace([{ACTIVITY_COLUMN: activity} for activity in variant])
+    alignments = dijkstra_less_memory.apply(trace, net, im, fm, parameters={dijkstra_less_memory.Parameters.PARAM_ALIGNMENT_RESULT_IS_SYNC_PROD_AWARE: True})
+    return alignments["alignment"]
+
+
+# Petri net of the current alignment worker process, set once per worker by the pool initializer
+_worker_petri_net: tuple[PetriNet, Marking, Marking] | None = None
+
+
+def _init_alignment_worker(petri_net: tuple[PetriNet, Marking, Marking]):
+    global _worker_petri_net
+    _worker_petri_net = petri_net
+
+
+def _align_variant_in_worker(variant: Variant) -> Alignment:
+    return align_variant(variant, _worker_petri_net)
+
+
+def align_variants_in_parallel(variants: list[Variant], petri_net: tuple[PetriNet, Marking, Marking], workers: int) -> list[Alignment]:
+    '''
+    Spreads the variants over a process pool and returns their alignments in the order of the variants.
+    The net and its markings are pickled once per worker process instead of once per variant.
+    The pool is a billiard pool, which (unlike concurrent.futures and multiprocessing pools) can also be started from
+    the daemonic worker processes of Celery's default prefork pool.
+
+    :param variants: The activity sequences to align.
+    :param petri_net: The Petri net tuple.
+    :param workers: The number of worker processes.
+    '''
+    if workers <= 1 or len(variants) <= 1:
+        return [align_variant(variant, petri_net) for variant in variants]
+
+    workers = min(workers, len(variants))
+    # Hand out several variants per task so that inter-process overhead stays small for short traces
+    chunksize = max(1, len(variants) // (workers * 4))
+    with Pool(processes=workers, initializer=_init_alignment_worker, initargs=(petri_net,)) as pool:
+        return pool.map(_align_variant_in_worker, variants, chunksize=chunksize)
+
+
+def load_alignment_cache(cache_path: str, fingerprint: str) -> VariantAlignments:
+    '''
+    Loads the cached alignments for a net. Returns an empty cache if the file is missing, unreadable
+    or was computed on a different net.
+
+    :param cache_path: The file path of the alignment cache.
+    :param fingerprint: The fingerprint of the net the alignments must belong to.
+    '''
+    try:
+        with open(cache_path, "rb") as file:
+            cache = pickle.load(file)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        # E.g. a cache pickled by an older version of the code
+        return {}
+
+    if cache.get("net") != fingerprint:
+        print("Alignment cache belongs to a different net, ignoring it")
+        return {}
+    return cache["alignments"]
+
+
+def save_alignment_cache(cache_path: str, fingerprint: str, alignments: VariantAlignments):
+    '''
+    Atomically writes the alignments of a net to the cache file. Every write goes through its own temporary file in
+    the same directory, so concurrent alignment runs on the same log do not overwrite each other's file.
+
+    :param cache_path: The file path of the alignment cache.
+    :param fingerprint: The fingerprint of the net the alignments belong to.
+    :param alignments: The alignments per variant.
+    '''
+    directory = os.path.dirname(cache_path) or "."
+    # The entry directory may have been evicted while the variants were aligned
+    os.makedirs(directory, exist_ok=True)
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(cache_path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "wb") as file:
+            pickle.dump({"net": fingerprint, "alignments": alignments}, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, cache_path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def align_variants(log: DataFrame, petri_net: tuple[PetriNet, Marking, Marking], cache_path: str | None = None, workers: int = 1) -> VariantAlignments:
+    '''
+    Aligns every unique variant of the log exactly once. Both replay passes look up the alignment of a
+    case by its variant instead of aligning the case again.
+    If a cache path is given, previously computed alignments on the same net are reused and newly
+    computed ones are written back.
+
+    :param log: The log DataFrame.
+    :param petri_net: The Petri net tuple.
+    :param cache_path: The file path of the alignment cache, or None to disable persistence.
+    :param workers: The number of processes used to align the variants that are not cached.
+    '''
+    fingerprint = net_fingerprint(petri_net)
+    cached_alignments = load_alignment_cache(cache_path, fingerprint) if cache_path else {}
+
+    variants = get_variants(log)
+    missing_variants = [variant for variant in variants if variant not in cached_alignments]
+    print(f"Variants: {len(variants)}, cached alignments: {len(variants) - len(missing_variants)}")
+
+    alignments: VariantAlignments = {variant: cached_alignments[variant] for variant in variants if variant in cached_alignments}
+    for variant, alignment in zip(missing_variants, align_variants_in_parallel(missing_variants, petri_net, workers)):
+        alignments[variant] = alignment
+
+    if cache_path and missing_variants:
+        save_alignment_cache(cache_path, fingerprint, {**cached_alignments, **alignments})
+
+    return alignments
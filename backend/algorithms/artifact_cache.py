@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+# Artifacts are stored per log content hash: artifacts/<log hash>/<artifact name>
+ARTIFACT_DIRECTORY = os.environ.get("TRANSLUCIFY_ARTIFACT_DIRECTORY", "artifacts")
+# Least recently used entries are evicted once the cache grows beyond this size
+MAX_ARTIFACT_CACHE_BYTES = int(os.environ.get("TRANSLUCIFY_ARTIFACT_CACHE_MAX_BYTES", 5 * 1024 ** 3))
+# Entries used more recently than this are not evicted, since another task may still be reading them
+MIN_EVICTION_AGE_SECONDS = int(os.environ.get("TRANSLUCIFY_ARTIFACT_MIN_EVICTION_AGE", 300))
+
+PETRI_NET_ARTIFACT = "petri_net.pkl"
+ALIGNMENTS_ARTIFACT = "alignments.pkl"
+METADATA_FILE = "metadata.json"
+
+# Content hash of every log file hashed by this process, with the size and modification time it was computed for
+_content_hashes: dict[str, tuple[tuple[int, int], str]] = {}
+
+
+def log_content_hash(log_filepath: str, column_mapping: dict[str, str] | None = None) -> str:
+    '''
+    Hashes the content of a log file, so artifacts stay valid when the log is renamed and become invalid
+    when its content changes. The hash is only recomputed when the size or modification time of the file changed.
+
+    :param log_filepath: The file path of the log file.
+    :param column_mapping: The column mapping the log is read with, which changes the log as much as its content does.
+    '''
+    stat = os.stat(log_filepath)
+    signature = (stat.st_size, stat.st_mtime_ns)
+    known = _content_hashes.get(log_filepath)
+    if known is not None and known[0] == signature:
+        file_hash = known[1]
+    else:
+        content_hash = hashlib.sha256()
+        with open(log_filepath, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                content_hash.update(chunk)
+        file_hash = content_hash.hexdigest()
+        _content_hashes[log_filepath] = (signature, file_hash)
+
+    if not column_mapping:
+        return file_hash
+    return hashlib.sha256((file_hash + json.dumps(column_mapping, sort_keys=True)).encode()).hexdigest()
+
+
+def models_artifact_name(data_columns: list[dict[str]], method: str, evaluate: bool = True) -> str:
+    '''
+    Returns the artifact name of the models trained on the given data columns with the given method.
+
+    :param data_columns: The selected data columns and their types.
+    :param method: The regression method.
+    :param evaluate: Whether the held-out accuracy of the models was computed, models without it are stored separately.
+    '''
+    configuration = json.dumps({"columns": sorted(data_columns, key=lambda data_column: data_column["column"]), "method": method, "evaluate": evaluate}, sort_keys=True)
+    return f"models_{hashlib.sha256(configuration.encode()).hexdigest()[:16]}.pkl"
+
+
+def prefix_automaton_artifact_name(options: dict, encoding: str | None = None) -> str:
+    '''
+    Returns the artifact name of a prefix automaton built with the given options, either of the automaton itself
+    or of its gzip-compressed JSON encoding.
+
+    :param options: The options of the automaton, e.g. its bounds.
+    :param encoding: The encoding, e.g. "react_flow" or "compact", or None for the automaton itself.
+    '''
+    configuration = hashlib.sha256(json.dumps(options, sort_keys=True).encode()).hexdigest()[:16]
+    if encoding is None:
+        return f"prefix_automaton_{configuration}.pkl"
+    return f"prefix_automaton_{encoding}_{configuration}.json.gz"
+
+
+def artifact_path(log_hash: str, name: str, log_filepath: str | None = None) -> str:
+    '''
+    Returns the path of an artifact and creates its entry directory if necessary.
+
+    :param log_hash: The content hash of the log.
+    :param name: The name of the artifact.
+    :param log_filepath: The file path of the log, recorded in the metadata of new entries.
+    '''
+    entry_directory = os.path.join(ARTIFACT_DIRECTORY, log_hash)
+    if not os.path.isdir(entry_directory):
+        os.makedirs(entry_directory, exist_ok=True)
+        with open(os.path.join(entry_directory, METADATA_FILE), "w") as file:
+            json.dump({"log_file_path": log_filepath, "created": time.time()}, file)
+    return os.path.join(entry_directory, name)
+
+
+def touch_entry(log_hash: str):
+    # The modification time of the entry directory tracks when it was last used
+    entry_directory = os.path.join(ARTIFACT_DIRECTORY, log_hash)
+    if os.path.isdir(entry_directory):
+        os.utime(entry_directory)
+
+
+def load_artifact(log_hash: str, name: str):
+    '''
+    Loads an artifact. Returns None if it does not exist or cannot be read, e.g. because it was pickled by an older
+    version of the code whose classes were moved or removed since.
+
+    :param log_hash: The content hash of the log.
+    :param name: The name of the artifact.
+    '''
+    try:
+        with open(os.path.join(ARTIFACT_DIRECTORY, log_hash, name), "rb") as file:
+            artifact = pickle.load(file)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError, AttributeError, ImportError) as error:
+        if not isinstance(error, FileNotFoundError):
+            print(f"Could not load artifact {name} of log {log_hash[:12]}: {error!r}")
+        return None
+    touch_entry(log_hash)
+    print(f"Loaded artifact {name} of log {log_hash[:12]}")
+    return artifact
+
+
+def save_artifact(log_hash: str, name: str, artifact, log_filepath: str | None = None):
+    '''
+    Atomically stores an artifact and evicts old entries if the cache became too large. Every write goes through its
+    own temporary file, so tasks that store the same artifact at the same time do not overwrite each other's file.
+
+    :param log_hash: The content hash of the log.
+    :param name: The name of the artifact.
+    :param artifact: The picklable artifact.
+    :param log_filepath: The file path of the log, recorded in the metadata of new entries.
+    '''
+    path = artifact_path(log_hash, name, log_filepath)
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=name + ".", suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "wb") as file:
+            pickle.dump(artifact, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+    touch_entry(log_hash)
+    evict_artifacts(keep=log_hash)
+
+
+def directory_size(directory: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(directory) for file in files)
+
+
+def list_artifacts() -> list[dict]:
+    '''
+    Lists all cache entries, most recently used first.
+    '''
+    if not os.path.isdir(ARTIFACT_DIRECTORY):
+        return []
+
+    entries = []
+    for log_hash in os.listdir(ARTIFACT_DIRECTORY):
+        entry_directory = os.path.join(ARTIFACT_DIRECTORY, log_hash)
+        if not os.path.isdir(entry_directory):
+            continue
+        try:
+            with open(os.path.join(entry_directory, METADATA_FILE)) as file:
+                metadata = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            metadata = {}
+        entries.append({
+            "key": log_hash,
+            "log_file_path": metadata.get("log_file_path"),
+            "artifacts": sorted(name for name in os.listdir(entry_directory) if name != METADATA_FILE),
+            "size": directory_size(entry_directory),
+            "last_used": os.path.getmtime(entry_directory),
+        })
+    return sorted(entries, key=lambda entry: entry["last_used"], reverse=True)
+
+
+def purge_artifacts(log_hash: str | None = None) -> int:
+    '''
+    Deletes one cache entry, or all of them. Returns the number of deleted entries.
+
+    :param log_hash: The content hash of the log whose artifacts are deleted, or None to delete everything.
+    '''
+    log_hashes = [log_hash] if log_hash else [entry["key"] for entry in list_artifacts()]
+    deleted = 0
+    for key in log_hashes:
+        entry_directory = os.path.join(ARTIFACT_DIRECTORY, os.path.basename(key))
+        if os.path.isdir(entry_directory):
+            shutil.rmtree(entry_directory, ignore_errors=True)
+            deleted += 1
+    return deleted
+
+
+def evict_artifacts(max_bytes: int = MAX_ARTIFACT_CACHE_BYTES, keep: str | None = None, min_age: float = MIN_EVICTION_AGE_SECONDS):
+    '''
+    Deletes the least recently used entries until the cache fits into the size limit. Entries used within the last
+    min_age seconds are kept, even if the cache stays too large, since a running task may still read them.
+
+    :param max_bytes: The maximum total size of the cache.
+    :param keep: The content hash of an entry that must not be evicted, e.g. the one currently in use.
+    :param min_age: The number of seconds since the last use after which an entry may be evicted.
+    '''
+    entries = list_artifacts()
+    total_size = sum(entry["size"] for entry in entries)
+    now = time.time()
+    for entry in reversed(entries):
+        if total_size <= max_bytes:
+            break
+        if entry["key"] == keep or now - entry["last_used"] < min_age:
+            continue
+        print(f"Evicting artifacts of log {entry['key'][:12]} ({entry['size']} bytes)")
+        purge_artifacts(entry["key"])
+        total_size -= entry["size"]
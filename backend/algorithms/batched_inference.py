@@ -0,0 +1,81 @@
+from collections import defaultdict
+from typing import Hashable
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+
+# A trained classifier, or 1 if the transition could not be trained because it always fires
+Model = LogisticRegression | RandomForestClassifier | int
+# Rows of the feature matrix at which a group of transitions is enabled, e.g. all events in one marking
+EnabledRows = dict[Hashable, tuple[np.ndarray, list[Hashable]]]
+
+
+def positive_class_probabilities(model: Model, X: np.ndarray) -> np.ndarray:
+    '''
+    Returns the probability of the positive class ("transition fires") for every row of X.
+    Models that were not trained, or that only saw one class, predict a probability of 1.
+
+    :param model: The trained model of a transition.
+    :param X: The feature matrix.
+    '''
+    if not hasattr(model, "predict_proba"):
+        return np.ones(len(X))
+
+    probabilities = model.predict_proba(X)
+    if probabilities.shape[1] == 1:
+        return np.ones(len(X))
+    return probabilities[:, 1]
+
+
+def class_probabilities(model: Model, X: np.ndarray, classes: list[int]) -> np.ndarray:
+    '''
+    Returns the probability of each of the given classes for every row of X, e.g. of every outgoing transition of a
+    state for a multiclass model. Classes the model has not seen get a probability of 0.
+    A model that is an int always predicts that class.
+
+    :param model: The trained multiclass model, or the only class.
+    :param X: The feature matrix.
+    :param classes: The classes in the order of the returned columns.
+    '''
+    probabilities = np.zeros((len(X), len(classes)))
+    column_of_class = {label: column for column, label in enumerate(classes)}
+    if not hasattr(model, "predict_proba"):
+        if model in column_of_class:
+            probabilities[:, column_of_class[model]] = 1
+        return probabilities
+
+    model_probabilities = model.predict_proba(X)
+    for model_column, label in enumerate(model.classes_.tolist()):
+        if label in column_of_class:
+            probabilities[:, column_of_class[label]] = model_probabilities[:, model_column]
+    return probabilities
+
+
+def predict_enabled_probabilities(enabled_rows: EnabledRows, models: dict[Hashable, Model], X: np.ndarray) -> dict[Hashable, np.ndarray]:
+    '''
+    Computes the firing probabilities of all enabled transitions with a single inference call per model.
+    The requests of all groups are stacked per transition, predicted at once and scattered back.
+    e.g.: {marking: (rows, [t1, t2])} -> {marking: matrix of shape (len(rows), 2)}
+
+    :param enabled_rows: The feature rows and the enabled transitions of every group.
+    :param models: The trained model of every transition.
+    :param X: The feature matrix of the whole log.
+    '''
+    probabilities = {key: np.empty((len(rows), len(transitions))) for key, (rows, transitions) in enabled_rows.items()}
+
+    # Collect, for every transition, all groups (and the column within the group) in which it is enabled
+    requests: dict[Hashable, list[tuple[Hashable, int, np.ndarray]]] = defaultdict(list)
+    for key, (rows, transitions) in enabled_rows.items():
+        for column, transition in enumerate(transitions):
+            requests[transition].append((key, column, rows))
+
+    for transition, transition_requests in requests.items():
+        stacked_rows = np.concatenate([rows for _, _, rows in transition_requests])
+        transition_probabilities = positive_class_probabilities(models[transition], X[stacked_rows])
+
+        offset = 0
+        for key, column, rows in transition_requests:
+            probabilities[key][:, column] = transition_probabilities[offset:offset + len(rows)]
+            offset += len(rows)
+
+    return probabilities
@@ -0,0 +1,190 @@
+from dataclasses import dataclass
+import numpy as np
+from pm4py.objects.petri_net.obj import PetriNet, Marking
+
+
+@dataclass
+class SilentClosure(object):
+    '''
+    The visible transitions reachable from a marking through silent transitions, in compact array form.
+    The closure is a tree: every node is a marking reached by a silent path, every path ends in a visible transition.
+    Nodes and paths are stored as flat arrays with offsets, columns refer to the entries of `transitions`.
+    '''
+    # Transition IDs whose probabilities are needed, one column each
+    transitions: np.ndarray
+    # Columns enabled at each node: node_columns[node_offsets[n]:node_offsets[n + 1]]
+    node_columns: np.ndarray
+    node_offsets: np.ndarray
+    # (node, column) of each step of each path: steps path_offsets[p] to path_offsets[p + 1]
+    step_nodes: np.ndarray
+    step_columns: np.ndarray
+    path_offsets: np.ndarray
+    # Paths grouped by the label of their visible transition: paths label_offsets[l] to label_offsets[l + 1]
+    labels: list[str]
+    label_offsets: np.ndarray
+
+    def label_probabilities(self, probabilities: np.ndarray) -> np.ndarray:
+        '''
+        Returns, for every row and every label, the highest probability of a path ending in that label. The probability
+        of a path is the product of the normalized firing probabilities along it.
+
+        :param probabilities: The firing probabilities of shape (rows, len(transitions)).
+        '''
+        if not self.labels:
+            return np.zeros((len(probabilities), 0))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            node_sums = np.add.reduceat(probabilities[:, self.node_columns], self.node_offsets[:-1], axis=1)
+            step_probabilities = probabilities[:, self.step_columns] / node_sums[:, self.step_nodes]
+        path_probabilities = np.multiply.reduceat(step_probabilities, self.path_offsets[:-1], axis=1)
+        return np.fmax.reduceat(path_probabilities, self.label_offsets[:-1], axis=1)
+
+
+class CompiledPetriNet(object):
+    '''
+    Integer-indexed replay structure of a Petri net.
+    Transitions and places are numbered, markings are interned as count vectors and receive an integer ID the first
+    time they are reached. The enabled transitions of a marking and the successor marking of every
+    (marking, transition) pair are computed lazily and memoized, so replay turns into array and dict lookups.
+    The structure is picklable and can be cached together with the discovered net.
+    '''
+
+    def __init__(self, petri_net: tuple[PetriNet, Marking, Marking]):
+        net, im, fm = petri_net
+
+        self.transitions: list[PetriNet.Transition] = sorted(net.transitions, key=lambda transition: transition.name)
+        self.transition_index: dict[str, int] = {transition.name: index for index, transition in enumerate(self.transitions)}
+        self.labels: list[str | None] = [transition.label for transition in self.transitions]
+        self.is_silent: np.ndarray = np.array([label is None for label in self.labels], dtype=bool)
+
+        self.places: list[PetriNet.Place] = sorted(net.places, key=lambda place: place.name)
+        place_index = {place: index for index, place in enumerate(self.places)}
+
+        # Token demand (pre) and token production (post) of every transition
+        self._pre = np.zeros((len(self.transitions), len(self.places)), dtype=np.int64)
+        self._post = np.zeros((len(self.transitions), len(self.places)), dtype=np.int64)
+        for index, transition in enumerate(self.transitions):
+            for arc in transition.in_arcs:
+                self._pre[index, place_index[arc.source]] += arc.weight
+            for arc in transition.out_arcs:
+                self._post[index, place_index[arc.target]] += arc.weight
+
+        self._markings: list[tuple[int, ...]] = []
+        self._marking_ids: dict[tuple[int, ...], int] = {}
+        self._enabled: list[np.ndarray | None] = []
+        self._successors: list[dict[int, int]] = []
+        self._closures: dict[int, SilentClosure] = {}
+
+        self.initial_marking: int = self._intern(self._to_vector(im, place_index))
+        self.final_marking: int = self._intern(self._to_vector(fm, place_index))
+
+    def _to_vector(self, marking: Marking, place_index: dict[PetriNet.Place, int]) -> tuple[int, ...]:
+        vector = [0] * len(self.places)
+        for place, count in marking.items():
+            vector[place_index[place]] = count
+        return tuple(vector)
+
+    def _intern(self, vector: tuple[int, ...]) -> int:
+        marking_id = self._marking_ids.get(vector)
+        if marking_id is None:
+            marking_id = len(self._markings)
+            self._marking_ids[vector] = marking_id
+            self._markings.append(vector)
+            self._enabled.append(None)
+            self._successors.append({})
+        return marking_id
+
+    @property
+    def number_of_markings(self) -> int:
+        return len(self._markings)
+
+    def transition_id(self, transition_name: str) -> int:
+        return self.transition_index[transition_name]
+
+    def enabled_transitions(self, marking_id: int) -> np.ndarray:
+        '''
+        Returns the IDs of the transitions that are enabled in a marking.
+
+        :param marking_id: The ID of the marking.
+        '''
+        enabled = self._enabled[marking_id]
+        if enabled is None:
+            vector = np.array(self._markings[marking_id], dtype=np.int64)
+            enabled = np.flatnonzero(np.all(self._pre <= vector, axis=1))
+            self._enabled[marking_id] = enabled
+        return enabled
+
+    def fire(self, marking_id: int, transition_id: int) -> int:
+        '''
+        Returns the ID of the marking reached by firing a transition in a marking.
+
+        :param marking_id: The ID of the marking.
+        :param transition_id: The ID of the (enabled) transition.
+        '''
+        successors = self._successors[marking_id]
+        successor_id = successors.get(transition_id)
+        if successor_id is None:
+            vector = np.array(self._markings[marking_id], dtype=np.int64) - self._pre[transition_id] + self._post[transition_id]
+            successor_id = self._intern(tuple(vector.tolist()))
+            successors[transition_id] = successor_id
+        return successor_id
+
+    def marking(self, marking_id: int) -> Marking:
+        '''
+        Converts a marking ID back into a pm4py Marking.
+
+        :param marking_id: The ID of the marking.
+        '''
+        return Marking({self.places[index]: count for index, count in enumerate(self._markings[marking_id]) if count > 0})
+
+    def silent_closure(self, marking_id: int) -> SilentClosure:
+        '''
+        Returns the (memoized) silent closure of a marking.
+
+        :param marking_id: The ID of the marking.
+        '''
+        closure = self._closures.get(marking_id)
+        if closure is None:
+            closure = self._build_silent_closure(marking_id)
+            self._closures[marking_id] = closure
+        return closure
+
+    def _build_silent_closure(self, marking_id: int) -> SilentClosure:
+        columns: dict[int, int] = {}
+        node_columns: list[list[int]] = []
+        paths: list[tuple[str, list[int], list[int]]] = []
+
+        def expand(current_marking: int, step_nodes: list[int], step_columns: list[int], visited_markings: set[int]):
+            node = len(node_columns)
+            enabled_transitions = self.enabled_transitions(current_marking).tolist()
+            node_columns.append([columns.setdefault(transition, len(columns)) for transition in enabled_transitions])
+
+            for transition in enabled_transitions:
+                path_nodes, path_columns = step_nodes + [node], step_columns + [columns[transition]]
+                if not self.is_silent[transition]:
+                    paths.append((self.labels[transition], path_nodes, path_columns))
+                    continue
+                # A silent path that reaches a dead marking (or loops back) does not enable any activity
+                next_marking = self.fire(current_marking, transition)
+                if next_marking not in visited_markings and len(self.enabled_transitions(next_marking)) > 0:
+                    expand(next_marking, path_nodes, path_columns, visited_markings | {next_marking})
+
+        if len(self.enabled_transitions(marking_id)) > 0:
+            expand(marking_id, [], [], {marking_id})
+
+        paths.sort(key=lambda path: (path[0].lower(), path[0]))
+        labels = list(dict.fromkeys(label for label, _, _ in paths))
+        label_starts = {}
+        for index, (label, _, _) in enumerate(paths):
+            label_starts.setdefault(label, index)
+
+        return SilentClosure(
+            transitions=np.array(list(columns), dtype=np.int64),
+            node_columns=np.array([column for node in node_columns for column in node], dtype=np.int64),
+            node_offsets=np.cumsum([0] + [len(node) for node in node_columns], dtype=np.int64),
+            step_nodes=np.array([node for _, nodes, _ in paths for node in nodes], dtype=np.int64),
+            step_columns=np.array([column for _, _, path_columns in paths for column in path_columns], dtype=np.int64),
+            path_offsets=np.cumsum([0] + [len(nodes) for _, nodes, _ in paths], dtype=np.int64),
+            labels=labels,
+            label_offsets=np.array([label_starts[label] for label in labels] + [len(paths)], dtype=np.int64),
+        )
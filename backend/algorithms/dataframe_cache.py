@@ -0,0 +1,130 @@
+from collections import OrderedDict
+import os
+import threading
+import pandas
+
+# Least recently used frames are evicted once the cached frames take more memory than this
+MAX_DATAFRAME_CACHE_BYTES = int(os.environ.get("TRANSLUCIFY_DATAFRAME_CACHE_MAX_BYTES", 1024 ** 3))
+
+# (file path, size, modification time, variant, e.g. the column mapping, columns or None for all columns)
+CacheKey = tuple[str, int, int, str | None, tuple[str, ...] | None]
+
+
+def freeze(frame: pandas.DataFrame):
+    # Marks the arrays of the columns read-only, so in-place writes into a shared frame raise instead of corrupting it.
+    # Object arrays stay writable, several pandas routines (e.g. memory_usage) cannot read read-only object arrays.
+    for block in frame._mgr.blocks:
+        values = block.values
+        for array in (values, getattr(values, "_ndarray", None), getattr(values, "_codes", None)):
+            if array is not None and hasattr(array, "flags") and array.dtype != object:
+                array.flags.writeable = False
+
+
+class DataFrameCache(object):
+    '''
+    Process-wide cache of parsed logs, keyed by file path, size and modification time of the file, so a changed
+    file is never served from the cache, and by the variant the file was parsed as, e.g. its column mapping. Frames are evicted least recently used first once their total memory
+    usage exceeds the budget.
+    Callers get shallow copies over read-only arrays: they can add, replace and drop columns, but writing values in
+    place (e.g. with .loc) raises a ValueError instead of changing the cached frame. The typed logs keep case IDs,
+    activities, timestamps and numbers in such arrays. Object columns (e.g. other string columns) are not protected,
+    writing them in place changes the cached frame.
+    Projections to some columns are cached as frozen entries of their own, so they are copied out of the frame with
+    all columns only once.
+    '''
+
+    def __init__(self, max_bytes: int = MAX_DATAFRAME_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[CacheKey, tuple[pandas.DataFrame, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(file_path: str, columns: list[str] | None = None, variant: str | None = None) -> CacheKey:
+        stat = os.stat(file_path)
+        return (file_path, stat.st_size, stat.st_mtime_ns, variant, None if columns is None else tuple(columns))
+
+    def get(self, key: CacheKey) -> pandas.DataFrame | None:
+        '''
+        Returns a read-only view of a cached frame, or None on a miss. A projection that is not cached yet is taken
+        from the cached frame with all columns and cached itself.
+
+        :param key: The cache key.
+        '''
+        full_entry = None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and key[4] is not None:
+                full_entry = self._entries.get(key[:4] + (None,))
+                if full_entry is not None:
+                    self._entries.move_to_end(key[:4] + (None,))
+            elif entry is not None:
+                self._entries.move_to_end(key)
+
+            if entry is None and full_entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        if entry is None:
+            # Selecting columns copies them, the copy is frozen like every cached frame
+            return self.put(key, full_entry[0][list(key[4])])
+        return entry[0].copy(deep=False)
+
+    def put(self, key: CacheKey, frame: pandas.DataFrame) -> pandas.DataFrame:
+        '''
+        Caches a frame and returns a read-only view of it. Older versions and other variants of the same file are
+        dropped, and frames larger than the whole budget are not cached.
+
+        :param key: The cache key.
+        :param frame: The parsed log.
+        '''
+        size = int(frame.memory_usage(index=True, deep=True).sum())
+        freeze(frame)
+        with self._lock:
+            for stale_key in [cached_key for cached_key in self._entries if cached_key[0] == key[0] and cached_key[1:4] != key[1:4]]:
+                del self._entries[stale_key]
+            if size <= self.max_bytes:
+                self._entries[key] = (frame, size)
+                self._entries.move_to_end(key)
+                self._evict()
+        return frame.copy(deep=False)
+
+    def _evict(self):
+        total_size = sum(size for _, size in self._entries.values())
+        while total_size > self.max_bytes and len(self._entries) > 1:
+            evicted_key, (_, size) = self._entries.popitem(last=False)
+            total_size -= size
+            self.evictions += 1
+            print(f"Evicted {evicted_key[0]} from the dataframe cache ({size} bytes)")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        '''
+        Returns the hit and miss counts and the cached frames, most recently used first.
+        '''
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "evictions": self.evictions,
+                "bytes": sum(size for _, size in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "entries": [{
+                    "file_path": file_path,
+                    "variant": variant,
+                    "columns": None if columns is None else list(columns),
+                    "bytes": size,
+                } for (file_path, _, _, variant, columns), (_, size) in reversed(self._entries.items())],
+            }
+
+
+# Shared by all requests and tasks of this process
+dataframe_cache = DataFrameCache()
@@ -0,0 +1,100 @@
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+ACTIVITY_COLUMN = "concept:name"
+CASE_COLUMN = "case:concept:name"
+
+# Counts are returned as dense arrays or, for large alphabets, as sparse row-compressed matrices
+CountMatrix = np.ndarray | sparse.csr_matrix
+
+
+@dataclass
+class DirectlyFollowsStatistics(object):
+    '''
+    Directly-follows counts of a log over integer activity codes.
+    Activities are coded in order of first appearance and cases in sorted order, like log[...].unique() and
+    log.groupby(...) label them.
+    e.g.: directly_follows[a, b] = 2 means that activity a is directly followed by activity b twice.
+    '''
+    activities: list[str]
+    cases: list
+    # Activity code of every event, in log order
+    activity_codes: np.ndarray
+    # Number of times each activity is directly followed by each activity, activities x activities
+    directly_follows: CountMatrix
+    # Number of cases that start and end with each activity
+    start_counts: np.ndarray
+    end_counts: np.ndarray
+    # Number of occurrences of each activity in each case, cases x activities
+    case_activity_counts: CountMatrix
+
+    @property
+    def start_activities(self) -> set[str]:
+        return {self.activities[code] for code in np.flatnonzero(self.start_counts)}
+
+    @property
+    def end_activities(self) -> set[str]:
+        return {self.activities[code] for code in np.flatnonzero(self.end_counts)}
+
+    def directly_follows_table(self) -> pd.DataFrame:
+        '''
+        Returns the directly-follows counts as a table labelled with the activities on both axes.
+        '''
+        counts = self.directly_follows.toarray() if sparse.issparse(self.directly_follows) else self.directly_follows
+        return pd.DataFrame(counts, self.activities, self.activities)
+
+    def case_activity_table(self) -> pd.DataFrame:
+        '''
+        Returns the activity counts per case as a table labelled with the cases and activities.
+        '''
+        counts = self.case_activity_counts.toarray() if sparse.issparse(self.case_activity_counts) else self.case_activity_counts
+        return pd.DataFrame(counts, self.cases, self.activities)
+
+    def max_occurrences(self) -> np.ndarray:
+        '''
+        Returns the maximum number of occurrences of each activity in a single case.
+        '''
+        if sparse.issparse(self.case_activity_counts):
+            return self.case_activity_counts.max(axis=0).toarray().ravel()
+        return self.case_activity_counts.max(axis=0, initial=0)
+
+
+def count_matrix(rows: np.ndarray, columns: np.ndarray, shape: tuple[int, int], sparse_output: bool) -> CountMatrix:
+    # Counts how many times each (row, column) pair occurs
+    if sparse_output:
+        return sparse.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, columns)), shape=shape)
+    return np.bincount(rows * shape[1] + columns, minlength=shape[0] * shape[1]).reshape(shape)
+
+
+def directly_follows_statistics(log: pd.DataFrame, sparse_output: bool = False, case_column=CASE_COLUMN, activity_column=ACTIVITY_COLUMN) -> DirectlyFollowsStatistics:
+    '''
+    Computes the directly-follows matrix, the start and end activities and the activity counts per case in one pass:
+    the activities are encoded as integers, the events are ordered by case (keeping their order within each case)
+    and every event is paired with the next one if both belong to the same case.
+
+    :param log: The event log.
+    :param sparse_output: Whether the matrices are returned as sparse matrices, e.g. for large alphabets.
+    :param case_column: The case ID column.
+    :param activity_column: The activity column.
+    '''
+    activity_codes, activities = pd.factorize(log[activity_column], sort=False)
+    case_codes, cases = pd.factorize(log[case_column], sort=True)
+    order = np.argsort(case_codes, kind="stable")
+    codes, case_codes = activity_codes[order].astype(np.int64), case_codes[order].astype(np.int64)
+
+    same_case = case_codes[1:] == case_codes[:-1]
+    case_starts = np.concatenate([[True], ~same_case]) if len(codes) else np.zeros(0, dtype=bool)
+    case_ends = np.concatenate([~same_case, [True]]) if len(codes) else np.zeros(0, dtype=bool)
+    number_of_activities = len(activities)
+
+    return DirectlyFollowsStatistics(
+        activities=activities.tolist(),
+        cases=cases.tolist(),
+        activity_codes=activity_codes.astype(np.int64),
+        directly_follows=count_matrix(codes[:-1][same_case], codes[1:][same_case], (number_of_activities, number_of_activities), sparse_output),
+        start_counts=np.bincount(codes[case_starts], minlength=number_of_activities),
+        end_counts=np.bincount(codes[case_ends], minlength=number_of_activities),
+        case_activity_counts=count_matrix(case_codes, codes, (len(cases), number_of_activities), sparse_output),
+    )
@@ -0,0 +1,106 @@
+import os
+from dataclasses import dataclass
+import numpy as np
+
+# Activity sets are encoded as bitmasks when the vocabulary is small enough to fit into an int64
+MAX_BITMASK_ACTIVITIES = 62
+
+
+def probabilities_path(translucent_log_filepath: str) -> str:
+    '''
+    Returns the path of the probabilities that belong to a translucent log file. They are stored next to the log.
+
+    :param translucent_log_filepath: The file path of the translucent log.
+    '''
+    base_name, _ = os.path.splitext(translucent_log_filepath)
+    return base_name + "_probabilities.npz"
+
+
+@dataclass
+class EnabledProbabilities(object):
+    '''
+    Normalized probability of every activity that can be enabled at every event, independent of a threshold.
+    Stored as a sparse row-compressed matrix: the entries of event i are offsets[i] to offsets[i + 1].
+    Activity codes index into the activities, which are sorted case-insensitively, so enabled activity tuples come
+    out sorted the same way as in the translucent log.
+    '''
+    activities: list[str]
+    offsets: np.ndarray
+    activity_codes: np.ndarray
+    probabilities: np.ndarray
+
+    @property
+    def number_of_events(self) -> int:
+        return len(self.offsets) - 1
+
+    @classmethod
+    def from_blocks(cls, number_of_events: int, blocks: list[tuple[np.ndarray, list[str], np.ndarray]]) -> "EnabledProbabilities":
+        '''
+        Assembles the sparse matrix from blocks of events that share the same candidate activities,
+        e.g. all events decided in one marking.
+
+        :param number_of_events: The number of events of the log.
+        :param blocks: (rows, activities, probabilities of shape (len(rows), len(activities))) per block.
+        '''
+        activities = sorted({activity for _, block_activities, _ in blocks for activity in block_activities}, key=lambda activity: (activity.lower(), activity))
+        activity_index = {activity: code for code, activity in enumerate(activities)}
+
+        rows, codes, values = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int32)], [np.empty(0)]
+        for block_rows, block_activities, block_probabilities in blocks:
+            if len(block_activities) == 0:
+                continue
+            # Activities that cannot be enabled at any threshold are not stored
+            keep = block_probabilities > 0
+            row_index, column_index = np.nonzero(keep)
+            rows.append(np.asarray(block_rows, dtype=np.int64)[row_index])
+            codes.append(np.array([activity_index[activity] for activity in block_activities], dtype=np.int32)[column_index])
+            values.append(block_probabilities[keep])
+
+        rows, codes, values = np.concatenate(rows), np.concatenate(codes), np.concatenate(values)
+        order = np.lexsort((codes, rows))
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=number_of_events))])
+        return cls(activities, offsets, codes[order], values[order])
+
+    def enabled_activities(self, threshold: float) -> np.ndarray:
+        '''
+        Returns the tuple of enabled activities of every event for a threshold.
+        An activity is enabled if its probability is greater than the threshold.
+
+        :param threshold: The cutoff probability.
+        '''
+        enabled = self.probabilities > threshold
+        entry_events = np.repeat(np.arange(self.number_of_events), np.diff(self.offsets))
+        result = np.empty(self.number_of_events, dtype=object)
+
+        if len(self.activities) <= MAX_BITMASK_ACTIVITIES:
+            # Encode the enabled set of every event as a bitmask and build each distinct tuple only once
+            bitmasks = np.zeros(self.number_of_events, dtype=np.int64)
+            np.add.at(bitmasks, entry_events[enabled], np.left_shift(np.int64(1), self.activity_codes[enabled].astype(np.int64)))
+            unique_bitmasks, event_bitmask = np.unique(bitmasks, return_inverse=True)
+            choices = np.empty(len(unique_bitmasks), dtype=object)
+            for index, bitmask in enumerate(unique_bitmasks.tolist()):
+                choices[index] = tuple(activity for code, activity in enumerate(self.activities) if bitmask >> code & 1)
+            result[:] = choices[event_bitmask.reshape(-1)]
+            return result
+
+        enabled_codes = self.activity_codes[enabled]
+        enabled_offsets = np.concatenate([[0], np.cumsum(np.bincount(entry_events[enabled], minlength=self.number_of_events))])
+        for event in range(self.number_of_events):
+            result[event] = tuple(self.activities[code] for code in enabled_codes[enabled_offsets[event]:enabled_offsets[event + 1]])
+        return result
+
+    def sweep(self, thresholds: list[float]) -> dict[float, np.ndarray]:
+        '''
+        Returns the enabled activities of every event for each of the thresholds.
+
+        :param thresholds: The cutoff probabilities.
+        '''
+        return {threshold: self.enabled_activities(threshold) for threshold in thresholds}
+
+    def save(self, file_path: str):
+        np.savez_compressed(file_path, activities=np.array(self.activities, dtype=str), offsets=self.offsets, activity_codes=self.activity_codes, probabilities=self.probabilities)
+
+    @classmethod
+    def load(cls, file_path: str) -> "EnabledProbabilities":
+        with np.load(file_path) as data:
+            return cls(data["activities"].tolist(), data["offsets"], data["activity_codes"], data["probabilities"])
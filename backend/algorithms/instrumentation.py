@@ -0,0 +1,152 @@
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+import psutil
+
+# Upper bounds (in seconds) of the stage latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+# Interval (in seconds) at which the resident set size is sampled while a stage runs
+RSS_SAMPLE_INTERVAL = 0.1
+
+
+def cpu_time() -> float:
+    # CPU time of this process (all threads) and of its reaped children, e.g. the alignment worker processes
+    usage, children_usage = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime + children_usage.ru_utime + children_usage.ru_stime
+
+
+def current_rss() -> int:
+    # Resident set size of this process and of its running children, e.g. the alignment worker processes.
+    # Unlike ru_maxrss, which is the high-water mark of the whole lifetime of a (long-lived worker) process.
+    process = psutil.Process()
+    rss = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            rss += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return rss
+
+
+class RssSampler(object):
+    '''
+    Samples the resident set size in a background thread while it is entered, and keeps the highest sample.
+    Allocations that are freed again within one sampling interval can be missed.
+    '''
+
+    def __init__(self, interval: float = RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.start_rss = self.end_rss = self.max_rss = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            self.max_rss = max(self.max_rss, current_rss())
+
+    def __enter__(self) -> "RssSampler":
+        self.start_rss = self.max_rss = current_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+        self.end_rss = current_rss()
+        self.max_rss = max(self.max_rss, self.end_rss)
+
+
+class RunMetrics(object):
+    '''
+    Collects the metrics of one translucification run: wall time, CPU time, highest sampled RSS and RSS growth of
+    every stage, and item counts such as the number of cases, variants, transitions and observations.
+    e.g.: {"pipeline": "petri_net", "stages": [{"stage": "alignment", "wall_time": 1.2, ...}], "counts": {"cases": 100}}
+    '''
+
+    def __init__(self, pipeline: str):
+        self.pipeline = pipeline
+        self.stages: list[dict[str, float | int | str]] = []
+        self.counts: dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        '''
+        Measures a stage of the run. The RSS is sampled while the stage runs: max_rss is the highest sample and
+        rss_delta the difference between the RSS at the end and at the start of the stage.
+
+        :param name: The name of the stage.
+        '''
+        start_wall_time, start_cpu_time = time.perf_counter(), cpu_time()
+        sampler = RssSampler()
+        try:
+            with sampler:
+                yield
+        finally:
+            self.stages.append({
+                "stage": name,
+                "wall_time": time.perf_counter() - start_wall_time,
+                "cpu_time": cpu_time() - start_cpu_time,
+                "max_rss": sampler.max_rss,
+                "rss_delta": sampler.end_rss - sampler.start_rss,
+            })
+            print(f"Stage {name} took {self.stages[-1]['wall_time']:.3f}s")
+
+    def count(self, name: str, value: int):
+        '''
+        Records the number of items of a kind, e.g. count("variants", 18).
+
+        :param name: The kind of items.
+        :param value: The number of items.
+        '''
+        self.counts[name] = int(value)
+
+    def to_dict(self) -> dict:
+        return {
+            "pipeline": self.pipeline,
+            "stages": self.stages,
+            "counts": self.counts,
+            "wall_time": sum(stage["wall_time"] for stage in self.stages),
+            "cpu_time": sum(stage["cpu_time"] for stage in self.stages),
+            "max_rss": max((stage["max_rss"] for stage in self.stages), default=current_rss()),
+        }
+
+
+def format_prometheus_metrics(runs: list[dict]) -> str:
+    '''
+    Renders the stage latencies of all recorded runs as Prometheus histograms in the text exposition format.
+
+    :param runs: The metrics of every run, as returned by RunMetrics.to_dict.
+    '''
+    histograms: dict[tuple[str, str, str], list[float]] = {}
+    for run in runs:
+        for stage in run.get("stages", []):
+            for kind in ("wall_time", "cpu_time"):
+                histograms.setdefault((kind, run.get("pipeline", "unknown"), stage["stage"]), []).append(stage[kind])
+
+    lines = []
+    for kind, description in (("wall_time", "Wall time"), ("cpu_time", "CPU time")):
+        metric = f"translucify_stage_{kind}_seconds"
+        lines.append(f"# HELP {metric} {description} of the stages of translucification runs.")
+        lines.append(f"# TYPE {metric} histogram")
+        for (histogram_kind, pipeline, stage), values in sorted(histograms.items()):
+            if histogram_kind != kind:
+                continue
+            labels = f'pipeline="{pipeline}",stage="{stage}"'
+            for bucket in LATENCY_BUCKETS:
+                lines.append(f'{metric}_bucket{{{labels},le="{bucket}"}} {sum(value <= bucket for value in values)}')
+            lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {len(values)}')
+            lines.append(f"{metric}_sum{{{labels}}} {sum(values)}")
+            lines.append(f"{metric}_count{{{labels}}} {len(values)}")
+
+    metric = "translucify_run_max_rss_bytes"
+    lines.append(f"# HELP {metric} Highest resident set size sampled during the recorded runs per pipeline.")
+    lines.append(f"# TYPE {metric} gauge")
+    highest_max_rss: dict[str, int] = {}
+    for run in runs:
+        pipeline = run.get("pipeline", "unknown")
+        highest_max_rss[pipeline] = max(highest_max_rss.get(pipeline, 0), run.get("max_rss", 0))
+    for pipeline, value in sorted(highest_max_rss.items()):
+        lines.append(f'{metric}{{pipeline="{pipeline}"}} {value}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,121 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Hashable
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import train_test_split
+from .batched_inference import Model
+from .observation_store import ObservationStore
+
+METHODS = ("logistic_regression", "random_forest")
+# One binary model per transition, or one multiclass model per state over its outgoing transitions
+TRAINING_MODES = ("transition", "state")
+# Transitions are trained in batches of at least this many observations so that small models do not pay pool overhead
+MIN_BATCH_OBSERVATIONS = 5000
+
+
+def train_model(X: np.ndarray, labels: np.ndarray, method: str, evaluate: bool = True) -> tuple[Model, float | None]:
+    '''
+    Trains the model of a single transition. With evaluation, 20% of the observations are held out to compute the
+    accuracy, otherwise the model is trained on all observations and no accuracy is returned.
+
+    :param X: The data states at which the transition was enabled.
+    :param labels: Whether the transition fired.
+    :param method: The regression method: logistic_regression or random_forest.
+    :param evaluate: Whether to compute the held-out accuracy.
+    '''
+    Y = labels.astype(int)
+    try:
+        if evaluate:
+            X_train, X_test, Y_train, Y_test = train_test_split(X, Y, test_size=0.2)
+        else:
+            X_train, Y_train = X, Y
+
+        if method == "logistic_regression":
+            regression = LogisticRegression().fit(X_train, Y_train)
+        elif method == "random_forest":
+            regression = RandomForestClassifier().fit(X_train, Y_train)
+
+        return regression, regression.score(X_test, Y_test) if evaluate else None
+    except ValueError:
+        # Error if transition has a 100% change of firing. But there are some transitions that have 100% change of firing!
+        # => Set the regression model to 1
+        return 1, 1 if evaluate else None
+
+
+def batch_transitions(observation_instances: ObservationStore, min_batch_observations: int = MIN_BATCH_OBSERVATIONS) -> list[list[Hashable]]:
+    '''
+    Groups the transitions into training batches, largest transitions first. Transitions with many observations
+    form a batch of their own while small ones are packed together until the batch is large enough.
+
+    :param observation_instances: The observation instances of all transitions.
+    :param min_batch_observations: The minimum number of observations of a batch.
+    '''
+    transitions = sorted(observation_instances, key=lambda transition: len(observation_instances.rows(transition)), reverse=True)
+
+    batches: list[list[Hashable]] = []
+    batch, batch_observations = [], 0
+    for transition in transitions:
+        batch.append(transition)
+        batch_observations += len(observation_instances.rows(transition))
+        if batch_observations >= min_batch_observations:
+            batches.append(batch)
+            batch, batch_observations = [], 0
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def train_models(observation_instances: ObservationStore, method: str, workers: int = 1, evaluate: bool = True) -> tuple[dict[Hashable, Model], dict[Hashable, float]]:
+    '''
+    Trains one model per transition, spread over a thread pool. scikit-learn releases the GIL in its fitting code,
+    and threads share the feature matrix of the observation store instead of copying it into every worker.
+    Returns the models and, with evaluation, the held-out accuracy of every transition.
+
+    :param observation_instances: The observation instances of all transitions.
+    :param method: The regression method: logistic_regression or random_forest.
+    :param workers: The maximum number of models trained concurrently.
+    :param evaluate: Whether to compute the held-out accuracy of every model.
+    '''
+    if method not in METHODS:
+        raise ValueError(f"Invalid method {method}. Please provide a valid method: {', '.join(METHODS)}")
+
+    def train_batch(batch: list[Hashable]) -> list[tuple[Hashable, Model, float | None]]:
+        return [(transition, *train_model(*observation_instances.observations(transition), method, evaluate)) for transition in batch]
+
+    batches = batch_transitions(observation_instances)
+    print(f"Training {len(observation_instances)} models in {len(batches)} batches with {workers} workers")
+
+    if workers <= 1 or len(batches) <= 1:
+        results = map(train_batch, batches)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(train_batch, batches))
+
+    regression_models: dict[Hashable, Model] = {}
+    accuracy_scores: dict[Hashable, float] = {}
+    for batch_results in results:
+        for transition, regression, accuracy_score in batch_results:
+            regression_models[transition] = regression
+            if accuracy_score is not None:
+                accuracy_scores[transition] = accuracy_score
+
+    return regression_models, accuracy_scores
+
+
+def train_state_models(observation_instances: ObservationStore, method: str, workers: int = 1, evaluate: bool = True) -> tuple[dict[Hashable, Model], dict[Hashable, float]]:
+    '''
+    Trains one multiclass model per state, labelled with the transition that fired. Returns the models and, with
+    evaluation, the held-out accuracy of every state. A state whose model could not be trained (e.g. because only one
+    transition ever fired in it) gets its most frequent transition instead of a model.
+
+    :param observation_instances: The observation instances of all states, labelled with the fired transition.
+    :param method: The regression method: logistic_regression or random_forest.
+    :param workers: The maximum number of models trained concurrently.
+    :param evaluate: Whether to compute the held-out accuracy of every model.
+    '''
+    regression_models, accuracy_scores = train_models(observation_instances, method, workers, evaluate)
+    for state, regression in regression_models.items():
+        if not hasattr(regression, "predict_proba"):
+            regression_models[state] = int(np.bincount(observation_instances.labels(state)).argmax())
+    return regression_models, accuracy_scores
@@ -0,0 +1,80 @@
+from typing import Hashable, Iterable, Iterator
+import numpy as np
+
+
+class ObservationStore(object):
+    '''
+    Observation instances of all transitions over a single feature matrix of the whole log.
+    Each transition only keeps the row indices of the data states at which it was enabled and whether it fired,
+    the feature vectors themselves are gathered from the matrix with fancy indexing when a model is trained.
+    e.g.: {t1: (rows [0, 4, 7], labels [True, False, True])}
+    Labels can also be class IDs instead of booleans, e.g. the transition that fired in a state.
+    '''
+
+    def __init__(self, X: np.ndarray, transitions: Iterable[Hashable], label_dtype: type = bool):
+        self.X = X
+        self.label_dtype = label_dtype
+        self._row_chunks: dict[Hashable, list[np.ndarray]] = {transition: [] for transition in transitions}
+        self._label_chunks: dict[Hashable, list[np.ndarray]] = {transition: [] for transition in transitions}
+
+    def add(self, transition: Hashable, rows: np.ndarray, labels: np.ndarray | bool):
+        '''
+        Records that a transition was enabled at the given rows and whether it fired there.
+
+        :param transition: The enabled transition.
+        :param rows: The row indices of the data states.
+        :param labels: Whether the transition fired (or the class ID), per row or for all rows.
+        '''
+        self._row_chunks[transition].append(np.asarray(rows, dtype=np.int64))
+        self._label_chunks[transition].append(np.broadcast_to(np.asarray(labels, dtype=self.label_dtype), np.shape(rows)))
+
+    def _concatenate(self, transition: Hashable):
+        # Merge the recorded chunks into one array each, so repeated accesses are cheap
+        row_chunks, label_chunks = self._row_chunks[transition], self._label_chunks[transition]
+        if len(row_chunks) != 1:
+            self._row_chunks[transition] = [np.concatenate(row_chunks) if row_chunks else np.empty(0, dtype=np.int64)]
+            self._label_chunks[transition] = [np.concatenate(label_chunks) if label_chunks else np.empty(0, dtype=self.label_dtype)]
+
+    @property
+    def transitions(self) -> list[Hashable]:
+        return list(self._row_chunks)
+
+    def rows(self, transition: Hashable) -> np.ndarray:
+        self._concatenate(transition)
+        return self._row_chunks[transition][0]
+
+    def labels(self, transition: Hashable) -> np.ndarray:
+        self._concatenate(transition)
+        return self._label_chunks[transition][0]
+
+    def observations(self, transition: Hashable) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Gathers the feature matrix and the labels of a transition.
+
+        :param transition: The transition.
+        '''
+        return self.X[self.rows(transition)], self.labels(transition)
+
+    def subset(self, transitions: Iterable[Hashable]) -> "ObservationStore":
+        '''
+        Returns a store with the observation instances of the given transitions only, sharing the feature matrix.
+
+        :param transitions: The transitions to keep.
+        '''
+        store = ObservationStore(self.X, [], self.label_dtype)
+        for transition in transitions:
+            store._row_chunks[transition] = self._row_chunks[transition]
+            store._label_chunks[transition] = self._label_chunks[transition]
+        return store
+
+    def __len__(self) -> int:
+        return len(self._row_chunks)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(self._row_chunks)
+
+    def summary(self) -> list[tuple[Hashable, int, int]]:
+        '''
+        Returns the number of observations and the number of times it fired for every transition.
+        '''
+        return [(transition, len(self.rows(transition)), int(self.labels(transition).sum())) for transition in self]
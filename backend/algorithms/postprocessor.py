@@ -1,24 +1,47 @@
-from .transition_system import State, Transition, TransitionSystem
+import numpy as np
+from .transition_system import CompactTransitionSystem, TransitionSystem
 
+# Part of the artifact name of stored encodings, so encodings of an older shape are not served anymore
+ENCODING_VERSION = 2
 
-def encode_prefix_automaton(transition_system: TransitionSystem):
+
+def encode_prefix_automaton(transition_system: TransitionSystem | CompactTransitionSystem):
+    '''
+    Encodes a prefix automaton into the JSON shape of the frontend: every state lists the IDs of its incoming and
+    outgoing transitions, every transition the IDs of its states.
+
+    :param transition_system: The prefix automaton, as object graph or in compact form.
+    '''
+    if isinstance(transition_system, TransitionSystem):
+        transition_system = CompactTransitionSystem.from_transition_system(transition_system)
+
+    names = transition_system.names()
+    state_ids = [transition_system.state_id(state) for state in range(transition_system.number_of_states)]
+    transition_ids = [transition_system.transition_id(edge) for edge in range(transition_system.number_of_transitions)]
+    sources, targets = transition_system.edge_source.tolist(), transition_system.edge_target.tolist()
+
+    # Outgoing transitions are grouped by source state already, incoming ones are grouped by target state here
+    incoming: list[list[str]] = [[] for _ in range(transition_system.number_of_states)]
+    for edge, target in enumerate(targets):
+        incoming[target].append(transition_ids[edge])
+    offsets = transition_system.edge_offsets.tolist()
 
     result = {
         "states": [{
-            "id": state.id,  # Use the UUID instead of id()
-            "name": state.name,
-            "incoming": [transition.id for transition in state.incoming],  # Use UUIDs
-            "outgoing": [transition.id for transition in state.outgoing]   # Use UUIDs
-        } for state in transition_system.states],
+            "id": state_ids[state],
+            "name": names[state],
+            "incoming": incoming[state],
+            "outgoing": transition_ids[offsets[state]:offsets[state + 1]]
+        } for state in range(transition_system.number_of_states)],
         "transitions": [{
-            "id": transition.id,  # Use the UUID instead of id()
-            "name": transition.name,
-            "from_state": transition.from_state.id,  # Use UUIDs
-            "to_state": transition.to_state.id       # Use UUIDs
-        } for transition in transition_system.transitions],
+            "id": transition_ids[edge],
+            "name": transition_system.transition_name(edge),
+            "from_state": state_ids[sources[edge]],
+            "to_state": state_ids[targets[edge]]
+        } for edge in range(transition_system.number_of_transitions)],
     }
 
-    print("Result: ", result)
+    print(f"Encoded prefix automaton with {len(result['states'])} states and {len(result['transitions'])} transitions")
 
     return result
 
@@ -30,26 +53,216 @@ def encode_prefix_automaton(transition_system: TransitionSystem):
     #     "incoming": []
     # })
 
-def decode_prefix_automaton(states, transitions):
-    print("States: ", states)
-    print("Transitions: ", transitions)
-    prefix_automaton = TransitionSystem(name="prefix_automaton", states=set(), transitions=set())
-
-    # Add all states first
-    for state in states:
-        prefix_automaton.states.add(State(id=state["id"], name=state["name"], data={"frequency": 0}))
-
-    # Add all transitions
-    for transition in transitions:
-        from_state = next((state for state in prefix_automaton.states if state.id == transition["from_state"]), None)
-        to_state = next((state for state in prefix_automaton.states if state.id == transition["to_state"]), None)
-        new_transition = Transition(id=transition["id"], name=transition["name"], from_state=from_state, to_state=to_state)
-        prefix_automaton.transitions.add(new_transition)
-        from_state.outgoing.add(new_transition)
-        to_state.incoming.add(new_transition)
-    
-    print("Resulting prefix automaton: ", prefix_automaton)
+def encode_prefix_automaton_view(transition_system: CompactTransitionSystem, root: int | None = None, levels: int = 3, top_k: int | None = None, skip: int = 0) -> dict:
+    '''
+    Encodes part of a prefix automaton into the JSON shape of encode_prefix_automaton: the states up to the given
+    number of levels below the root, following only the top_k most frequent transitions out of every state.
+    The transitions that are left out of a state are collapsed into one placeholder state, which names the state
+    to expand next and how many of its most frequent transitions to skip there, so expanding it shows the hidden
+    transitions, e.g.: {"id": "s4/more", "name": "+3", "collapsed": True, "expand": "s4", "skip": 2, "transitions": 3, "frequency": 12}
+    States and transitions additionally carry their frequency, so the frontend can scale them.
+
+    :param transition_system: The prefix automaton in compact form.
+    :param root: The state the view starts at. The start state if not given.
+    :param levels: The number of levels below the root that are included.
+    :param top_k: The maximum number of transitions followed out of every state. All if not given.
+    :param skip: The number of most frequent transitions out of the root that are left out, e.g. because they were already shown.
+    '''
+    root = transition_system.start_state if root is None else root
+    offsets = transition_system.edge_offsets
+    visited, frontier = {root}, [root]
+    visible_states, visible_edges, collapsed = [root], [], []
+
+    for level in range(levels + 1):
+        next_frontier = []
+        for state in frontier:
+            edges = np.arange(offsets[state], offsets[state + 1])
+            if level == levels:
+                shown, hidden = edges[:0], edges
+            else:
+                # Most frequent first, ties in activity order
+                edges = edges[np.argsort(-transition_system.edge_frequency[edges], kind="stable")]
+                skipped = skip if level == 0 else 0
+                edges = edges[skipped:]
+                shown, hidden = (edges, edges[:0]) if top_k is None else (edges[:top_k], edges[top_k:])
+            for edge in shown.tolist():
+                visible_edges.append(edge)
+                target = int(transition_system.edge_target[edge])
+                if target not in visited:
+                    visited.add(target)
+                    visible_states.append(target)
+                    next_frontier.append(target)
+            if len(hidden):
+                collapsed.append((state, hidden, skipped + len(shown) if level < levels else 0))
+        frontier = next_frontier
+
+    incoming: dict[int, list[str]] = {state: [] for state in visible_states}
+    outgoing: dict[int, list[str]] = {state: [] for state in visible_states}
+    transitions = []
+    for edge in visible_edges:
+        source = int(np.searchsorted(offsets, edge, side="right") - 1)
+        target = int(transition_system.edge_target[edge])
+        transition_id = transition_system.transition_id(edge)
+        outgoing[source].append(transition_id)
+        incoming[target].append(transition_id)
+        transitions.append({
+            "id": transition_id,
+            "name": transition_system.transition_name(edge),
+            "from_state": transition_system.state_id(source),
+            "to_state": transition_system.state_id(target),
+            "frequency": int(transition_system.edge_frequency[edge]),
+        })
+
+    states = [{
+        "id": transition_system.state_id(state),
+        "name": transition_system.state_name(state),
+        "incoming": incoming[state],
+        "outgoing": outgoing[state],
+        "frequency": int(transition_system.state_frequency[state]),
+    } for state in visible_states]
+
+    for state, hidden, hidden_skip in collapsed:
+        state_id = transition_system.state_id(state)
+        placeholder_id, transition_id = state_id + "/more", state_id + "/more-transition"
+        frequency = int(transition_system.edge_frequency[hidden].sum())
+        outgoing[state].append(transition_id)
+        states.append({
+            "id": placeholder_id,
+            "name": f"+{len(hidden)}",
+            "incoming": [transition_id],
+            "outgoing": [],
+            "frequency": frequency,
+            "collapsed": True,
+            "expand": state_id,
+            "skip": hidden_skip,
+            "transitions": len(hidden),
+        })
+        transitions.append({"id": transition_id, "name": "...", "from_state": state_id, "to_state": placeholder_id, "frequency": frequency})
+
+    return {
+        "root": transition_system.state_id(root),
+        "states": states,
+        "transitions": transitions,
+        "number_of_states": transition_system.number_of_states,
+        "number_of_transitions": transition_system.number_of_transitions,
+    }
+
+
+def decode_prefix_automaton(states, transitions) -> CompactTransitionSystem:
+    '''
+    Decodes a prefix automaton from the JSON shape of the frontend into compact form.
+    The endpoints of every transition are looked up in an index of the state IDs, so decoding takes linear time.
+    The start state is the state named "<>".
+
+    :param states: The states with their IDs and names.
+    :param transitions: The transitions with their IDs, names and the IDs of their states.
+    '''
+    state_index = {state["id"]: index for index, state in enumerate(states)}
+    names = [state["name"] for state in states]
+
+    prefix_automaton = CompactTransitionSystem.from_edges(
+        "prefix_automaton",
+        len(states),
+        [state_index[transition["from_state"]] for transition in transitions],
+        [state_index[transition["to_state"]] for transition in transitions],
+        [transition["name"] for transition in transitions],
+        state_names=names,
+        state_ids=[state["id"] for state in states],
+        edge_ids=[transition["id"] for transition in transitions],
+        start_state=next((index for index, name in enumerate(names) if name == "<>"), 0),
+    )
+
+    print(f"Decoded prefix automaton with {prefix_automaton.number_of_states} states and {prefix_automaton.number_of_transitions} transitions")
     return prefix_automaton
+
+
+def is_prefix_tree(transition_system: CompactTransitionSystem) -> bool:
+    # A prefix tree has exactly one transition into every state but the start state, which comes from its parent
+    return (
+        transition_system.state_names is None
+        and transition_system.start_state == 0
+        and transition_system.number_of_transitions == transition_system.number_of_states - 1
+        and bool(np.all(transition_system.state_parent[transition_system.edge_target] == transition_system.edge_source))
+    )
+
+
+def encode_compact_prefix_automaton(transition_system: TransitionSystem | CompactTransitionSystem) -> dict:
+    '''
+    Encodes a prefix automaton into a compact JSON shape with integer IDs: the state and transition IDs are
+    positions in the arrays and activities are codes into the activity list.
+    Prefix trees are sent as parent-pointer arrays only, with the frequency of the transition into every state, e.g.:
+    {"format": "compact", "activities": ["a", "b"], "frequency": [2, 2, 1], "parent": [-1, 0, 1], "activity": [-1, 0, 1], "edge_frequency": [0, 2, 1]}
+    Other automata (e.g. after merging states) additionally carry the state names and the transitions as
+    "source", "target", "edge_activity" and "edge_frequency" arrays, since the frequency of a transition into a
+    merged state is not the frequency of that state.
+
+    :param transition_system: The prefix automaton, as object graph or in compact form.
+    '''
+    if isinstance(transition_system, TransitionSystem):
+        transition_system = CompactTransitionSystem.from_transition_system(transition_system)
+
+    result = {
+        "format": "compact",
+        "name": transition_system.name,
+        "activities": transition_system.activities,
+        "start": transition_system.start_state,
+        "frequency": transition_system.state_frequency.tolist(),
+    }
+    if is_prefix_tree(transition_system):
+        result["parent"] = transition_system.state_parent.tolist()
+        result["activity"] = transition_system.state_activity.tolist()
+        incoming_frequency = np.zeros(transition_system.number_of_states, dtype=np.int64)
+        incoming_frequency[transition_system.edge_target] = transition_system.edge_frequency
+        result["edge_frequency"] = incoming_frequency.tolist()
+    else:
+        result["names"] = transition_system.names()
+        result["source"] = transition_system.edge_source.tolist()
+        result["target"] = transition_system.edge_target.tolist()
+        result["edge_activity"] = transition_system.edge_activity.tolist()
+        result["edge_frequency"] = transition_system.edge_frequency.tolist()
+    return result
+
+
+def decode_compact_prefix_automaton(payload: dict) -> CompactTransitionSystem:
+    '''
+    Decodes a prefix automaton from the compact JSON shape of encode_compact_prefix_automaton.
+
+    :param payload: The compact prefix automaton.
+    '''
+    activities: list[str] = payload["activities"]
+    frequency = payload.get("frequency")
+    # Payloads without transition frequencies fall back to the frequency of the target state
+    edge_frequency = payload.get("edge_frequency")
+
+    if "parent" in payload:
+        parent = np.asarray(payload["parent"], dtype=np.int64)
+        activity = np.asarray(payload["activity"], dtype=np.int64)
+        children = np.flatnonzero(parent >= 0)
+        return CompactTransitionSystem.from_edges(
+            payload.get("name", "prefix_automaton"),
+            len(parent),
+            parent[children],
+            children,
+            [activities[code] for code in activity[children].tolist()],
+            state_frequency=frequency,
+            edge_frequency=None if edge_frequency is None else np.asarray(edge_frequency, dtype=np.int64)[children],
+            state_parent=parent,
+            state_activities=[activities[code] if code >= 0 else None for code in activity.tolist()],
+            start_state=payload.get("start", 0),
+        )
+
+    names: list[str] = payload["names"]
+    return CompactTransitionSystem.from_edges(
+        payload.get("name", "prefix_automaton"),
+        len(names),
+        payload["source"],
+        payload["target"],
+        [activities[code] for code in payload["edge_activity"]],
+        state_frequency=frequency,
+        edge_frequency=edge_frequency,
+        state_names=names,
+        start_state=payload.get("start", 0),
+    )
 
 
 
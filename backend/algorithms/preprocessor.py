@@ -1,7 +1,33 @@
+import csv
+import glob
+import hashlib
+import io
+import json
 import os
+import tempfile
+import numpy
 import pandas
 import pm4py
+import pyarrow.parquet
 import inquirer
+from pyarrow import ArrowException
+from pm4py.objects.log.util.dataframe_utils import convert_timestamp_columns_in_df
+from .dataframe_cache import dataframe_cache
+
+CASE_COLUMN = "case:concept:name"
+ACTIVITY_COLUMN = "concept:name"
+TIMESTAMP_COLUMN = "time:timestamp"
+
+# Original column of the case ID, activity and timestamp of a log, e.g. {"case:concept:name": "CaseID", ...}
+ColumnMapping = dict[str, str]
+
+# Version of the shape of mapped logs, see apply_column_mapping
+MAPPED_LOG_VERSION = 2
+# Index columns that pm4py.format_dataframe adds to a log
+PM4PY_INDEX_COLUMNS = ("@@index", "@@case_index")
+
+# Number of rows that are parsed to derive the columns of a mapped log
+SAMPLE_ROWS = 100
 
 def import_csv(file_path: str, separator=";") -> pandas.DataFrame:
 
@@ -75,10 +101,223 @@ def user_select_columns(dataframe) -> list[str]:
     # Return the DataFrame with only selected columns
     return answers['selected_columns']
 
-def fetch_dataframe(file_path: str, file_type: str) -> pandas.DataFrame:
+def sniff_csv_header(file_path: str, delimiter: str | None = None, sample_size: int = 64 * 1024) -> tuple[str, list[str]]:
+    '''
+    Reads the delimiter and the column names of a CSV file from its first bytes only.
+
+    :param file_path: The file path of the CSV file.
+    :param delimiter: The delimiter, if it is known. Otherwise it is sniffed from the sample, ";" if that fails.
+    :param sample_size: The number of bytes that are read.
+    '''
+    with open(file_path, "r", newline="") as file:
+        sample = file.read(sample_size)
+    if not delimiter:
+        try:
+            delimiter = csv.Sniffer().sniff(sample, delimiters=";,\t|").delimiter
+        except csv.Error:
+            delimiter = ";"
+    header = next(csv.reader(io.StringIO(sample), delimiter=delimiter), [])
+    return delimiter, header
+
+def convert_delimiter(file_path: str, delimiter: str):
+    '''
+    Rewrites a CSV file with ";" as delimiter, which is the delimiter all logs are read with. The file is written
+    through a temporary file of its own, so an ingestion that overlaps another one of the same file does not share it.
+
+    :param file_path: The file path of the CSV file.
+    :param delimiter: The current delimiter of the file.
+    '''
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or ".", prefix=os.path.basename(file_path) + ".", suffix=".tmp")
+    try:
+        with open(file_path, "r", newline="") as infile, os.fdopen(file_descriptor, "w", newline="") as outfile:
+            csv.writer(outfile, delimiter=";").writerows(csv.reader(infile, delimiter=delimiter))
+        # Temporary files are only readable by their owner, the log keeps its permissions
+        os.chmod(temporary_path, os.stat(file_path).st_mode & 0o777)
+        os.replace(temporary_path, file_path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+def read_event_log(file_path: str, file_type: str) -> pandas.DataFrame:
+    '''
+    Parses an event log from its original CSV or XES file.
+
+    :param file_path: The file path of the log.
+    :param file_type: The type of the log file, "CSV" or "XES".
+    '''
     if file_type == "CSV":
         return pandas.read_csv(file_path, delimiter=";")
     elif file_type == "XES":
         return pm4py.read_xes(file_path)
     else:
-        raise ValueError("Invalid file type. Please provide a valid file type: csv or xes")
\ No newline at end of file
+        raise ValueError("Invalid file type. Please provide a valid file type: csv or xes")
+
+def column_mapping_fingerprint(column_mapping: ColumnMapping | None) -> str | None:
+    # Short, stable hash of a column mapping, e.g. to tell apart the typed copies of the log for different mappings.
+    # It includes the version of the mapped shape, so copies that still kept the original columns are written again.
+    if not column_mapping:
+        return None
+    return hashlib.sha256(json.dumps({"mapping": column_mapping, "version": MAPPED_LOG_VERSION}, sort_keys=True).encode()).hexdigest()[:16]
+
+def apply_column_mapping(log: pandas.DataFrame, column_mapping: ColumnMapping | None) -> pandas.DataFrame:
+    '''
+    Renames the mapped columns of a log to the case ID, activity and timestamp columns, parses the timestamps, drops
+    events without case ID, activity or timestamp and sorts the events by case and timestamp, see
+    pm4py.format_dataframe. The original columns are dropped, so every value is in the log only once, and the case ID,
+    activity and timestamp columns come first. Returns the log unchanged if there is no mapping.
+
+    :param log: The parsed log.
+    :param column_mapping: The original column of the case ID, activity and timestamp.
+    '''
+    if not column_mapping:
+        return log
+    log = pm4py.format_dataframe(log, case_id=column_mapping[CASE_COLUMN], activity_key=column_mapping[ACTIVITY_COLUMN], timestamp_key=column_mapping[TIMESTAMP_COLUMN])
+    # format_dataframe copies the mapped columns and adds index columns of its own
+    mapped_columns = {column for column in column_mapping.values() if column not in column_mapping} | set(PM4PY_INDEX_COLUMNS)
+    columns = [column for column in log.columns if column not in mapped_columns and column not in column_mapping]
+    return log[[CASE_COLUMN, ACTIVITY_COLUMN, TIMESTAMP_COLUMN] + columns]
+
+def columnar_log_path(file_path: str, column_mapping: ColumnMapping | None = None) -> str:
+    # The typed copy is stored next to the original file, e.g. logs/x/log.csv.parquet or, with a column mapping,
+    # logs/x/log.csv.<mapping fingerprint>.parquet
+    if not column_mapping:
+        return file_path + ".parquet"
+    return f"{file_path}.{column_mapping_fingerprint(column_mapping)}.parquet"
+
+def write_columnar_log(file_path: str, file_type: str, column_mapping: ColumnMapping | None = None) -> pandas.DataFrame:
+    '''
+    Parses an event log once and stores a typed columnar copy next to it: the column mapping is applied, timestamps
+    are parsed and the case and activity columns are stored as categoricals of strings. Events without case ID or
+    activity are dropped. Returns the typed log. The original file is left untouched, the copies for other column
+    mappings are deleted.
+
+    :param file_path: The file path of the log.
+    :param file_type: The type of the log file, "CSV" or "XES".
+    :param column_mapping: The original column of the case ID, activity and timestamp, if they are not named by the XES standard.
+    '''
+    log = apply_column_mapping(read_event_log(file_path, file_type), column_mapping)
+    if file_type == "CSV":
+        log = convert_timestamp_columns_in_df(log)
+    identifier_columns = [column for column in (CASE_COLUMN, ACTIVITY_COLUMN) if column in log.columns]
+    # Events without case ID or activity belong to no case, they would otherwise become a "nan" case or activity
+    missing = log[identifier_columns].isna().any(axis=1)
+    if missing.any():
+        print(f"Dropped {int(missing.sum())} events without case ID or activity from {file_path}")
+        log = log[~missing].reset_index(drop=True)
+    for column in identifier_columns:
+        values = log[column]
+        # Integer IDs parsed as floats (e.g. because of missing values) keep their integer form, "1" instead of "1.0"
+        if pandas.api.types.is_float_dtype(values) and bool((values % 1 == 0).all()):
+            values = values.astype("int64")
+        log[column] = values.astype("string").astype("category")
+
+    columnar_path = columnar_log_path(file_path, column_mapping)
+    # A write of its own, e.g. when a re-ingestion overlaps an ingestion of the same log
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(columnar_path) or ".", prefix=os.path.basename(columnar_path) + ".", suffix=".tmp")
+    os.close(file_descriptor)
+    try:
+        log.to_parquet(temporary_path, index=False)
+        os.replace(temporary_path, columnar_path)
+    except (ArrowException, TypeError, ValueError) as error:
+        # E.g. columns with mixed types, the log is then parsed from the original file every time
+        print(f"Could not store columnar copy of {file_path}: {error!r}")
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+    if column_mapping:
+        # Only one mapping is in use at a time, so the copies of the mappings it replaced are superseded. The unmapped
+        # copy is kept to sample XES logs from, CSV logs are sampled from the original file.
+        stale_paths = glob.glob(glob.escape(file_path) + ".*.parquet")
+        if file_type == "CSV":
+            stale_paths.append(columnar_log_path(file_path))
+        for stale_path in stale_paths:
+            if stale_path != columnar_path and os.path.exists(stale_path):
+                os.remove(stale_path)
+    # The log is usually read right after it was written, e.g. when it is first viewed. Putting it drops the cached
+    # frames of the superseded copies.
+    return dataframe_cache.put(dataframe_cache.key(file_path, variant=column_mapping_fingerprint(column_mapping)), log)
+
+def has_columnar_log(file_path: str, column_mapping: ColumnMapping | None = None) -> bool:
+    # The copy is stale if the original file was written after it, e.g. after it was uploaded again
+    columnar_path = columnar_log_path(file_path, column_mapping)
+    return os.path.exists(columnar_path) and os.stat(columnar_path).st_mtime_ns >= os.stat(file_path).st_mtime_ns
+
+def fetch_dataframe(file_path: str, file_type: str, columns: list[str] | None = None, categorical: bool = True, column_mapping: ColumnMapping | None = None) -> pandas.DataFrame:
+    '''
+    Reads an event log from its typed columnar copy, which is (re)created from the original file if it is missing
+    or stale. Parsed logs are kept in the in-process dataframe cache until the file changes, the returned frame
+    shares its data with the cache and must not be written in place.
+
+    :param file_path: The file path of the log.
+    :param file_type: The type of the log file, "CSV" or "XES".
+    :param columns: The columns to read. All columns if not given.
+    :param categorical: Whether the case and activity columns stay categorical, or are converted back to plain values.
+    :param column_mapping: The original column of the case ID, activity and timestamp, applied when the copy is created.
+    '''
+    key = dataframe_cache.key(file_path, columns, column_mapping_fingerprint(column_mapping))
+    log = dataframe_cache.get(key)
+    if log is None:
+        if has_columnar_log(file_path, column_mapping):
+            log = dataframe_cache.put(key, pandas.read_parquet(columnar_log_path(file_path, column_mapping), columns=columns))
+        else:
+            log = write_columnar_log(file_path, file_type, column_mapping)
+            if columns is not None:
+                log = dataframe_cache.put(key, log[columns])
+
+    if not categorical:
+        for column in log.columns:
+            if isinstance(log[column].dtype, pandas.CategoricalDtype):
+                log[column] = log[column].astype(log[column].cat.categories.dtype)
+    return log
+
+def sample_event_log(file_path: str, file_type: str, column_mapping: ColumnMapping | None = None, rows: int = SAMPLE_ROWS) -> pandas.DataFrame:
+    '''
+    Parses the first rows of an event log and applies the column mapping to them, e.g. to derive the columns and
+    their types or to check a mapping without parsing the whole log. XES logs are read from their typed copy.
+
+    :param file_path: The file path of the log.
+    :param file_type: The type of the log file, "CSV" or "XES".
+    :param column_mapping: The original column of the case ID, activity and timestamp.
+    :param rows: The number of rows that are parsed.
+    '''
+    if file_type == "CSV":
+        log = convert_timestamp_columns_in_df(pandas.read_csv(file_path, delimiter=";", nrows=rows))
+    else:
+        log = fetch_dataframe(file_path, file_type).head(rows)
+    return apply_column_mapping(log, column_mapping)
+
+def fetch_columns(file_path: str, file_type: str, column_mapping: ColumnMapping | None = None) -> list[str]:
+    '''
+    Returns the column names of an event log. They are read from the header of a CSV file, or the schema of the
+    typed copy, without parsing the events. With a column mapping, only the first rows are parsed.
+
+    :param file_path: The file path of the log.
+    :param file_type: The type of the log file, "CSV" or "XES".
+    :param column_mapping: The original column of the case ID, activity and timestamp.
+    '''
+    if has_columnar_log(file_path, column_mapping):
+        return pyarrow.parquet.read_schema(columnar_log_path(file_path, column_mapping)).names
+    if column_mapping:
+        return sample_event_log(file_path, file_type, column_mapping).columns.tolist()
+    if file_type == "CSV":
+        return sniff_csv_header(file_path, ";")[1]
+    return write_columnar_log(file_path, file_type).columns.tolist()
+
+def case_order(log: pandas.DataFrame, case_column="case:concept:name") -> numpy.ndarray:
+    '''
+    Returns the event positions grouped by case (sorted by case ID), keeping the order of events within each case,
+    e.g. to pair every event with the previous event of its case. Results computed in this order are scattered back
+    with result[case_order(log)] = values, the generated logs keep the row order of the input log.
+    '''
+    return numpy.argsort(log.groupby(case_column).ngroup().to_numpy(), kind="stable")
+
+
+def positions_by_variant(log: pandas.DataFrame, case_column="case:concept:name", activity_column="concept:name") -> dict[tuple[str, ...], numpy.ndarray]:
+    '''
+    Groups the cases of the log by their variant. Returns, for every variant, a matrix of shape (cases, len(variant))
+    holding the row positions of the events of each case, with the cases ordered by case ID.
+    '''
+    activities = log[activity_column].to_numpy()
+    cases_by_variant: dict[tuple[str, ...], list[numpy.ndarray]] = {}
+    for positions in log.groupby(case_column).indices.values():
+        cases_by_variant.setdefault(tuple(activities[positions]), []).append(positions)
+    return {variant: numpy.vstack(positions) for variant, positions in cases_by_variant.items()}
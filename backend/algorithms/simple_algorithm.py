@@ -1,9 +1,12 @@
+import numpy as np
 import pandas
-from pm4py.stats import get_start_activities
+from .directly_follows import directly_follows_statistics
+from .preprocessor import case_order
 
 def add_activities(log: pandas.DataFrame, threshold: float) -> pandas.DataFrame:
 
-    next_activity_table = get_next_activity_table(log)
+    statistics = directly_follows_statistics(log)
+    next_activity_table = statistics.directly_follows_table()
     
     # Normalize the table
     next_activity_table = next_activity_table.div(next_activity_table.sum(axis=1), axis=0).fillna(0)
@@ -13,46 +16,36 @@ def add_activities(log: pandas.DataFrame, threshold: float) -> pandas.DataFrame:
 
     # Create dictionary of enabled activities
     next_activities_dict = {index: set(next_activity_table.columns[row > 0]) for index, row in next_activity_table.iterrows()}
-    # Make a set out of keys of start_activities
-    start_activities = set(get_start_activities(log).keys())
     # Add start activities to next_activities_dict
-    next_activities_dict.update({"start": start_activities})
+    next_activities_dict.update({"start": statistics.start_activities})
     print(next_activities_dict)
 
-    # Add enabled__activities column to DataFrame
-    log["enabled__activities"] = None
-
-    def fill_enabled_activities_column(group: pandas.Series) -> pandas.DataFrame:
-
-        enabled_activities = next_activities_dict["start"].copy()
-
-        for index, row in group.iterrows():
-            enabled_activities.add(row["concept:name"])
-            group.at[index, "enabled__activities"] = tuple(sorted(enabled_activities, key=str.lower))
-            enabled_activities = next_activities_dict[row["concept:name"]].copy()
-        return group
-
-    return log.groupby("case:concept:name", group_keys=False).apply(fill_enabled_activities_column).reset_index()
+    # The enabled activities of an event only depend on the previous activity in its case (or the case start) and its
+    # own activity, so they are assembled once per distinct pair and then looked up for all events
+    order = case_order(log)
+    codes = statistics.activity_codes[order]
+    case_ids = log["case:concept:name"].to_numpy()[order]
+    previous_codes = np.concatenate([[-1], codes[:-1]]) if len(codes) else codes
+    if len(codes):
+        previous_codes[np.concatenate([[True], case_ids[1:] != case_ids[:-1]])] = -1
+
+    pairs, pair_index = np.unique((previous_codes + 1) * len(statistics.activities) + codes, return_inverse=True)
+    enabled_activities = np.empty(len(pairs), dtype=object)
+    for index, pair in enumerate(pairs.tolist()):
+        previous_code, code = divmod(pair, len(statistics.activities))
+        previous = next_activities_dict["start"] if previous_code == 0 else next_activities_dict[statistics.activities[previous_code - 1]]
+        enabled_activities[index] = tuple(sorted(previous | {statistics.activities[code]}, key=str.lower))
+
+    # The events keep their order, the results of the events grouped by case are scattered back to their positions
+    result = log.reset_index()
+    events_enabled_activities = np.empty(len(log), dtype=object)
+    events_enabled_activities[order] = enabled_activities[pair_index]
+    result["enabled__activities"] = events_enabled_activities
+    return result
 
 def get_next_activity_table(log: pandas.DataFrame) -> pandas.DataFrame:
 
-    # Get all activities in the log
-    activities = log["concept:name"].unique()
-
     # Create a table where next_activity_table(a, b) = 2 means that activity a is followed by activity b twice 
-    next_activity_table = pandas.DataFrame(0, activities, activities)
-
-    def fill_next_activity_table(group: pandas.DataFrame) -> pandas.DataFrame:
-        trace = list(group["concept:name"].values)
-        # Pop first activity from trace and retrieve the activity
-        current_activity = trace.pop(0)
-        while trace: 
-            next_activity = trace.pop(0)
-            next_activity_table.loc[current_activity, next_activity] += 1
-            current_activity = next_activity
-        return group
-    
-    # Iterate over each group and add the next activities to the next_activity_table
-    log.groupby("case:concept:name", group_keys=False).apply(fill_next_activity_table).reset_index()
+    next_activity_table = directly_follows_statistics(log).directly_follows_table()
     print(next_activity_table)
-    return next_activity_table
\ No newline at end of file
+    return next_activity_table
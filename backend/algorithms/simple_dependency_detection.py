@@ -2,26 +2,14 @@ from pm4py import read_xes
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+from .directly_follows import directly_follows_statistics
 
 
 def dependency_detection(log: pd.DataFrame):
-    activities = log["concept:name"].unique()
-    print("activities: ", activities)
-    # Create a dataframe matrix with shape of activities x activities
-    dependency_matrix = pd.DataFrame(0, activities, activities)
-
-    def fill_dependency_matrix(group: pd.DataFrame) -> pd.DataFrame:
-        trace = list(group["concept:name"].values)
-
-        prev_activitiy = None
-        for activity in trace:
-            current_activity = trace.pop(0)
-            if prev_activitiy is not None:
-                dependency_matrix.loc[prev_activitiy, current_activity] += 1
-            prev_activitiy = current_activity
-        return group
-    
-    log.groupby("case:concept:name", group_keys=False).apply(fill_dependency_matrix, include_groups=False).reset_index()
+    statistics = directly_follows_statistics(log)
+    print("activities: ", statistics.activities)
+    # Matrix with shape of activities x activities, counting how often an activity directly follows another one
+    dependency_matrix = statistics.directly_follows_table()
 
     print("Dependency:", dependency_matrix)
 
@@ -52,15 +40,7 @@ def dependency_detection(log: pd.DataFrame):
     # dependency_correlation_matrix.to_csv("dependency_matrix.csv", sep=";")
 
 def singleton_detection(log: pd.DataFrame):
-    activities = log["concept:name"].unique()
-    cases = log["case:concept:name"].unique()
-
-    case_activity_matrix = pd.DataFrame(0, cases, activities)
-
-    for case in cases:
-        case_activities = log[log["case:concept:name"] == case]["concept:name"].values
-        for activity in case_activities:
-            case_activity_matrix.loc[case, activity] += 1
+    case_activity_matrix = directly_follows_statistics(log).case_activity_table()
 
     print("case_activity_matrix: ", case_activity_matrix)
 
@@ -1,7 +1,8 @@
 from dataclasses import dataclass, field
 import uuid
+import numpy as np
 
-@dataclass
+@dataclass(slots=True)
 class State(object):
 
     name: str
@@ -12,11 +13,11 @@ class State(object):
 
     def __repr__(self):
         return str(self.name)
-    
+
     def __hash__(self):
-        return id(self) 
-    
-@dataclass
+        return id(self)
+
+@dataclass(slots=True)
 class Transition(object):
     name: str
     from_state : State
@@ -26,12 +27,242 @@ class Transition(object):
 
     def __repr__(self):
         return self.from_state.name + " -> " + self.to_state.name
-    
+
     def __hash__(self):
         return id(self)
-        
+
 @dataclass
 class TransitionSystem(object):
     name: str = ""
     states: set[State] = field(default_factory=set)
     transitions: set[Transition] = field(default_factory=set)
+
+
+@dataclass
+class CompactTransitionSystem(object):
+    '''
+    Array-backed transition system with integer state and transition IDs.
+    Transitions are stored row-compressed by source state: the outgoing transitions of state s are
+    edge_offsets[s] to edge_offsets[s + 1], sorted by activity code, so a (state, activity) lookup is a binary search.
+    Prefix automata built from a log also keep the parent and the incoming activity of every state, so state names
+    (e.g. "<,a,b>") are derived on demand instead of being stored.
+    '''
+    name: str
+    # Activity vocabulary, transitions refer to it by code
+    activities: list[str]
+    # Number of cases that reached each state
+    state_frequency: np.ndarray
+    # Parent state and incoming activity code of each state of a prefix tree, -1 if unknown
+    state_parent: np.ndarray
+    state_activity: np.ndarray
+    edge_offsets: np.ndarray
+    edge_target: np.ndarray
+    edge_activity: np.ndarray
+    # Number of cases that took each transition
+    edge_frequency: np.ndarray
+    # Explicit state names and external IDs, e.g. of a decoded automaton. Derived from the arrays if None.
+    state_names: list[str] | None = None
+    state_ids: list[str] | None = None
+    edge_ids: list[str] | None = None
+    start_state: int = 0
+
+    def __post_init__(self):
+        self._activity_index = {activity: code for code, activity in enumerate(self.activities)}
+        self._edge_keys = self.edge_source * len(self.activities) + self.edge_activity
+
+    @classmethod
+    def from_edges(cls, name: str, number_of_states: int, sources: np.ndarray, targets: np.ndarray, edge_activities: list[str], state_frequency: np.ndarray | None = None, edge_frequency: np.ndarray | None = None, state_parent: np.ndarray | None = None, state_activities: list[str | None] | None = None, state_names: list[str] | None = None, state_ids: list[str] | None = None, edge_ids: list[str] | None = None, start_state: int = 0) -> "CompactTransitionSystem":
+        '''
+        Builds the compact form from a list of edges in any order.
+
+        :param name: The name of the transition system.
+        :param number_of_states: The number of states.
+        :param sources: The source state of every edge.
+        :param targets: The target state of every edge.
+        :param edge_activities: The activity of every edge.
+        :param state_frequency: The frequency of every state. 0 if not given.
+        :param edge_frequency: The frequency of every edge. The frequency of its target state if not given.
+        :param state_parent: The parent of every state of a prefix tree.
+        :param state_activities: The incoming activity of every state of a prefix tree.
+        :param state_names: The name of every state.
+        :param state_ids: The external ID of every state.
+        :param edge_ids: The external ID of every edge.
+        :param start_state: The start state.
+        '''
+        activities = sorted(set(edge_activities))
+        activity_index = {activity: code for code, activity in enumerate(activities)}
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        codes = np.array([activity_index[activity] for activity in edge_activities], dtype=np.int64)
+
+        state_frequency = np.zeros(number_of_states, dtype=np.int64) if state_frequency is None else np.asarray(state_frequency, dtype=np.int64)
+        edge_frequency = state_frequency[targets] if edge_frequency is None else np.asarray(edge_frequency, dtype=np.int64)
+        if state_parent is None:
+            state_parent = np.full(number_of_states, -1, dtype=np.int64)
+            state_activity = np.full(number_of_states, -1, dtype=np.int64)
+        else:
+            state_activity = np.array([-1 if activity is None else activity_index[activity] for activity in state_activities], dtype=np.int64)
+
+        order = np.lexsort((codes, sources))
+        return cls(
+            name=name,
+            activities=activities,
+            state_frequency=state_frequency,
+            state_parent=np.asarray(state_parent, dtype=np.int64),
+            state_activity=state_activity,
+            edge_offsets=np.concatenate([[0], np.cumsum(np.bincount(sources, minlength=number_of_states))]).astype(np.int64),
+            edge_target=targets[order],
+            edge_activity=codes[order],
+            edge_frequency=edge_frequency[order],
+            state_names=state_names,
+            state_ids=state_ids,
+            edge_ids=None if edge_ids is None else [edge_ids[edge] for edge in order.tolist()],
+            start_state=start_state,
+        )
+
+    @classmethod
+    def from_transition_system(cls, transition_system: TransitionSystem) -> "CompactTransitionSystem":
+        '''
+        Converts an object graph into the compact form. State and transition IDs are kept,
+        the start state is the state named "<>" (or the first state if there is none).
+
+        :param transition_system: The transition system.
+        '''
+        states = list(transition_system.states)
+        state_index = {id(state): index for index, state in enumerate(states)}
+        transitions = list(transition_system.transitions)
+        # Transitions without a frequency of their own take the frequency of their target state
+        edge_frequency = [transition.data["frequency"] for transition in transitions] if all("frequency" in transition.data for transition in transitions) else None
+        start_state = next((index for index, state in enumerate(states) if state.name == "<>"), 0)
+
+        return cls.from_edges(
+            transition_system.name,
+            len(states),
+            [state_index[id(transition.from_state)] for transition in transitions],
+            [state_index[id(transition.to_state)] for transition in transitions],
+            [transition.name for transition in transitions],
+            state_frequency=[state.data.get("frequency", 0) for state in states],
+            edge_frequency=edge_frequency,
+            state_names=[state.name for state in states],
+            state_ids=[state.id for state in states],
+            edge_ids=[transition.id for transition in transitions],
+            start_state=start_state,
+        )
+
+    def to_transition_system(self) -> TransitionSystem:
+        '''
+        Converts the compact form into an object graph. The frequency of every transition is kept in its data,
+        since the transitions into a merged state of a bounded automaton do not share the frequency of that state.
+        '''
+        transition_system = TransitionSystem(name=self.name, states=set(), transitions=set())
+        states = [State(name, data={"frequency": int(frequency)}, id=self.state_id(state)) for state, (name, frequency) in enumerate(zip(self.names(), self.state_frequency.tolist()))]
+        for edge, (source, target) in enumerate(zip(self.edge_source.tolist(), self.edge_target.tolist())):
+            transition = Transition(self.transition_name(edge), states[source], states[target], id=self.transition_id(edge), data={"frequency": int(self.edge_frequency[edge])})
+            states[source].outgoing.add(transition)
+            states[target].incoming.add(transition)
+            transition_system.transitions.add(transition)
+        transition_system.states.update(states)
+        return transition_system
+
+    @property
+    def number_of_states(self) -> int:
+        return len(self.state_frequency)
+
+    @property
+    def number_of_transitions(self) -> int:
+        return len(self.edge_target)
+
+    @property
+    def edge_source(self) -> np.ndarray:
+        return np.repeat(np.arange(self.number_of_states, dtype=np.int64), np.diff(self.edge_offsets))
+
+    def activity_code(self, activity: str) -> int:
+        return self._activity_index.get(activity, -1)
+
+    def outgoing(self, state: int) -> np.ndarray:
+        return np.arange(self.edge_offsets[state], self.edge_offsets[state + 1])
+
+    def find_edges(self, states: np.ndarray, activity_codes: np.ndarray) -> np.ndarray:
+        '''
+        Returns the transition leaving each state with the given activity, or -1 if there is none.
+
+        :param states: The source states.
+        :param activity_codes: The activity codes, -1 for unknown activities.
+        '''
+        states, activity_codes = np.asarray(states, dtype=np.int64), np.asarray(activity_codes, dtype=np.int64)
+        keys = states * len(self.activities) + activity_codes
+        edges = np.searchsorted(self._edge_keys, keys)
+        found = (activity_codes >= 0) & (edges < len(self._edge_keys))
+        found[found] = self._edge_keys[edges[found]] == keys[found]
+        return np.where(found, edges, -1)
+
+    def find_edge(self, state: int, activity: str) -> int:
+        '''
+        Returns the transition leaving a state with the given activity, or -1 if there is none.
+
+        :param state: The source state.
+        :param activity: The activity.
+        '''
+        return int(self.find_edges([state], [self.activity_code(activity)])[0])
+
+    def transition_name(self, edge: int) -> str:
+        return self.activities[self.edge_activity[edge]]
+
+    def state_id(self, state: int) -> str:
+        return self.state_ids[state] if self.state_ids is not None else f"s{state}"
+
+    def transition_id(self, edge: int) -> str:
+        return self.edge_ids[edge] if self.edge_ids is not None else f"t{edge}"
+
+    def state_index(self, state_id: str) -> int:
+        '''
+        Returns the state with the given external ID, or -1 if there is none.
+
+        :param state_id: The external ID, e.g. "s4" for generated IDs.
+        '''
+        if self.state_ids is not None:
+            if not hasattr(self, "_state_index"):
+                self._state_index = {state_id: state for state, state_id in enumerate(self.state_ids)}
+            return self._state_index.get(state_id, -1)
+        if state_id[:1] == "s" and state_id[1:].isdigit() and int(state_id[1:]) < self.number_of_states:
+            return int(state_id[1:])
+        return -1
+
+    def state_name(self, state: int) -> str:
+        '''
+        Returns the name of a single state without deriving the names of all states.
+
+        :param state: The state.
+        '''
+        if self.state_names is not None:
+            return self.state_names[state]
+        activities = []
+        while self.state_parent[state] >= 0:
+            activities.append(self.activities[self.state_activity[state]])
+            state = self.state_parent[state]
+        return "<" + "".join("," + activity for activity in reversed(activities)) + ">"
+
+    def names(self) -> list[str]:
+        '''
+        Returns the name of every state. Prefix tree states are named after their prefix, e.g. "<,a,b>".
+        '''
+        if self.state_names is not None:
+            return self.state_names
+
+        # In a prefix tree built from a log, the parent of a state always has a smaller ID than the state itself
+        prefixes: list[str] = [""] * self.number_of_states
+        for state, (parent, activity) in enumerate(zip(self.state_parent.tolist(), self.state_activity.tolist())):
+            if parent >= 0:
+                prefixes[state] = prefixes[parent] + "," + self.activities[activity]
+        return [f"<{prefix}>" for prefix in prefixes]
+
+    def transition_label(self, edge: int, names: list[str] | None = None) -> str:
+        '''
+        Returns the label of a transition in the form "<from state> -> <to state>".
+
+        :param edge: The transition.
+        :param names: The names of all states, if they were already computed.
+        '''
+        names = self.names() if names is None else names
+        source = int(np.searchsorted(self.edge_offsets, edge, side="right") - 1)
+        return names[source] + " -> " + names[self.edge_target[edge]]
@@ -1,29 +1,33 @@
-from math import prod
-import os
+import logging
 import pandas as pd
-from pm4py.objects.log.obj import Trace
 import pm4py
-from pandas import DataFrame, Series, read_csv
+from pandas import DataFrame
 from pm4py.objects.petri_net.obj import PetriNet, Marking
-from pm4py.algo.conformance.alignments.petri_net.variants import dijkstra_less_memory
-from pm4py.objects.petri_net.semantics import PetriNetSemantics
 from sklearn.calibration import LabelEncoder
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.linear_model import LogisticRegression
-from sklearn.model_selection import train_test_split
 import numpy as np
-from anytree import Node
-from .custom_logger import get_logger_by_flie_path
-from pm4py.objects.log.util.dataframe_utils import convert_timestamp_columns_in_df
+from .alignment_cache import VariantAlignments, align_variants, net_fingerprint
+from .artifact_cache import ALIGNMENTS_ARTIFACT, PETRI_NET_ARTIFACT, artifact_path, load_artifact, log_content_hash, models_artifact_name, save_artifact
+from .batched_inference import EnabledRows, predict_enabled_probabilities
+from .compiled_petri_net import CompiledPetriNet
+from .enabled_probabilities import EnabledProbabilities
+from .instrumentation import RunMetrics
+from .model_training import train_models
+from .observation_store import ObservationStore
+from .preprocessor import ColumnMapping, fetch_dataframe, positions_by_variant
 
 import warnings
 # Suppress FutureWarning messages
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
+# Debug output of the discovery, e.g. whole DataFrames, which is only rendered if enabled
+logger = logging.getLogger(__name__)
+
 # Define DataState as type for dict[str, float]
 DataState = dict[str, float]
 Activity = str
-ObservationInstances = dict[PetriNet.Transition, tuple[list[DataState], list[bool]]]
+ObservationInstances = ObservationStore
 RegressionModels = dict[PetriNet.Transition, LogisticRegression]
 RandomForests = dict[PetriNet.Transition, RandomForestClassifier]
 
@@ -33,33 +37,53 @@ TIMESTAMP_COLUMN = "time:timestamp"
 
 
 
-def translucify_petri_net(log_filepath: str, data_columns: list[dict[str]], method: str, threshold: float) -> DataFrame:
+def translucify_petri_net(log_filepath: str, data_columns: list[dict[str]], method: str, threshold: float, workers: int = 1, training_workers: int = 1, evaluate: bool = True, probabilities_filepath: str | None = None, metrics: RunMetrics | None = None, column_mapping: ColumnMapping | None = None) -> DataFrame:
     '''
     Discovers a translucent log from a given log file path using a threshold.
 
     :param log_filepath: The file path of the log file.
     :param threshold: The cutoff percentage.
+    :param workers: The number of processes used to align the variants of the log.
+    :param training_workers: The maximum number of models trained concurrently.
+    :param evaluate: Whether to compute the held-out accuracy of the models.
+    :param probabilities_filepath: Where to store the enabled probabilities of every event for re-thresholding.
+    :param metrics: Collects the duration, memory usage and item counts of every stage.
+    :param column_mapping: The original column of the case ID, activity and timestamp, if they are not named by the XES standard.
     '''
 
+    if metrics is None:
+        metrics = RunMetrics("petri_net")
     print("Log file path: ", log_filepath)
     
     # If log flie is a CSV file, import it as a DataFrame
     # Else if log file is a XES file, import it as a log object
-    if log_filepath.endswith(".csv"):
-        log = read_csv(log_filepath, sep=";")
-        print("Event log from CSV: \n", log)
-        log = convert_timestamp_columns_in_df(log)
-        print("Event log after converting timestamp columns: \n", log)
-        log[CASE_COLUMN] = log[CASE_COLUMN].astype("string")
-        log[ACTIVITY_COLUMN] = log[ACTIVITY_COLUMN].astype("string")
-    else:
-        log = pm4py.read_xes(log_filepath)
-
-
-    print("Dataframe from log: \n", log)
+    with metrics.stage("read_log"):
+        # Read from the typed columnar copy of the log, the timestamp columns are already converted there
+        if log_filepath.endswith(".csv"):
+            log = fetch_dataframe(log_filepath, "CSV", categorical=False, column_mapping=column_mapping)
+            logger.debug("Event log from CSV:\n %s", log)
+            log[CASE_COLUMN] = log[CASE_COLUMN].astype("string")
+            log[ACTIVITY_COLUMN] = log[ACTIVITY_COLUMN].astype("string")
+        else:
+            log = fetch_dataframe(log_filepath, "XES", categorical=False, column_mapping=column_mapping)
+
+
+    logger.debug("Dataframe from log:\n %s", log)
     # check dataframe types
-    print("DTYPES: ", log.dtypes)
-    petri_net = pm4py.discover_petri_net_inductive(log)
+    logger.debug("Dtypes: %s", log.dtypes)
+
+    # Reuse the discovered net (and its compiled replay structure) if the log content did not change
+    with metrics.stage("discovery"):
+        log_hash = log_content_hash(log_filepath, column_mapping)
+        cached_petri_net = load_artifact(log_hash, PETRI_NET_ARTIFACT)
+        if cached_petri_net is not None:
+            petri_net, compiled_net = cached_petri_net
+        else:
+            petri_net = pm4py.discover_petri_net_inductive(log)
+            # Compile the net into an integer-indexed replay structure shared by both replay passes
+            compiled_net = CompiledPetriNet(petri_net)
+            save_artifact(log_hash, PETRI_NET_ARTIFACT, (petri_net, compiled_net), log_filepath)
+    number_of_markings = compiled_net.number_of_markings
 
     # pm4py.view_petri_net(petri_net=petri_net[0], initial_marking=petri_net[1], final_marking=petri_net[2], format="png")
     
@@ -67,221 +91,224 @@ def translucify_petri_net(log_filepath: str, data_columns: list[dict[str]], meth
     # Print number of traces of log
     num_traces = log[CASE_COLUMN].nunique()
     print(f"Number of traces in log: {num_traces}")
-    print(f"Log data types:\n {log.dtypes}")
+    logger.debug("Log data types:\n %s", log.dtypes)
+    metrics.count("events", len(log))
+    metrics.count("cases", num_traces)
+    metrics.count("transitions", len(petri_net[0].transitions))
     # Choose (or select all) attribute columns
 
     
     # Preprocess log using one-hot encoding
-    if method == "logistic_regression":
-        categorical_columns = [data_column["column"] for data_column in data_columns if data_column["type"] == "categorical"]
-        print("Categorical columns: ", categorical_columns)
-        log = pd.get_dummies(log, columns=categorical_columns, dtype=int)
-    # Scikit tends to perform well with categorical variables encoded as integers
-    elif method == "random_forest":
-        le = LabelEncoder()
-        for data_column in data_columns:
-            if data_column["type"] == "categorical":
-                log[data_column["column"]] = le.fit_transform(log[data_column["column"]])
+    with metrics.stage("preprocessing"):
+        if method == "logistic_regression":
+            categorical_columns = [data_column["column"] for data_column in data_columns if data_column["type"] == "categorical"]
+            print("Categorical columns: ", categorical_columns)
+            log = pd.get_dummies(log, columns=categorical_columns, dtype=int)
+        # Scikit tends to perform well with categorical variables encoded as integers
+        elif method == "random_forest":
+            le = LabelEncoder()
+            for data_column in data_columns:
+                if data_column["type"] == "categorical":
+                    log[data_column["column"]] = le.fit_transform(log[data_column["column"]])
 
 
-    print(f"Log after preprocessing:\n {log}")
+    logger.debug("Log after preprocessing:\n %s", log)
 
     # Select all log columns as features as long as their names start with a selected column name (Due to one-hot encoding)
     feature_columns = [column for column in log.columns if any([column.startswith(data_column["column"]) for data_column in data_columns])]
-    print(f"Feature Columns:\n {feature_columns}")
-
-    observation_instances: ObservationInstances = create_observation_instances(petri_net, log, feature_columns)
-    print("Observation instances: ", observation_instances)
-
-    # Save the observation instances to a csv file
-    observation_instances_dataframe = DataFrame(observation_instances.items(), columns=["Transition", "Observation Instances"])
-    observation_instances_dataframe.to_csv("observation_instances.csv", index=False)
+    logger.debug("Feature columns:\n %s", feature_columns)
+
+    # Align every variant once and share the alignments between both replay passes
+    with metrics.stage("alignment"):
+        alignments: VariantAlignments = align_variants(log, petri_net, artifact_path(log_hash, ALIGNMENTS_ARTIFACT, log_filepath), workers)
+    metrics.count("variants", len(alignments))
+
+    # Reuse the models if they were trained on the same net, columns, method and evaluation (e.g. only the threshold changed)
+    models_name = models_artifact_name(data_columns, method, evaluate)
+    regression_models = load_regression_models(log_hash, models_name, petri_net, feature_columns)
+    if regression_models is None:
+        with metrics.stage("observation_extraction"):
+            observation_instances: ObservationInstances = create_observation_instances(petri_net, log, feature_columns, alignments, compiled_net)
+
+        # Save the number of observation instances per transition to a csv file
+        observation_instances_dataframe = DataFrame(observation_instances.summary(), columns=["Transition", "Observation Instances", "Fired"])
+        logger.debug("Observation instances:\n %s", observation_instances_dataframe)
+        observation_instances_dataframe.to_csv("observation_instances.csv", index=False)
+        metrics.count("observations", observation_instances_dataframe["Observation Instances"].sum())
+
+        with metrics.stage("training"):
+            regression_models = create_regression_models(observation_instances, feature_columns, method, training_workers, evaluate)
+            save_artifact(log_hash, models_name, {
+                "net": net_fingerprint(petri_net),
+                "feature_columns": feature_columns,
+                "models": {transition.name: regression for transition, regression in regression_models.items()},
+            }, log_filepath)
+    logger.debug("Regression models: %s", regression_models)
+
+    with metrics.stage("enabled_activities"):
+        log = create_enabled_activities(petri_net, log, regression_models, feature_columns, threshold, method, alignments, compiled_net, probabilities_filepath)
+    metrics.count("markings", compiled_net.number_of_markings)
+
+    # Keep the markings discovered during replay with the cached net
+    if compiled_net.number_of_markings > number_of_markings:
+        save_artifact(log_hash, PETRI_NET_ARTIFACT, (petri_net, compiled_net), log_filepath)
+
+    return log
+
+def load_regression_models(log_hash: str, models_name: str, petri_net: tuple[PetriNet, Marking, Marking], feature_columns: list[str]) -> RegressionModels | RandomForests | None:
+    '''
+    Loads cached models and maps them onto the transitions of the net. Returns None if there are no models
+    for this net and these feature columns.
 
-    regression_models = create_regression_models(observation_instances, feature_columns, method)
-    print("Regression models: ", regression_models)
+    :param log_hash: The content hash of the log.
+    :param models_name: The artifact name of the models.
+    :param petri_net: The Petri net tuple.
+    :param feature_columns: The list of feature columns.
+    '''
+    cached_models = load_artifact(log_hash, models_name)
+    if cached_models is None or cached_models["net"] != net_fingerprint(petri_net) or cached_models["feature_columns"] != feature_columns:
+        return None
 
-    return create_enabled_activities(petri_net, log, regression_models, feature_columns, threshold, method)
+    net, _, _ = petri_net
+    return {transition: cached_models["models"][transition.name] for transition in net.transitions}
 
-def create_observation_instances(petri_net: tuple[PetriNet, Marking, Marking], log: DataFrame, feature_columns: list[str]) -> ObservationInstances:
+def create_observation_instances(petri_net: tuple[PetriNet, Marking, Marking], log: DataFrame, feature_columns: list[str], alignments: VariantAlignments | None = None, compiled_net: CompiledPetriNet | None = None) -> ObservationInstances:
     '''
     This function creates observation instances for each transition in the Petri net.
-    e.g.: {t1: ([datastate1, datastate2], [True, False])}
+    The data states are stored once in a feature matrix, each transition only keeps row indices and labels.
+    e.g.: {t1: (rows [0, 4], labels [True, False])}
     :param petri_net: The Petri net tuple.
     :param log: The log DataFrame.
     :param feature_columns: The list of feature columns.
+    :param alignments: The alignments per variant. Computed on the fly if not given.
+    :param compiled_net: The compiled replay structure of the net. Compiled on the fly if not given.
     '''
     net, im, fm = petri_net
-
-    # Create a dictionary of transitions and its instances
-    observation_instances: ObservationInstances = { transition: ([], []) for transition in net.transitions}
-
-    def fill_observation_instances(group: Series) -> DataFrame:
-
-        # Create alignments for each trace
-        trace = Trace([{ACTIVITY_COLUMN: activity} for activity in group[ACTIVITY_COLUMN]])
-        alignments = dijkstra_less_memory.apply(trace, net, im, fm, parameters={dijkstra_less_memory.Parameters.PARAM_ALIGNMENT_RESULT_IS_SYNC_PROD_AWARE: True})
-        #print("Alignment:", alignments["alignment"])
-        current_marking = im
+    if alignments is None:
+        alignments = align_variants(log, petri_net)
+    if compiled_net is None:
+        compiled_net = CompiledPetriNet(petri_net)
+
+    def replay_variant(alignment_moves: list) -> list[tuple[int, list[int], int]]:
+        # (data state index, enabled transitions, fired transition) of every model move of the alignment
+        steps = []
+        current_marking = compiled_net.initial_marking
         current_data_state_index = 0
 
-        for alignment in alignments["alignment"]:
-            # Get all enabled transitions from the current marking
-            enabled_transitions: set[PetriNet.Transition] = pm4py.get_enabled_transitions(net, current_marking)
-            #print("Enabled transitions:", enabled_transitions)
-            # Find the transition that was fired
+        for alignment in alignment_moves:
             fired_transition_name: str = alignment[0][1]
-            fired_transition: PetriNet.Transition = next(filter(lambda transition: transition.name == fired_transition_name, enabled_transitions))
-            #print("Fired transition:", fired_transition)
-            #print(f"Current data state index: {current_data_state_index}")
-            # Get the data state of the current data state index
-            try:
-                current_data_state: list[list[float | int]] = group[feature_columns].iloc[current_data_state_index].to_list()
-            except IndexError:
-                current_data_state: list[list[float | int]] = group[feature_columns].iloc[-1].to_list()
-            
-            for enabled_transition in enabled_transitions:
-                # Add each instances to dictionary
-                observation_instances[enabled_transition][0].append(current_data_state)
-                observation_instances[enabled_transition][1].append(fired_transition == enabled_transition)
+            # Log moves do not fire a transition of the net
+            if fired_transition_name != ">>":
+                fired_transition = compiled_net.transition_id(fired_transition_name)
+                steps.append((current_data_state_index, compiled_net.enabled_transitions(current_marking).tolist(), fired_transition))
+                # Increment marking by firing the transition
+                current_marking = compiled_net.fire(current_marking, fired_transition)
 
             # Increment data state index if transition is not silent
             if alignment[1][1] is not None: current_data_state_index += 1
-            # Increment marking by firing the transition
-            current_marking = PetriNetSemantics.fire(net, fired_transition, current_marking)
+        return steps
+
+    # Create a store of transitions and its instances over the feature matrix of the log
+    observation_instances: ObservationInstances = ObservationStore(log[feature_columns].to_numpy(dtype=float), net.transitions)
+
+    for variant, positions in positions_by_variant(log).items():
+        for data_state_index, enabled_transitions, fired_transition in replay_variant(alignments[variant]):
+            # Rows of the current data state in every case of the variant (or the last one after the end of the trace)
+            rows = positions[:, min(data_state_index, len(variant) - 1)]
+
+            for enabled_transition in enabled_transitions:
+                # Add each instances to the store
+                observation_instances.add(compiled_net.transitions[enabled_transition], rows, fired_transition == enabled_transition)
 
-    log.groupby(CASE_COLUMN, group_keys=False).apply(fill_observation_instances).reset_index()
     return observation_instances
 
-def create_regression_models(observation_instances: ObservationInstances, feature_columns: list[str], method: str) -> RegressionModels | RandomForests:
+def create_regression_models(observation_instances: ObservationInstances, feature_columns: list[str], method: str, workers: int = 1, evaluate: bool = True) -> RegressionModels | RandomForests:
     '''
-    Receives a dictionary of observation instances and creates a regression model for each transition.
+    Receives the observation instances and creates a regression model for each transition.
     
-    :param observation_instances: The dictionary of observation instances.
+    :param observation_instances: The observation instances of all transitions.
     :param feature_columns: The list of feature columns.
+    :param method: The regression method: logistic_regression or random_forest.
+    :param workers: The maximum number of models trained concurrently.
+    :param evaluate: Whether to compute the held-out accuracy of every model and store it in a csv file.
     '''
-    regression_models: RegressionModels | RandomForests = {transition: None for transition in observation_instances}
-
-    accuracy_scores: dict[PetriNet.Transition, float] = {}
-
-    for transition, (data_states, labels) in observation_instances.items():
-        X_dataframe = DataFrame(data_states, columns=feature_columns)
-        Y_dataframe = DataFrame(labels, columns=["label"]).astype(int)
-
-        # print("X dataframe: ", X_dataframe)
-        # print("Y dataframe: ", Y_dataframe)
-
-        X_train, X_test, Y_train, Y_test = train_test_split(X_dataframe, Y_dataframe, test_size=0.2)
-
-        try:
-            if method == "logistic_regression":
-                regression = LogisticRegression().fit(X_train, np.ravel(Y_train))
-            elif method == "random_forest":
-                print("using random forest")
-                regression = RandomForestClassifier().fit(X_train, np.ravel(Y_train))
-            # Add regression model to corresponding transition
-            regression_models[transition] = regression
-            accuracy_scores[transition] = regression.score(X_test, np.ravel(Y_test))
-        except ValueError:
-            #print("Valueerror!")
-            # Error if transition has a 100% change of firing. But there are some transitions that have 100% change of firing!
-            # => Set the regression model to 1
-            regression_models[transition] = 1
-            accuracy_scores[transition] = 1
-    
-    # Convert the accuracy scores into a dataframe then store in a csv file
-    accuracy_scores_dataframe = DataFrame(accuracy_scores.items(), columns=["Transition", "Accuracy Score"])
-    file_path = 'multivariate_regression_accuracy_scores.csv' if method == "logistic_regression" else 'random_forest_accuracy_scores.csv'
-    accuracy_scores_dataframe.to_csv(file_path, index=False)
+    regression_models: RegressionModels | RandomForests
+    accuracy_scores: dict[PetriNet.Transition, float]
+    regression_models, accuracy_scores = train_models(observation_instances, method, workers, evaluate)
 
-    return regression_models
-
-
-def create_enabled_activities(petri_net: tuple[PetriNet, Marking, Marking], log: DataFrame, regression_models: RegressionModels | RandomForests, feature_columns: list[str], threshold: float, method: str) -> DataFrame:
+    if evaluate:
+        # Convert the accuracy scores into a dataframe then store in a csv file
+        accuracy_scores_dataframe = DataFrame(accuracy_scores.items(), columns=["Transition", "Accuracy Score"])
+        file_path = 'multivariate_regression_accuracy_scores.csv' if method == "logistic_regression" else 'random_forest_accuracy_scores.csv'
+        accuracy_scores_dataframe.to_csv(file_path, index=False)
 
-    # Add column enabled_activities
-    log["enabled_activities"] = None
-    print(log)
-
-    net, im, fm = petri_net
+    return regression_models
 
-    def fill_enabled_activities_column(group: Series) -> DataFrame:
+def create_enabled_activities(petri_net: tuple[PetriNet, Marking, Marking], log: DataFrame, regression_models: RegressionModels | RandomForests, feature_columns: list[str], threshold: float, method: str, alignments: VariantAlignments | None = None, compiled_net: CompiledPetriNet | None = None, probabilities_filepath: str | None = None) -> DataFrame:
+    '''
+    Adds the enabled_activities column to the log.
+    Every variant is replayed once to find the marking in which each event is decided. Then, for every transition,
+    all data states at which it can be reached are predicted in a single batched call.
 
-        # Create alignments for each trace
-        trace = Trace([{ACTIVITY_COLUMN: activity} for activity in group[ACTIVITY_COLUMN]])
-        alignments = dijkstra_less_memory.apply(trace, net, im, fm, parameters={dijkstra_less_memory.Parameters.PARAM_ALIGNMENT_RESULT_IS_SYNC_PROD_AWARE: True})
-    
-        print("Trace:", trace)
-        print("Alignments:", alignments)
-        current_marking = im
+    :param petri_net: The Petri net tuple.
+    :param log: The log DataFrame.
+    :param regression_models: The trained model of every transition.
+    :param feature_columns: The list of feature columns.
+    :param threshold: The cutoff probability.
+    :param method: The regression method the models were trained with.
+    :param alignments: The alignments per variant. Computed on the fly if not given.
+    :param compiled_net: The compiled replay structure of the net. Compiled on the fly if not given.
+    :param probabilities_filepath: Where to store the enabled probabilities of every event, in the order of the returned log.
+    '''
+    if alignments is None:
+        alignments = align_variants(log, petri_net)
+    if compiled_net is None:
+        compiled_net = CompiledPetriNet(petri_net)
+
+    def replay_variant(alignment_moves: list, trace_length: int) -> list[int]:
+        # Every alignment move writes the enabled activities of the current row, so the last marking per row wins
+        decision_markings: dict[int, int] = {}
+        current_marking = compiled_net.initial_marking
         current_row_index = 0
 
-        for alignment in alignments["alignment"]:
-            current_data_state = group[feature_columns].iloc[[current_row_index]]
-            #print("Data state df:", current_data_state)
-
-            def traverse_petri_net(node: Node, current_marking: Marking):
-
-                enabled_transitions: set[PetriNet.Transition] = pm4py.get_enabled_transitions(net, current_marking)                
-
-                # Compute weighted sum of probabilities of enabled transitions
-                probs_all = [regression_models[enabled_transition].predict_proba(current_data_state)[0] if regression_models[enabled_transition]!=1 else 1 for enabled_transition in enabled_transitions]
-                print("Probs all: ", probs_all)
-
-                if method == "logistic_regression":
-                    probs = [regression_models[enabled_transition].predict_proba(current_data_state)[0][1] if regression_models[enabled_transition]!=1 else 1 for enabled_transition in enabled_transitions]
-                elif method == "random_forest":                  
-                    probs = [regression_models[enabled_transition].predict_proba(current_data_state)[0][1] if len(regression_models[enabled_transition].predict_proba(current_data_state)[0]) != 1 else 1 for enabled_transition in enabled_transitions]
-
-                print("Probs: ", probs)
-
-
-
-                sum_of_probs = sum(probs)
-
-                # Add all activities as children of the node
-                for enabled_transition in enabled_transitions:
-                    if method == "logistic_regression":
-                        probability = regression_models[enabled_transition].predict_proba(current_data_state)[0][1] if regression_models[enabled_transition]!=1 else 1
-                    elif method == "random_forest":
-                        probability = regression_models[enabled_transition].predict_proba(current_data_state)[0][1] if len(regression_models[enabled_transition].predict_proba(current_data_state)[0]) != 1 else 1
-                    probability /= sum_of_probs
-                    child_node = Node(enabled_transition.name, parent=node, transition=enabled_transition, probability=probability)
-                    if child_node.transition.label is None:
-                        #print("Silent transition found!")
-                        traverse_petri_net(child_node, PetriNetSemantics.fire(net, enabled_transition, current_marking))
-            
-            root = Node("root", probability=1)
-            traverse_petri_net(root, current_marking)
-
-            def traverse_tree_dfs(node, path):
-                path.append(node)
-                if not node.children:
-                    paths.append(path.copy())
-                for child in node.children:
-                    traverse_tree_dfs(child, path)
-                path.pop()
-
-            # Start DFS from the root node
-            paths = []
-            traverse_tree_dfs(root, [])
-            print(f"Paths: {paths}")
-
-            choices = [(prod([node.probability for node in path]), path[-1].transition.label) for path in paths]
-            choices_filtered = tuple(sorted(set([choice[1] for choice in choices if choice[0] > threshold]), key=str.lower))
-            print(f"Filtered choices: {choices_filtered}")
-            
-            # # Add enabled activities to the DataFrame
-            group["enabled_activities"].iloc[current_row_index] = choices_filtered
+        for alignment in alignment_moves:
+            decision_markings[current_row_index] = current_marking
 
             # Increment data state index if transition is not silent
             if alignment[1][1] is not None: current_row_index += 1
 
-             # Find the transition that was fired
+            # Increment marking by firing the transition (log moves do not change the marking)
             fired_transition_name: str = alignment[0][1]
-            #print("Fired transition name:", fired_transition_name)
-            fired_transition: PetriNet.Transition = next(filter(lambda transition: transition.name == fired_transition_name, net.transitions))
-            # Increment marking by firing the transition
-            current_marking = PetriNetSemantics.fire(net, fired_transition, current_marking)
-        return group
-
-    return log.groupby(CASE_COLUMN, group_keys=False).apply(fill_enabled_activities_column).reset_index()
\ No newline at end of file
+            if fired_transition_name != ">>":
+                current_marking = compiled_net.fire(current_marking, compiled_net.transition_id(fired_transition_name))
+
+        return [decision_markings[row_index] for row_index in range(trace_length)]
+
+    # Group the rows of the log by the marking in which they are decided
+    rows_by_marking: dict[int, list[np.ndarray]] = {}
+    for variant, positions in positions_by_variant(log).items():
+        for row_index, marking in enumerate(replay_variant(alignments[variant], len(variant))):
+            rows_by_marking.setdefault(marking, []).append(positions[:, row_index])
+
+    # The silent closure of a marking tells which transitions have to be predicted and how their probabilities combine
+    enabled_rows: EnabledRows = {}
+    for marking, rows in rows_by_marking.items():
+        closure = compiled_net.silent_closure(marking)
+        enabled_rows[marking] = (np.concatenate(rows), [compiled_net.transitions[transition] for transition in closure.transitions])
+
+    X = log[feature_columns].to_numpy(dtype=float)
+    probabilities = predict_enabled_probabilities(enabled_rows, regression_models, X)
+    print(f"Predicted {len(log)} events in {len(enabled_rows)} markings")
+
+    # Keep the label probabilities of every event, so the log can be re-thresholded without replaying it again
+    blocks = []
+    for marking, (rows, _) in enabled_rows.items():
+        closure = compiled_net.silent_closure(marking)
+        blocks.append((rows, closure.labels, closure.label_probabilities(probabilities[marking])))
+    enabled_probabilities = EnabledProbabilities.from_blocks(len(log), blocks)
+    log["enabled_activities"] = enabled_probabilities.enabled_activities(threshold)
+
+    # The events keep their order, like the rows of groupby(...).apply(...) with same-indexed results
+    if probabilities_filepath is not None:
+        enabled_probabilities.save(probabilities_filepath)
+    return log.reset_index()
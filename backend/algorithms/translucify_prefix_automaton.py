@@ -1,64 +1,319 @@
-from math import prod
-import os
-from sys import prefix
+from collections import Counter
+import gzip
+import json
+import logging
 
 import numpy as np
-import regex
 from sklearn.calibration import LabelEncoder
-from sklearn.ensemble import RandomForestClassifier
 from sklearn.linear_model import LogisticRegression
-from sklearn.model_selection import train_test_split
-from .preprocessor import import_csv
+from .preprocessor import ColumnMapping, fetch_dataframe, positions_by_variant
+from .artifact_cache import load_artifact, log_content_hash, prefix_automaton_artifact_name, save_artifact
+from .batched_inference import EnabledRows, Model, class_probabilities, predict_enabled_probabilities
+from .enabled_probabilities import EnabledProbabilities
+from .instrumentation import RunMetrics
+from .model_training import TRAINING_MODES, train_models, train_state_models
+from .observation_store import ObservationStore
+from .postprocessor import ENCODING_VERSION, encode_compact_prefix_automaton, encode_prefix_automaton
 import pandas as pd
-from pm4py import read_xes
-from .transition_system import TransitionSystem, State, Transition
-from pm4py.objects.log.util.dataframe_utils import convert_timestamp_columns_in_df
+from .transition_system import CompactTransitionSystem, TransitionSystem, State
+
+# Debug output of the discovery, e.g. whole DataFrames, which is only rendered if enabled
+logger = logging.getLogger(__name__)
 
 DataState = dict[str, float]
-ObservationInstances = dict[Transition, tuple[list[DataState], list[bool]]]
-RegressionModels = dict[Transition, LogisticRegression]
+ObservationInstances = ObservationStore
+# Trained model of every transition, keyed by the transition ID of the compact prefix automaton
+RegressionModels = dict[int, LogisticRegression]
 
 ACTIVITY_COLUMN = "concept:name"
 CASE_COLUMN = "case:concept:name"
 TIMESTAMP_COLUMN = "time:timestamp"
+# State that collects the events pruned from a bounded prefix automaton
+FALLBACK_STATE_NAME = "<*>"
+# Part of the artifact name of stored automata, changed whenever the automaton built from a log changes
+PREFIX_AUTOMATON_VERSION = 2
+# Encodings of the prefix automaton served to the frontend
+PREFIX_AUTOMATON_ENCODINGS = ("react_flow", "compact")
+
+def generate_prefix_automaton(log: pd.DataFrame, max_depth: int | None = None, min_frequency: int = 1, k_tail: int | None = None) -> CompactTransitionSystem:
+    '''
+    Builds the prefix automaton of a log as a trie. Every variant is inserted once together with its number of cases,
+    and every step is a lookup in the children of the current state, keyed by activity.
+    The trie is returned in compact form, state names (e.g. "<,a,b>") are only assembled when it is encoded.
+
+    The size of the automaton can be bounded. Events that would reach a state deeper than max_depth, or a state reached
+    by fewer than min_frequency cases, go to the fallback state "<*>" instead, which keeps a self-loop for every
+    activity that occurs after it. With k_tail, states are identified by the last k activities instead of the whole
+    prefix (e.g. "<*,a,b>" for k = 2), so the number of states is bounded by the number of activity sequences of length k.
+    The frequencies of states and transitions count cases, also when a case passes a merged state more than once.
+
+    :param log: The log DataFrame.
+    :param max_depth: The maximum length of the prefix of a state.
+    :param min_frequency: The minimum number of cases that reach a state.
+    :param k_tail: The number of last activities that identify a state.
+    '''
+    if k_tail is not None and k_tail < 1:
+        raise ValueError("Invalid k-tail. Please provide a positive number of activities")
+    variant_counts = Counter(log.groupby(CASE_COLUMN)[ACTIVITY_COLUMN].agg(tuple))
+
+    # Trie nodes as parallel lists, node 0 is the start state
+    children: list[dict[str, int]] = [{}]
+    parents: list[int] = [-1]
+    activities: list[str | None] = [None]
+    frequencies: list[int] = [0]
+    # With k-tail, nodes are merged by the last k activities of their prefix
+    tails: dict[tuple[str, ...], int] = {(): 0}
+    node_tails: list[tuple[str, ...]] = [()]
+    for variant, count in variant_counts.items():
+        node = 0
+        frequencies[node] += count
+        # A case can pass a merged k-tail node more than once, but counts once towards its frequency
+        visited = {node}
+        for depth, activity in enumerate(variant):
+            if max_depth is not None and depth >= max_depth:
+                break
+            child = children[node].get(activity)
+            if child is None:
+                tail = (node_tails[node] + (activity,))[-k_tail:] if k_tail is not None else None
+                child = tails.get(tail) if k_tail is not None else None
+                if child is None:
+                    child = len(children)
+                    children.append({})
+                    parents.append(node)
+                    activities.append(activity)
+                    frequencies.append(0)
+                    if k_tail is not None:
+                        tails[tail] = child
+                        node_tails.append(tail)
+                children[node][activity] = child
+            if child not in visited:
+                visited.add(child)
+                frequencies[child] += count
+            node = child
+
+    is_bounded = k_tail is not None or min_frequency > 1 or (max_depth is not None and any(len(variant) > max_depth for variant in variant_counts))
+    if not is_bounded:
+        print(f"Prefix automaton with {len(children)} states from {len(variant_counts)} variants")
+
+        # Every node but the start state is the target of exactly one transition, from its parent
+        return CompactTransitionSystem.from_edges(
+            "prefix_automaton",
+            len(children),
+            parents[1:],
+            np.arange(1, len(children)),
+            activities[1:],
+            state_frequency=frequencies,
+            state_parent=parents,
+            state_activities=activities,
+        )
+
+    return bound_prefix_automaton(variant_counts, children, parents, activities, frequencies, node_tails, max_depth, min_frequency, k_tail)
+
+def bound_prefix_automaton(variant_counts: Counter, children: list[dict[str, int]], parents: list[int], activities: list[str | None], frequencies: list[int], node_tails: list[tuple[str, ...]], max_depth: int | None, min_frequency: int, k_tail: int | None) -> CompactTransitionSystem:
+    '''
+    Removes the nodes reached by fewer than min_frequency cases from a (k-tail) trie and replays every variant on the
+    remaining nodes to count the frequencies of states and transitions. Events that leave the remaining nodes go to
+    the fallback state, which is never left again.
+
+    :param variant_counts: The number of cases of every variant.
+    :param children: The child of every node per activity.
+    :param parents: The parent of every node.
+    :param activities: The activity leading into every node.
+    :param frequencies: The number of cases that reach every node.
+    :param node_tails: The last k activities of every node of a k-tail trie.
+    :param max_depth: The maximum length of the prefix of a state.
+    :param min_frequency: The minimum number of cases that reach a state.
+    :param k_tail: The number of last activities that identify a state, or None for a plain trie.
+    '''
+    kept_nodes = [node for node, frequency in enumerate(frequencies) if node == 0 or frequency >= min_frequency]
+    state_of_node = {node: state for state, node in enumerate(kept_nodes)}
+    fallback_state = len(kept_nodes)
+
+    state_frequency = [0] * (len(kept_nodes) + 1)
+    # (source state, activity) -> [target state, frequency]
+    edges: dict[tuple[int, str], list[int]] = {}
+    for variant, count in variant_counts.items():
+        node, state = 0, 0
+        state_frequency[state] += count
+        # Count the cases entering a state or taking a transition, not how often they do, like in the unbounded trie
+        visited_states, visited_edges = {state}, set()
+        for depth, activity in enumerate(variant):
+            child = children[node].get(activity) if node >= 0 and (max_depth is None or depth < max_depth) else None
+            if child is not None and child in state_of_node:
+                node, next_state = child, state_of_node[child]
+            else:
+                node, next_state = -1, fallback_state
+
+            edge = edges.setdefault((state, activity), [next_state, 0])
+            if (state, activity) not in visited_edges:
+                visited_edges.add((state, activity))
+                edge[1] += count
+            if next_state not in visited_states:
+                visited_states.add(next_state)
+                state_frequency[next_state] += count
+            state = next_state
+
+    if state_frequency[fallback_state] == 0:
+        state_frequency.pop()
+
+    # Name the states after their (tail of the) prefix, the fallback state is "<*>"
+    names: list[str] = []
+    prefixes: dict[int, str] = {0: ""}
+    for node in kept_nodes:
+        if k_tail is not None:
+            tail = node_tails[node]
+            names.append(f"<{'*' if len(tail) == k_tail else ''}{''.join(',' + activity for activity in tail)}>")
+        else:
+            if node > 0:
+                prefixes[node] = prefixes[parents[node]] + "," + activities[node]
+            names.append(f"<{prefixes[node]}>")
+    if len(state_frequency) > len(kept_nodes):
+        names.append(FALLBACK_STATE_NAME)
+
+    print(f"Bounded prefix automaton with {len(names)} states (of {len(frequencies)}) from {len(variant_counts)} variants")
+
+    sources = [source for source, _ in edges]
+    return CompactTransitionSystem.from_edges(
+        "prefix_automaton",
+        len(names),
+        sources,
+        [target for target, _ in edges.values()],
+        [activity for _, activity in edges],
+        state_frequency=state_frequency,
+        edge_frequency=[frequency for _, frequency in edges.values()],
+        state_names=names,
+    )
+
+def cached_compact_prefix_automaton(log_filepath: str, log_type: str, max_depth: int | None = None, min_frequency: int = 1, k_tail: int | None = None, column_mapping: ColumnMapping | None = None) -> CompactTransitionSystem:
+    '''
+    Returns the prefix automaton of a log file. It is stored as an artifact of the log content, so the log is only
+    read and the automaton only built when the file changed or the options were not requested before.
+
+    :param log_filepath: The file path of the log.
+    :param log_type: The type of the log file, "CSV" or "XES".
+    :param max_depth: The maximum prefix length, see generate_prefix_automaton.
+    :param min_frequency: The minimum case frequency of a state, see generate_prefix_automaton.
+    :param k_tail: The length of the suffix that identifies a state, see generate_prefix_automaton.
+    :param column_mapping: The original column of the case ID, activity and timestamp.
+    '''
+    log_hash = log_content_hash(log_filepath, column_mapping)
+    artifact_name = prefix_automaton_artifact_name({"max_depth": max_depth, "min_frequency": min_frequency, "k_tail": k_tail, "automaton_version": PREFIX_AUTOMATON_VERSION})
+    prefix_automaton = load_artifact(log_hash, artifact_name)
+    if prefix_automaton is None:
+        # Only the case and activity columns are needed to build the automaton
+        log = fetch_dataframe(log_filepath, log_type, [CASE_COLUMN, ACTIVITY_COLUMN], categorical=False, column_mapping=column_mapping)
+        prefix_automaton = generate_prefix_automaton(log, max_depth, min_frequency, k_tail)
+        save_artifact(log_hash, artifact_name, prefix_automaton, log_filepath)
+    return prefix_automaton
 
-def generate_prefix_automaton(log: pd.DataFrame):
-    prefix_automaton = TransitionSystem(name="prefix_automaton", states=set(), transitions=set())
-    # Add start state
-    prefix_automaton.states.add(State("<>", data={"frequency": 0}))
 
-    print(prefix_automaton.states)
+def cached_prefix_automaton(log_filepath: str, log_type: str, encoding: str = "react_flow", max_depth: int | None = None, min_frequency: int = 1, k_tail: int | None = None, column_mapping: ColumnMapping | None = None) -> tuple[str, bytes]:
+    '''
+    Returns the encoded prefix automaton of a log file as gzip-compressed JSON, together with a tag that changes
+    whenever the automaton does. Like the automaton, the encoding is stored as an artifact of the log content.
+
+    :param log_filepath: The file path of the log.
+    :param log_type: The type of the log file, "CSV" or "XES".
+    :param encoding: "react_flow" for the shape of encode_prefix_automaton, "compact" for encode_compact_prefix_automaton.
+    :param max_depth: The maximum prefix length, see generate_prefix_automaton.
+    :param min_frequency: The minimum case frequency of a state, see generate_prefix_automaton.
+    :param k_tail: The length of the suffix that identifies a state, see generate_prefix_automaton.
+    :param column_mapping: The original column of the case ID, activity and timestamp.
+    '''
+    if encoding not in PREFIX_AUTOMATON_ENCODINGS:
+        raise ValueError(f"Invalid encoding {encoding}. Please provide one of: {', '.join(PREFIX_AUTOMATON_ENCODINGS)}")
 
-    def extend_prefix_automaton_with_trace(group: pd.DataFrame):
-        trace = list(group["concept:name"].values)
-        # Get start state
-        curr_prefix = ""
-        curr_state: State = next((state for state in prefix_automaton.states if state.name == f"<{curr_prefix}>"), None)
-        curr_state.data["frequency"] += 1
-        for activity in trace:
-            
-            next_prefix = curr_prefix + ","+ activity
-            # Check if activity is already in the automaton 
-            next_state = next((state for state in prefix_automaton.states if state.name == f"<{next_prefix}>"), None)
-            if not next_state:
-                next_state = State(f"<{next_prefix}>", data={"frequency": 0})
-                print("Activity: ", activity)
-                new_transition = Transition(activity, curr_state, next_state)
-                curr_state.outgoing.add(new_transition)
-                next_state.incoming.add(new_transition)
-                prefix_automaton.states.add(next_state)
-                prefix_automaton.transitions.add(new_transition)
-            curr_state = next_state
-            curr_prefix = next_prefix
-            curr_state.data["frequency"] += 1
-        return group
-    
-    log.groupby("case:concept:name", group_keys=False).apply(extend_prefix_automaton_with_trace, include_groups=False).reset_index()
+    log_hash = log_content_hash(log_filepath, column_mapping)
+    artifact_name = prefix_automaton_artifact_name({"max_depth": max_depth, "min_frequency": min_frequency, "k_tail": k_tail, "automaton_version": PREFIX_AUTOMATON_VERSION, "version": ENCODING_VERSION}, encoding)
+    tag = log_hash[:16] + "-" + artifact_name.removesuffix(".json.gz")
 
-    return prefix_automaton
+    payload = load_artifact(log_hash, artifact_name)
+    if payload is None:
+        prefix_automaton = cached_compact_prefix_automaton(log_filepath, log_type, max_depth, min_frequency, k_tail, column_mapping)
+        encoded = encode_compact_prefix_automaton(prefix_automaton) if encoding == "compact" else encode_prefix_automaton(prefix_automaton)
+        payload = gzip.compress(json.dumps(encoded, separators=(",", ":")).encode(), compresslevel=6)
+        save_artifact(log_hash, artifact_name, payload, log_filepath)
+        print(f"Cached prefix automaton of {log_filepath} ({len(payload)} bytes compressed)")
+    return tag, payload
+
+
+def assign_states(log: pd.DataFrame, prefix_automaton: CompactTransitionSystem) -> np.ndarray:
+    '''
+    Returns the state of the prefix automaton in which each event occurs, i.e. the state reached by the events
+    before it in its case, or -1 once the case left the automaton. The automaton is walked for all cases at once,
+    one event position at a time.
+
+    :param log: The log DataFrame.
+    :param prefix_automaton: The prefix automaton in compact form.
+    '''
+    case_codes = log.groupby(CASE_COLUMN, sort=False).ngroup().to_numpy()
+    positions = log.groupby(CASE_COLUMN, sort=False).cumcount().to_numpy()
+    activity_values, activity_uniques = pd.factorize(log[ACTIVITY_COLUMN])
+    activity_codes = np.array([prefix_automaton.activity_code(activity) for activity in activity_uniques], dtype=np.int64)[activity_values]
+
+    # Events sorted by their position within the case, so every step of the walk is one contiguous slice
+    events_by_position = np.lexsort((case_codes, positions))
+    position_offsets = np.searchsorted(positions[events_by_position], np.arange(positions.max(initial=-1) + 2))
+
+    states = np.full(len(log), -1, dtype=np.int64)
+    case_states = np.full(case_codes.max(initial=-1) + 1, prefix_automaton.start_state, dtype=np.int64)
+    for position in range(len(position_offsets) - 1):
+        events = events_by_position[position_offsets[position]:position_offsets[position + 1]]
+        cases = case_codes[events]
+        current_states = case_states[cases]
+        states[events] = current_states
+
+        edges = prefix_automaton.find_edges(np.maximum(current_states, 0), activity_codes[events])
+        found = (current_states >= 0) & (edges >= 0)
+        next_states = np.full(len(events), -1, dtype=np.int64)
+        next_states[found] = prefix_automaton.edge_target[edges[found]]
+        case_states[cases] = next_states
+    return states
+
+def enabled_activities_by_state(prefix_automaton: CompactTransitionSystem, states: np.ndarray, threshold: float) -> np.ndarray:
+    '''
+    Returns, for each of the given states, the tuple of outgoing activities whose share of the outgoing transition
+    frequency is at least the threshold.
+
+    :param prefix_automaton: The prefix automaton in compact form.
+    :param states: The states.
+    :param threshold: The minimum share of the frequency.
+    '''
+    enabled_activities = np.empty(len(states), dtype=object)
+    for index, state in enumerate(states.tolist()):
+        edges = prefix_automaton.outgoing(state)
+        frequencies = prefix_automaton.edge_frequency[edges]
+        frequency_sum = frequencies.sum()
+        enabled_edges = edges[frequencies / frequency_sum >= threshold] if frequency_sum > 0 else edges[:0]
+        enabled_activities[index] = tuple(sorted((prefix_automaton.transition_name(edge) for edge in enabled_edges.tolist()), key=str.lower))
+    return enabled_activities
 
 # Translucent log generation with simple frequency threshold
-def fill_enabled_activities(log: pd.DataFrame, prefix_automaton: TransitionSystem, threshold=0.1):
+def fill_enabled_activities(log: pd.DataFrame, prefix_automaton: TransitionSystem | CompactTransitionSystem, threshold=0.1, vectorized: bool = False):
+    '''
+    Adds the enabled_activities column to the log: the outgoing activities of the state of every event whose share of
+    the outgoing frequency is at least the threshold.
+    In vectorized mode, the states of all events are assigned in one walk and the enabled activities are computed
+    once per state and taken into the column. The frequency of a transition is then the number of cases that took it.
+    Events of cases that left the automaton keep None.
+
+    :param log: The log DataFrame.
+    :param prefix_automaton: The prefix automaton, as object graph or in compact form.
+    :param threshold: The minimum share of the frequency.
+    :param vectorized: Whether to use the vectorized mode.
+    '''
+    if vectorized:
+        if isinstance(prefix_automaton, TransitionSystem):
+            prefix_automaton = CompactTransitionSystem.from_transition_system(prefix_automaton)
+        states = assign_states(log, prefix_automaton)
+        used_states, state_of_event = np.unique(states, return_inverse=True)
+        table = np.empty(len(used_states), dtype=object)
+        table[used_states >= 0] = enabled_activities_by_state(prefix_automaton, used_states[used_states >= 0], threshold)
+        log["enabled_activities"] = table[state_of_event.reshape(-1)]
+        return log
+
+    if isinstance(prefix_automaton, CompactTransitionSystem):
+        prefix_automaton = prefix_automaton.to_transition_system()
 
     log["enabled_activities"] = None
 
@@ -68,19 +323,18 @@ def fill_enabled_activities(log: pd.DataFrame, prefix_automaton: TransitionSyste
         curr_state: State = next((state for state in prefix_automaton.states if state.name == f"<{curr_prefix}>"), None)
 
         for (index, _), activity in zip(group.iterrows(), trace):
-            print("INDEX:", index)
             curr_prefix += activity
-            print("Current state:", curr_state)
-            print("Current prefix:", curr_prefix)
-            frequency_sum = sum([transition.to_state.data["frequency"] for transition in curr_state.outgoing])
-            print("Frequency sum:", frequency_sum)
-            available_activities = [transition.name for transition in curr_state.outgoing]
-            print("Available activities:", available_activities)
-            enabled_activities = [transition.name for transition in curr_state.outgoing if transition.to_state.data["frequency"] / frequency_sum >= threshold]
-            print("Enabled activities:", enabled_activities)
+            logger.debug("Event %s in state %s after prefix %s", index, curr_state, curr_prefix)
+            # Like in vectorized mode, the frequency of a transition is the number of cases that took it
+            frequencies = {transition: transition.data.get("frequency", transition.to_state.data["frequency"]) for transition in curr_state.outgoing}
+            frequency_sum = sum(frequencies.values())
+            enabled_activities = [transition.name for transition, frequency in frequencies.items() if frequency_sum > 0 and frequency / frequency_sum >= threshold]
+            logger.debug("Enabled activities: %s", enabled_activities)
             log.at[index, 'enabled_activities'] = tuple(sorted(enabled_activities, key=str.lower))
             next_transition = next((transition for transition in curr_state.outgoing if transition.name == activity), None)
-            print("Next transition:", next_transition)
+            # The case left a bounded automaton, its remaining events keep None
+            if next_transition is None:
+                break
             curr_state = next_transition.to_state
         return group
     
@@ -92,182 +346,221 @@ def fill_enabled_activities(log: pd.DataFrame, prefix_automaton: TransitionSyste
 
 # Multivariate Logistic Regression with Prefix Automaton
 
-def translucify_prefix_automaton(log_filepath: str, prefix_automaton: TransitionSystem, data_columns: list[dict[str]], method, threshold=0.1):
+def translucify_prefix_automaton(log_filepath: str, prefix_automaton: TransitionSystem | CompactTransitionSystem, data_columns: list[dict[str]], method, threshold=0.1, training_workers: int = 1, evaluate: bool = True, probabilities_filepath: str | None = None, metrics: RunMetrics | None = None, training_mode: str = "transition", column_mapping: ColumnMapping | None = None):
+    '''
+    Discovers a translucent log from a given log file path and prefix automaton using a threshold.
+
+    :param log_filepath: The file path of the log file.
+    :param prefix_automaton: The prefix automaton of the log, as object graph or in compact form.
+    :param data_columns: The selected data columns and their types.
+    :param method: The regression method: logistic_regression or random_forest.
+    :param threshold: The cutoff percentage.
+    :param training_workers: The maximum number of models trained concurrently.
+    :param evaluate: Whether to compute the held-out accuracy of the models.
+    :param probabilities_filepath: Where to store the enabled probabilities of every event for re-thresholding.
+    :param metrics: Collects the duration, memory usage and item counts of every stage.
+    :param training_mode: "transition" trains one binary model per transition, "state" one multiclass model per state.
+    :param column_mapping: The original column of the case ID, activity and timestamp, if they are not named by the XES standard.
+    '''
+    if training_mode not in TRAINING_MODES:
+        raise ValueError(f"Invalid training mode {training_mode}. Please provide a valid training mode: {', '.join(TRAINING_MODES)}")
+
+    if metrics is None:
+        metrics = RunMetrics("prefix_automaton")
 
     # If log flie is a CSV file, import it as a DataFrame
     # Else if log file is a XES file, import it as a log object
-    if log_filepath.endswith(".csv"):
-        log = pd.read_csv(log_filepath, sep=";")
-
-        print("Event log from CSV: \n", log)
-        log = convert_timestamp_columns_in_df(log)
-        log[CASE_COLUMN] = log[CASE_COLUMN].astype("string")
-    else:
-        log = read_xes(log_filepath)
+    with metrics.stage("read_log"):
+        # Read from the typed columnar copy of the log, the timestamp columns are already converted there
+        if log_filepath.endswith(".csv"):
+            log = fetch_dataframe(log_filepath, "CSV", categorical=False, column_mapping=column_mapping)
+
+            logger.debug("Event log from CSV:\n %s", log)
+            log[CASE_COLUMN] = log[CASE_COLUMN].astype("string")
+        else:
+            log = fetch_dataframe(log_filepath, "XES", categorical=False, column_mapping=column_mapping)
+    metrics.count("events", len(log))
+    metrics.count("cases", log[CASE_COLUMN].nunique())
+    metrics.count("variants", log.groupby(CASE_COLUMN)[ACTIVITY_COLUMN].agg(tuple).nunique())
+    if isinstance(prefix_automaton, TransitionSystem):
+        prefix_automaton = CompactTransitionSystem.from_transition_system(prefix_automaton)
+    metrics.count("states", prefix_automaton.number_of_states)
+    metrics.count("transitions", prefix_automaton.number_of_transitions)
 
     # Preprocess log using one-hot encoding
-    if method == "logistic_regression":
-        categorical_columns = [data_column["column"] for data_column in data_columns if data_column["type"] == "categorical"]
-        print("Categorical columns: ", categorical_columns)
-        log = pd.get_dummies(log, columns=categorical_columns, dtype=int)
-    # Scikit tends to perform well with categorical variables encoded as integers
-    elif method == "random_forest":
-        le = LabelEncoder()
-        for data_column in data_columns:
-            if data_column["type"] == "categorical":
-                log[data_column["column"]] = le.fit_transform(log[data_column["column"]])
-
+    with metrics.stage("preprocessing"):
+        if method == "logistic_regression":
+            categorical_columns = [data_column["column"] for data_column in data_columns if data_column["type"] == "categorical"]
+            print("Categorical columns: ", categorical_columns)
+            log = pd.get_dummies(log, columns=categorical_columns, dtype=int)
+        # Scikit tends to perform well with categorical variables encoded as integers
+        elif method == "random_forest":
+            le = LabelEncoder()
+            for data_column in data_columns:
+                if data_column["type"] == "categorical":
+                    log[data_column["column"]] = le.fit_transform(log[data_column["column"]])
 
-    print(f"Log after preprocessing:\n {log}")
 
-    # log = preprocess_log(log, selected_columns)
-    print(f"Log after preprocessing:\n {log}")
+    logger.debug("Log after preprocessing:\n %s", log)
 
     # # Select all log columns as features as long as their names start with a selected column name (Due to one-hot encoding)
     feature_columns = [column for column in log.columns if any([column.startswith(data_column["column"]) for data_column in data_columns])]
-    print(f"Feature Columns:\n {feature_columns}")
-    observation_instances = extract_observation_instances(log, prefix_automaton, feature_columns)
-    print("Observation instances: ", observation_instances)
-    regression_models = create_regression_models(observation_instances, feature_columns, method)
-    log = create_enabled_activities(prefix_automaton, log, regression_models, feature_columns, threshold, method)
+    logger.debug("Feature columns:\n %s", feature_columns)
+    with metrics.stage("observation_extraction"):
+        observation_instances = extract_observation_instances(log, prefix_automaton, feature_columns, training_mode)
+    logger.debug("Observation instances: %s", observation_instances.summary())
+    metrics.count("observations", sum(observations for _, observations, _ in observation_instances.summary()))
+    metrics.count("models", len(observation_instances))
+    with metrics.stage("training"):
+        regression_models = create_regression_models(observation_instances, feature_columns, method, training_workers, evaluate, prefix_automaton, training_mode)
+    with metrics.stage("enabled_activities"):
+        log = create_enabled_activities(prefix_automaton, log, regression_models, feature_columns, threshold, method, probabilities_filepath, training_mode)
     return log
 
-def extract_observation_instances(log: pd.DataFrame, prefix_automaton: TransitionSystem, feature_columns: list[str]) -> ObservationInstances:
-    observation_instances: ObservationInstances = { transition: ([], []) for transition in prefix_automaton.transitions}
-    def fill_observation_instances(group: pd.Series) -> pd.DataFrame:
-        trace = list(group[ACTIVITY_COLUMN].values)
-        
-        current_data_state_index = 0
-        current_state: State = next((state for state in prefix_automaton.states if state.name == "<>"), None)
+def extract_observation_instances(log: pd.DataFrame, prefix_automaton: CompactTransitionSystem, feature_columns: list[str], training_mode: str = "transition") -> ObservationInstances:
+    '''
+    Creates observation instances for each transition of the prefix automaton.
+    The data states are stored once in a feature matrix, each transition only keeps row indices and labels.
+    In state mode, the observation instances are grouped by state instead and labelled with the transition that fired.
+    States with a single outgoing transition get no observation instances, as there is nothing to choose from.
 
-        for activity in trace:
-            enabled_transitions = [transition for transition in current_state.outgoing]
-            fired_transition = next((transition for transition in enabled_transitions if transition.name == activity), None)
-
-            try:
-                current_data_state: list[list[float | int]] = group[feature_columns].iloc[current_data_state_index].to_list()
-            except IndexError:
-                current_data_state: list[list[float | int]] = group[feature_columns].iloc[-1].to_list()
-            
-            for enabled_transition in enabled_transitions:
-                # Add each instances to dictionary
-                observation_instances[enabled_transition][0].append(current_data_state)
-                observation_instances[enabled_transition][1].append(fired_transition == enabled_transition)
-
-            current_data_state_index += 1
+    :param log: The log DataFrame.
+    :param prefix_automaton: The prefix automaton in compact form.
+    :param feature_columns: The list of feature columns.
+    :param training_mode: "transition" or "state".
+    '''
+    X = log[feature_columns].to_numpy(dtype=float)
+    if training_mode == "state":
+        choice_states = np.flatnonzero(np.diff(prefix_automaton.edge_offsets) > 1)
+        observation_instances: ObservationInstances = ObservationStore(X, choice_states.tolist(), label_dtype=np.int64)
+    else:
+        observation_instances: ObservationInstances = ObservationStore(X, range(prefix_automaton.number_of_transitions))
+
+    for variant, positions in positions_by_variant(log).items():
+        current_state = prefix_automaton.start_state
+
+        for data_state_index, activity in enumerate(variant):
+            fired_transition = prefix_automaton.find_edge(current_state, activity)
+            enabled_transitions = prefix_automaton.outgoing(current_state).tolist()
+
+            if training_mode == "state":
+                if fired_transition >= 0 and len(enabled_transitions) > 1:
+                    observation_instances.add(current_state, positions[:, data_state_index], fired_transition)
+            else:
+                for enabled_transition in enabled_transitions:
+                    # Add the data state of every case of the variant to the store
+                    observation_instances.add(enabled_transition, positions[:, data_state_index], fired_transition == enabled_transition)
+
+            # The automaton does not know how the variant continues
+            if fired_transition < 0:
+                break
             # Increment marking by firing the transition
-            current_state = fired_transition.to_state
-
-        return group
+            current_state = int(prefix_automaton.edge_target[fired_transition])
 
-    log.groupby(CASE_COLUMN, group_keys=False).apply(fill_observation_instances).reset_index()
+    if training_mode == "state":
+        # Drop the states that were never decided in
+        observation_instances = observation_instances.subset([state for state in observation_instances if len(observation_instances.rows(state)) > 0])
     return observation_instances
     
 
-def create_regression_models(observation_instances: ObservationInstances, feature_columns: list[str], method: str) -> RegressionModels:
+def create_regression_models(observation_instances: ObservationInstances, feature_columns: list[str], method: str, workers: int = 1, evaluate: bool = True, prefix_automaton: CompactTransitionSystem | None = None, training_mode: str = "transition") -> RegressionModels:
     '''
-    Receives a dictionary of observation instances and creates a regression model for each transition.
-    :param observation_instances: The dictionary of observation instances.
+    Receives the observation instances and creates a regression model for each transition,
+    or a multiclass model for each state in state mode.
+    
+    :param observation_instances: The observation instances of all transitions.
     :param feature_columns: The list of feature columns.
+    :param method: The regression method: logistic_regression or random_forest.
+    :param workers: The maximum number of models trained concurrently.
+    :param evaluate: Whether to compute the held-out accuracy of every model and store it in a csv file.
+    :param prefix_automaton: The prefix automaton, used to label the transitions in the csv file.
+    :param training_mode: "transition" or "state".
     '''
-    regression_models: RegressionModels = {transition: None for transition in observation_instances}
-
-    accuracy_scores: dict[Transition, float] = {}
-
-    for transition, (data_states, labels) in observation_instances.items():
-        X_dataframe = pd.DataFrame(data_states, columns=feature_columns)
-        Y_dataframe = pd.DataFrame(labels, columns=["label"]).astype(int)
-
-        # print("X_dataframe: ", X_dataframe)
-        # print("Y_dataframe: ", Y_dataframe)
-
-        X_train, X_test, Y_train, Y_test = train_test_split(X_dataframe, Y_dataframe, test_size=0.2)
-
-        try:
-            if method == "logistic_regression":
-                regression = LogisticRegression().fit(X_train, np.ravel(Y_train))
-            elif method == "random_forest":
-                print("using random forest")
-                regression = RandomForestClassifier().fit(X_train, np.ravel(Y_train))
-            # Add regression model to corresponding transition
-            regression_models[transition] = regression
-            accuracy_scores[transition] = regression.score(X_test, np.ravel(Y_test))
-        except ValueError:
-            #print("Valueerror!")
-            # Error if transition has a 100% change of firing. But there are some transitions that have 100% change of firing!
-            # => Set the regression model to 1
-            regression_models[transition] = 1
-            accuracy_scores[transition] = 1
-    
-    # Convert the accuracy scores into a dataframe then store in a csv file
-    accuracy_scores_dataframe = pd.DataFrame(accuracy_scores.items(), columns=["Transition", "Accuracy Score"])
-    file_path = 'pa_multivariate_regression_accuracy_scores.csv' if method == "logistic_regression" else 'pa_random_forest_accuracy_scores.csv'
-    accuracy_scores_dataframe.to_csv(file_path, index=False)
+    regression_models: RegressionModels
+    accuracy_scores: dict[int, float]
+    if training_mode == "state":
+        regression_models, accuracy_scores = train_state_models(observation_instances, method, workers, evaluate)
+    else:
+        regression_models, accuracy_scores = train_models(observation_instances, method, workers, evaluate)
+
+    if evaluate:
+        # Convert the accuracy scores into a dataframe then store in a csv file
+        if prefix_automaton is not None:
+            names = prefix_automaton.names()
+            if training_mode == "state":
+                accuracy_scores = {names[state]: accuracy_score for state, accuracy_score in accuracy_scores.items()}
+            else:
+                accuracy_scores = {prefix_automaton.transition_label(transition, names): accuracy_score for transition, accuracy_score in accuracy_scores.items()}
+        accuracy_scores_dataframe = pd.DataFrame(accuracy_scores.items(), columns=["State" if training_mode == "state" else "Transition", "Accuracy Score"])
+        file_path = 'pa_multivariate_regression_accuracy_scores.csv' if method == "logistic_regression" else 'pa_random_forest_accuracy_scores.csv'
+        accuracy_scores_dataframe.to_csv(file_path, index=False)
 
     return regression_models
 
-def create_enabled_activities(prefix_automaton: TransitionSystem, log: pd.DataFrame, regression_models: dict[Transition, LogisticRegression], feature_columns: list[str], threshold: float, method: str) -> pd.DataFrame:
-
-    # Add column enabled_activities
-    log["enabled_activities"] = None
-    print(log)
-
-    def fill_enabled_activities_column(group: pd.Series) -> pd.DataFrame:
-
-        trace = list(group[ACTIVITY_COLUMN].values)
-
-        current_data_state_index = 0
-        current_row_index = 0
+def predict_state_probabilities(model: Model | None, X: np.ndarray, transitions: list[int]) -> np.ndarray:
+    '''
+    Returns the probability of every outgoing transition of a state for every row of X. A single outgoing transition
+    always fires, and the transitions of a state without a model (e.g. never decided in) are equally likely.
 
-        try:
-            current_data_state: list[list[float | int]] = group[feature_columns].iloc[current_data_state_index].to_list()
-        except IndexError:
-            current_data_state: list[list[float | int]] = group[feature_columns].iloc[-1].to_list()
+    :param model: The multiclass model of the state, or None.
+    :param X: The feature matrix of the events decided in the state.
+    :param transitions: The outgoing transitions of the state.
+    '''
+    if len(transitions) <= 1 or model is None:
+        return np.full((len(X), len(transitions)), 1 / max(len(transitions), 1))
+    return class_probabilities(model, X, transitions)
 
-        current_state: State = next((state for state in prefix_automaton.states if state.name == "<>"), None)
+def create_enabled_activities(prefix_automaton: CompactTransitionSystem, log: pd.DataFrame, regression_models: RegressionModels, feature_columns: list[str], threshold: float, method: str, probabilities_filepath: str | None = None, training_mode: str = "transition") -> pd.DataFrame:
+    '''
+    Adds the enabled_activities column to the log.
+    Every variant is walked once to find the state each event is decided in. Then, for every transition, all data
+    states at which it is enabled are predicted in a single batched call. In state mode, the multiclass model of
+    every state predicts the distribution over its outgoing transitions for all its data states in a single call.
+
+    :param prefix_automaton: The prefix automaton in compact form.
+    :param log: The log DataFrame.
+    :param regression_models: The trained model of every transition.
+    :param feature_columns: The list of feature columns.
+    :param threshold: The cutoff probability.
+    :param method: The regression method the models were trained with.
+    :param probabilities_filepath: Where to store the enabled probabilities of every event, in the order of the returned log.
+    :param training_mode: "transition" or "state", the mode the models were trained in.
+    '''
+    def walk_variant(trace: tuple[str, ...]) -> list[int]:
+        states: list[int] = []
+        current_state = prefix_automaton.start_state
         for activity in trace:
-            
-            current_data_state = group[feature_columns].iloc[[current_row_index]]
-            #print("Data state df:", current_data_state)
-
-            enabled_transitions = current_state.outgoing
-            #print("Enabled transitions:", enabled_transitions)
-
-            # Compute weighted sum of probabilities of enabled transitions
-
-            if method == "logistic_regression":
-                probs = [regression_models[enabled_transition].predict_proba(current_data_state)[0][1] if regression_models[enabled_transition]!=1 else 1 for enabled_transition in enabled_transitions]
-            elif method == "random_forest":                  
-                probs = [regression_models[enabled_transition].predict_proba(current_data_state)[0][1] if len(regression_models[enabled_transition].predict_proba(current_data_state)[0]) != 1 else 1 for enabled_transition in enabled_transitions]
-
-
-            sum_of_probs = sum(probs)
-
-            choices = []
-
-            # Add all activities as children of the node
-            for enabled_transition in enabled_transitions:
-                if method == "logistic_regression":
-                    probability = regression_models[enabled_transition].predict_proba(current_data_state)[0][1] if regression_models[enabled_transition]!=1 else 1
-                elif method == "random_forest":
-                    probability = regression_models[enabled_transition].predict_proba(current_data_state)[0][1] if len(regression_models[enabled_transition].predict_proba(current_data_state)[0]) != 1 else 1
-                probability /= sum_of_probs
-                choices.append((probability, enabled_transition.name))
-
-            choices_filtered = tuple(sorted(set([choice[1] for choice in choices if choice[0] > threshold]), key=str.lower))
-            print(f"Filtered choices: {choices_filtered}")
-            
-            # # Add enabled activities to the DataFrame
-            group["enabled_activities"].iloc[current_row_index] = choices_filtered
-
-            current_row_index += 1
-            current_data_state_index += 1
-            fired_transition: Transition = next(filter(lambda transition: transition.name == activity, enabled_transitions), None)
-            print("Fired transition name:", fired_transition.name)
+            states.append(current_state)
+            fired_transition = prefix_automaton.find_edge(current_state, activity)
             # Increment marking by firing the transition
-            if fired_transition is not None:
-                current_state = fired_transition.to_state
+            if fired_transition >= 0:
+                current_state = int(prefix_automaton.edge_target[fired_transition])
+        return states
 
-        return group
+    # Group the rows of the log by the state in which they are decided
+    rows_by_state: dict[int, list[np.ndarray]] = {}
+    for variant, positions in positions_by_variant(log).items():
+        for row_index, state in enumerate(walk_variant(variant)):
+            rows_by_state.setdefault(state, []).append(positions[:, row_index])
 
-    return log.groupby(CASE_COLUMN, group_keys=False).apply(fill_enabled_activities_column).reset_index()
+    enabled_rows: EnabledRows = {state: (np.concatenate(rows), prefix_automaton.outgoing(state).tolist()) for state, rows in rows_by_state.items()}
+
+    X = log[feature_columns].to_numpy(dtype=float)
+    if training_mode == "state":
+        probabilities = {state: predict_state_probabilities(regression_models.get(state), X[rows], transitions) for state, (rows, transitions) in enabled_rows.items()}
+    else:
+        probabilities = predict_enabled_probabilities(enabled_rows, regression_models, X)
+    print(f"Predicted {len(log)} events in {len(enabled_rows)} states")
+
+    # Keep the normalized probabilities of every event, so the log can be re-thresholded without walking it again
+    blocks = []
+    for state, (rows, transitions) in enabled_rows.items():
+        state_probabilities = probabilities[state]
+        blocks.append((rows, [prefix_automaton.transition_name(transition) for transition in transitions], state_probabilities / state_probabilities.sum(axis=1, keepdims=True)))
+    enabled_probabilities = EnabledProbabilities.from_blocks(len(log), blocks)
+    log["enabled_activities"] = enabled_probabilities.enabled_activities(threshold)
+
+    # The events keep their order, like the rows of groupby(...).apply(...) with same-indexed results
+    if probabilities_filepath is not None:
+        enabled_probabilities.save(probabilities_filepath)
+    return log.reset_index()
@@ -5,21 +5,29 @@ from flask_cors import CORS
 import sqlalchemy as sql
 from sqlalchemy.orm import mapped_column, Mapped, DeclarativeBase
 import enum
+import gzip
+import io
+import json
 import os
-from flask import request, jsonify, send_file
+from flask import abort, request, jsonify, send_file, stream_with_context
 from flask_alembic import Alembic
-import csv
+import numpy as np
 import pandas as pd
 import requests
 import uuid
 from celery import Celery, Task, shared_task
 import shutil
-import pm4py
+import zipfile
 
-from algorithms.preprocessor import fetch_dataframe
-from algorithms.translucify_prefix_automaton import translucify_prefix_automaton, generate_prefix_automaton
-from algorithms.postprocessor import decode_prefix_automaton, encode_prefix_automaton
+from algorithms.preprocessor import ACTIVITY_COLUMN, CASE_COLUMN, TIMESTAMP_COLUMN, convert_delimiter, fetch_columns, fetch_dataframe, sample_event_log, sniff_csv_header, write_columnar_log
+from algorithms.translucify_prefix_automaton import cached_compact_prefix_automaton, cached_prefix_automaton, translucify_prefix_automaton
+from algorithms.postprocessor import decode_compact_prefix_automaton, decode_prefix_automaton, encode_prefix_automaton_view
 from algorithms.translucify_petri_net import translucify_petri_net
+from algorithms.alignment_based_generation import translucify_alignments
+from algorithms.artifact_cache import list_artifacts, purge_artifacts
+from algorithms.dataframe_cache import dataframe_cache
+from algorithms.enabled_probabilities import EnabledProbabilities, probabilities_path
+from algorithms.instrumentation import RunMetrics, format_prometheus_metrics
 
 # Celery configuration
 def celery_init_app(app: Flask) -> Celery:
@@ -75,12 +83,25 @@ class ProcessModelType(enum.Enum):
     PETRINET = "PETRINET"
     PREFIX_AUTOMATON = "PREFIX_AUTOMATON"
 
+class IngestionStatus(enum.Enum):
+    PENDING = "PENDING"
+    PROCESSING = "PROCESSING"
+    READY = "READY"
+    FAILED = "FAILED"
+
 class EventLog(Base):
     __tablename__ = "log"
     id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     name: Mapped[str] = mapped_column(sql.String(255))
     type: Mapped[EventLogType] = mapped_column(sql.Enum(EventLogType))
     file_path: Mapped[str] = mapped_column(sql.String)
+    # Uploaded logs are converted and typed in the background, their data can be read once they are READY
+    status: Mapped[IngestionStatus] = mapped_column(sql.Enum(IngestionStatus), default=IngestionStatus.READY, server_default=IngestionStatus.READY.name)
+    status_message: Mapped[str | None] = mapped_column(sql.String, nullable=True)
+    # Column names, read from the header of the file on upload
+    columns: Mapped[list | None] = mapped_column(sql.JSON(none_as_null=True), nullable=True)
+    # Original column of the case ID, activity and timestamp, applied whenever the log is read
+    column_mapping: Mapped[dict | None] = mapped_column(sql.JSON(none_as_null=True), nullable=True)
     translucnet_event_logs = db.relationship('TranslucentEventLog', cascade="all,delete", backref='event_log')
 
 class TranslucentEventLog(Base):
@@ -90,6 +111,8 @@ class TranslucentEventLog(Base):
     type: Mapped[EventLogType] = mapped_column(sql.Enum(EventLogType))
     file_path: Mapped[str] = mapped_column(sql.String)
     is_ready: Mapped[bool] = mapped_column(sql.Boolean)
+    # Duration, memory usage and item counts of every stage of the run that generated the log
+    metrics: Mapped[dict | None] = mapped_column(sql.JSON(none_as_null=True), nullable=True)
     # foreign key to EventLog
     event_log_id: Mapped[int] = mapped_column(sql.ForeignKey('log.id'))
 
@@ -130,7 +153,8 @@ def event_logs():
             "id": log.id,
             "name": log.name,
             "type": log.type.value,
-            "file_path": log.file_path
+            "file_path": log.file_path,
+            "status": log.status.value
         } for log in logs]
         return jsonify(log_dicts)
 
@@ -153,35 +177,100 @@ def event_logs():
         print("File path: ", file_path)
         file.save(file_path)
 
-        # Change delimiter if necessary
-        if (delimiter != ""):
-            print("Changing delimiter") 
-            with open(file_path, "r") as infile:    
-                reader = csv.reader(infile, delimiter=delimiter) 
-                 
-                with open(file_path + "delimit", "w") as outfile:
-                    writer = csv.writer(outfile, delimiter=';')
-                    writer.writerows(reader)
-
-            # Remove old file
-            os.remove(file_path)
-            # # Rename new file
-            os.rename(file_path + "delimit", file_path)
-            
+        # Only the header is read here, converting the delimiter, typing and caching the log happens in the background
+        columns = None
+        if type == "CSV":
+            delimiter, columns = sniff_csv_header(file_path, delimiter)
+            print("Columns: ", columns)
+
         # Save file as database entry
-        event_log = EventLog(name=name, type=type, file_path=file_path)
+        event_log = EventLog(name=name, type=type, file_path=file_path, status=IngestionStatus.PENDING, columns=columns)
 
         db.session.add(event_log)
         db.session.commit()
 
-        # Return columns of the dataframe
-        df = fetch_dataframe(file_path, type)
-        columns = df.columns.tolist()
-        print("Columns: ", columns)
+        ingest_event_log.delay(event_log.id, delimiter)
+
         return {
             "id": event_log.id,
-            "columns": columns 
-        }
+            "columns": columns,
+            "status": event_log.status.value
+        }, 202
+
+@shared_task
+def ingest_event_log(event_log_id, delimiter=None):
+    event_log = db.get_or_404(EventLog, event_log_id)
+    event_log.status = IngestionStatus.PROCESSING
+    db.session.commit()
+
+    try:
+        file_path, file_type = event_log.file_path, event_log.type.value
+        # Change delimiter if necessary
+        if file_type == "CSV" and delimiter and delimiter != ";":
+            print("Changing delimiter")
+            convert_delimiter(file_path, delimiter)
+
+        # Logs without the case ID, activity and timestamp columns are unusable until their columns are mapped, so they
+        # are parsed once with the mapping instead of once without and once more with it
+        if needs_column_mapping(event_log):
+            event_log.status = IngestionStatus.READY
+            event_log.status_message = COLUMNS_NOT_MAPPED
+            db.session.commit()
+            return event_log.id
+
+        # The mapping can change while the log is ingested, the log is then typed again with the new mapping
+        while True:
+            column_mapping = event_log.column_mapping
+            # Store the typed columnar copy that all reads use, with the column mapping applied
+            df = write_columnar_log(file_path, file_type, column_mapping)
+            event_log.columns = df.columns.tolist()
+            # Build the prefix automaton as well, so it is ready when it is first viewed
+            cache_prefix_automaton(file_path, file_type, column_mapping)
+            db.session.commit()
+            if event_log.column_mapping == column_mapping:
+                break
+    except Exception as error:
+        print(f"Could not ingest {event_log.file_path}: {error!r}")
+        event_log.status = IngestionStatus.FAILED
+        event_log.status_message = str(error)
+        db.session.commit()
+        raise
+
+    event_log.status = IngestionStatus.READY
+    event_log.status_message = None
+    db.session.commit()
+    return event_log.id
+
+@app.route("/event-logs/<uuid:id>/status", methods=["GET"])
+def event_log_status(id):
+    event_log = db.get_or_404(EventLog, id)
+    return jsonify({
+        "id": event_log.id,
+        "status": event_log.status.value,
+        "message": event_log.status_message,
+        "columns": event_log.columns
+    })
+
+COLUMNS_NOT_MAPPED = "Select the case ID, activity and timestamp columns"
+
+def needs_column_mapping(event_log: EventLog) -> bool:
+    # CSV logs without the case ID, activity and timestamp columns are not typed until their columns are mapped
+    return event_log.column_mapping is None and event_log.type == EventLogType.CSV and not {CASE_COLUMN, ACTIVITY_COLUMN, TIMESTAMP_COLUMN} <= set(event_log.columns or [])
+
+def source_columns(event_log: EventLog) -> list[str] | None:
+    # The columns of the original file, which a column mapping refers to. None if they are not known yet.
+    if event_log.type == EventLogType.CSV:
+        return sniff_csv_header(event_log.file_path)[1]
+    if event_log.status == IngestionStatus.READY:
+        return fetch_columns(event_log.file_path, event_log.type.value)
+    return None
+
+def require_ingested(event_log: EventLog):
+    # The data of a log can only be read once it was converted and typed, which needs its columns to be mapped
+    if event_log.status != IngestionStatus.READY:
+        abort(409, f"Event log is {event_log.status.value.lower()}")
+    if needs_column_mapping(event_log):
+        abort(409, COLUMNS_NOT_MAPPED)
     
 @app.route("/event-logs/<uuid:id>/metadata", methods=["GET"])
 def event_log_metadata(id):
@@ -194,6 +283,7 @@ def event_log_metadata(id):
             "id": event_log.id,
             "name": event_log.name,
             "type": event_log.type.value,
+            "status": event_log.status.value,
         })
     
 @app.route("/event-logs/<uuid:id>", methods=["GET", "PATCH", "DELETE"])
@@ -201,15 +291,16 @@ def event_log(id):
     print("Event log id in columns: ", id)
     if request.method == "GET":
         event_log = db.get_or_404(EventLog, id)
+        require_ingested(event_log)
         # Get file path and send it back
         print("File path: ", event_log.file_path)
-        df = fetch_dataframe(event_log.file_path, event_log.type.value)
+        df = fetch_dataframe(event_log.file_path, event_log.type.value, column_mapping=event_log.column_mapping)
 
         # Put Columns case:concept:name, concept:name, time:timestamp in front
         priority_columns = ["case:concept:name", "concept:name", "time:timestamp"]
         df = df[priority_columns + [col for col in df.columns if col not in priority_columns]]
 
-        df_json = df.to_json()
+        df_json = df.to_json(date_format="iso")
         result = jsonify({
             "id": event_log.id,
             "name": event_log.name,
@@ -235,78 +326,256 @@ def event_log(id):
 
         return "Deleted event log"
 
+# Number of events per page if no limit is given, and the largest page that can be requested
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 100000
+# Number of rows serialized at once while a page is streamed
+STREAM_CHUNK_SIZE = 5000
+
+def query_list(name: str) -> list[str] | None:
+    # Comma-separated or repeated query parameter, e.g. ?activity=a,b or ?activity=a&activity=b
+    values = [value for values in request.args.getlist(name) for value in values.split(",") if value]
+    return values or None
+
+@app.route("/event-logs/<uuid:id>/events", methods=["GET"])
+def event_log_events(id):
+    # Pages are given by offset and limit over the events, or by a cursor over the cases (sorted by case ID):
+    # ?cases=100&after=<last case ID of the previous page> returns the events of the next 100 cases.
+    # Events can be filtered by case ID and activity (?case=c1,c2&activity=a), and only the selected columns
+    # (?columns=concept:name,age) are read and returned. "total" counts the matching events, or cases when paging by
+    # case, and "next" is the offset or cursor of the next page, or null on the last page.
+    event_log = db.get_or_404(EventLog, id)
+    require_ingested(event_log)
+    file_path, file_type = event_log.file_path, event_log.type.value
+
+    # Put Columns case:concept:name, concept:name, time:timestamp in front
+    priority_columns = ["case:concept:name", "concept:name", "time:timestamp"]
+    available_columns = fetch_columns(file_path, file_type, event_log.column_mapping)
+    columns = query_list("columns") or [col for col in priority_columns if col in available_columns] + [col for col in available_columns if col not in priority_columns]
+    unknown_columns = [column for column in columns if column not in available_columns]
+    if unknown_columns:
+        return f"Unknown columns: {', '.join(unknown_columns)}", 400
+
+    case_ids, activities = query_list("case"), query_list("activity")
+    page_cases = request.args.get("cases", type=int)
+    offset = request.args.get("offset", default=0, type=int)
+    limit = request.args.get("limit", default=DEFAULT_PAGE_SIZE, type=int)
+    if offset < 0 or not 0 < limit <= MAX_PAGE_SIZE or (page_cases is not None and not 0 < page_cases <= MAX_PAGE_SIZE):
+        return f"offset must be non-negative, limit and cases between 1 and {MAX_PAGE_SIZE}", 400
+
+    # Only the returned columns and the columns needed to filter and page are read
+    filter_columns = ["case:concept:name"] if case_ids or page_cases is not None else []
+    filter_columns += ["concept:name"] if activities else []
+    df = fetch_dataframe(file_path, file_type, list(dict.fromkeys(columns + filter_columns)), column_mapping=event_log.column_mapping)
+
+    mask = np.ones(len(df), dtype=bool)
+    if case_ids:
+        mask &= df["case:concept:name"].astype(str).isin(case_ids).to_numpy()
+    if activities:
+        mask &= df["concept:name"].isin(activities).to_numpy()
+    rows = np.flatnonzero(mask)
+
+    if page_cases is None:
+        total = len(rows)
+        rows = rows[offset:offset + limit]
+        next_page = offset + limit if offset + limit < total else None
+    else:
+        # Rank the cases of the matching events by case ID and take the events of the next cases after the cursor
+        case_codes, cases = pd.factorize(df["case:concept:name"].to_numpy()[rows].astype(str), sort=True)
+        total = len(cases)
+        first_case = int(np.searchsorted(cases, request.args["after"], side="right")) if "after" in request.args else 0
+        in_page = (case_codes >= first_case) & (case_codes < first_case + page_cases)
+        rows = rows[in_page][np.argsort(case_codes[in_page], kind="stable")]
+        next_page = str(cases[first_case + page_cases - 1]) if first_case + page_cases < total else None
+
+    page = df.iloc[rows][columns]
+
+    def generate():
+        yield json.dumps({"id": str(event_log.id), "columns": columns, "total": total, "next": next_page})[:-1] + ', "rows": ['
+        for start in range(0, len(page), STREAM_CHUNK_SIZE):
+            chunk = page.iloc[start:start + STREAM_CHUNK_SIZE].to_json(orient="values", date_format="iso")
+            yield ("," if start else "") + chunk[1:-1]
+        yield "]}"
+
+    return app.response_class(stream_with_context(generate()), mimetype="application/json")
+
 @app.route("/event-logs/<uuid:id>/columns", methods=["PATCH", "GET"])
 def event_log_columns(id):
     print("Event log id in columns: ", id)
     if request.method == "GET":
         event_log = db.get_or_404(EventLog, id)
-        df = fetch_dataframe(event_log.file_path, event_log.type.value)
-        columns = df.columns.tolist()
+        # The header is read on upload, so the columns are available before the ingestion finished
+        if event_log.columns is not None:
+            return jsonify(event_log.columns)
+        require_ingested(event_log)
+        columns = fetch_columns(event_log.file_path, event_log.type.value, event_log.column_mapping)
         return jsonify(columns)
     
     elif request.method == "PATCH":
         event_log = db.get_or_404(EventLog, id)
-        file_path = event_log.file_path
+        file_path, file_type = event_log.file_path, event_log.type.value
         print("Update columns for: ", file_path)
         # Get request body
         body = request.json
         columns = body.get("columns")
         print("Columns: ", columns)
 
-        df = fetch_dataframe(file_path, event_log.type.value)
+        # Only the mapping is stored, the original file is not rewritten: it is applied when the log is typed.
+        # The typed log only has the mapped columns, so they stand for the original columns they are mapped from.
+        current_mapping = event_log.column_mapping or {}
+        column_mapping = {key: current_mapping.get(column, column) for key, column in ((CASE_COLUMN, columns.get("caseId")), (ACTIVITY_COLUMN, columns.get("activity")), (TIMESTAMP_COLUMN, columns.get("timestamp")))}
+        # The columns are known from the header of the original file, the values can only be checked once the log was converted
+        original_columns = source_columns(event_log)
+        unknown_columns = [column for column in column_mapping.values() if not column or (original_columns is not None and column not in original_columns)]
+        if unknown_columns:
+            return f"Invalid column mapping, unknown columns: {', '.join(map(str, unknown_columns))}", 400
+        if event_log.status == IngestionStatus.READY:
+            try:
+                # Check the mapping on the first rows before the whole log is parsed with it
+                sample_event_log(file_path, file_type, column_mapping)
+            except Exception as error:
+                return f"Invalid column mapping: {error}", 400
+
+        event_log.column_mapping = column_mapping
+        # A pending or running ingestion applies the new mapping, otherwise the log is ingested again with it.
+        # The log is sorted and typed once, in its columnar copy for this mapping.
+        if event_log.status in (IngestionStatus.PENDING, IngestionStatus.PROCESSING):
+            db.session.commit()
+        else:
+            event_log.status = IngestionStatus.PENDING
+            event_log.status_message = None
+            db.session.commit()
+            ingest_event_log.delay(event_log.id)
 
-        df = pm4py.format_dataframe(df, case_id=columns.get("caseId"), activity_key=columns.get("activity"), timestamp_key=columns.get("timestamp"))
-
-        df.to_csv(file_path, sep=";", index=False)
+        return jsonify({
+            "id": event_log.id,
+            "columnMapping": event_log.column_mapping,
+            "status": event_log.status.value
+        }), 202
 
-        return "Update columns for event log"
+@shared_task
+def cache_prefix_automaton(file_path, file_type, column_mapping=None):
+    try:
+        for encoding in ("react_flow", "compact"):
+            cached_prefix_automaton(file_path, file_type, encoding, column_mapping=column_mapping)
+    except (KeyError, ValueError) as error:
+        # E.g. the case, activity and timestamp columns have not been selected yet
+        print(f"Could not build prefix automaton of {file_path}: {error!r}")
 
 # Should get a "method" parameter to determine which method to use: logistic regression or random forest
 @app.route("/event-logs/<uuid:id>/prefix-automaton", methods=["GET", "POST"])
 def prefix_automaton(id):
     if request.method == "GET":
         event_log = db.get_or_404(EventLog, id)
-        df = fetch_dataframe(event_log.file_path, event_log.type.value)
-        prefix_automaton = generate_prefix_automaton(df)
-        payload = encode_prefix_automaton(prefix_automaton)
-        return jsonify(payload)
+        require_ingested(event_log)
+        # Only the top levels (and the most frequent branches) if requested, collapsed states are expanded on demand
+        if "levels" in request.args or "topK" in request.args:
+            return prefix_automaton_view(event_log, None)
+        # Large automata can be fetched with integer IDs and parent-pointer arrays instead of the React Flow shape
+        encoding = "compact" if request.args.get("format") == "compact" else "react_flow"
+        try:
+            tag, payload = cached_prefix_automaton(event_log.file_path, event_log.type.value, encoding, *prefix_automaton_bounds(), column_mapping=event_log.column_mapping)
+        except ValueError as error:
+            return str(error), 400
+
+        # The encoding is stored compressed, clients that do not accept gzip get it decompressed
+        compressed = "gzip" in request.accept_encodings
+        response = app.response_class(payload if compressed else gzip.decompress(payload), mimetype="application/json")
+        if compressed:
+            response.headers["Content-Encoding"] = "gzip"
+        response.headers["Vary"] = "Accept-Encoding"
+        response.headers["Cache-Control"] = "no-cache"
+        response.set_etag(tag + ("-gzip" if compressed else ""))
+        return response.make_conditional(request)
     elif request.method == "POST":
         event_log = db.get_or_404(EventLog, id)
+        require_ingested(event_log)
 
-        base_name, extension = os.path.splitext(event_log.file_path)
-        file_path = os.path.join(base_name + "_translucent_petri_net" + extension)
+        translucent_log_id = uuid.uuid4()
+        file_path = translucent_log_path(event_log, "prefix_automaton", translucent_log_id)
 
         # Save to database first
-        translucent_log = TranslucentEventLog(name=event_log.name + "_translucent_prefix_automaton", type=EventLogType.CSV, file_path=file_path, is_ready=False, event_log_id=event_log.id)
+        translucent_log = TranslucentEventLog(id=translucent_log_id, name=event_log.name + "_translucent_prefix_automaton", type=EventLogType.CSV, file_path=file_path, is_ready=False, event_log_id=event_log.id)
         db.session.add(translucent_log)
         db.session.commit()
         
         body = request.json
         states = body.get("states")
         transitions = body.get("transitions")
+        # Alternatively, the automaton in the compact format of GET ?format=compact
+        compact_prefix_automaton = body.get("prefixAutomaton")
         threshold = body.get("threshold")
         selected_columns = body.get("selectedColumns")
         method = body.get("method")
+        # Number of models trained concurrently and whether to compute their held-out accuracy
+        training_workers: int = body.get("trainingWorkers", 1)
+        evaluate: bool = body.get("evaluate", True)
+        # "transition": one binary model per transition, "state": one multiclass model per state
+        training_mode: str = body.get("trainingMode", "transition")
         print("Method in prefix automaton: ", method)
-        process_translucent_log_from_prefix_automaton.delay(event_log.file_path, states, transitions, threshold, selected_columns, method, translucent_log.id, translucent_log.file_path)
+        process_translucent_log_from_prefix_automaton.delay(event_log.file_path, states, transitions, threshold, selected_columns, method, translucent_log.id, translucent_log.file_path, training_workers=training_workers, evaluate=evaluate, compact_prefix_automaton=compact_prefix_automaton, training_mode=training_mode, column_mapping=event_log.column_mapping)
 
         return jsonify({
         "message": "Translucent Log Generation (Prefix Automaton) in progress",
         "translucent_log_id": translucent_log.id
         }), 202
         
+def translucent_log_path(event_log: EventLog, method: str, translucent_log_id: uuid.UUID) -> str:
+    # Every run gets its own file, so that runs of the same or another method do not overwrite each other's log
+    # and probabilities, e.g. logs/x/log_translucent_petri_net_<id>.csv
+    base_name, extension = os.path.splitext(event_log.file_path)
+    return f"{base_name}_translucent_{method}_{translucent_log_id}{extension}"
+
+def prefix_automaton_bounds() -> tuple[int | None, int, int | None]:
+    # Optional bounds on the size of the automaton: maximum prefix length, minimum case frequency of a state, k-tail
+    return request.args.get("maxDepth", type=int), request.args.get("minFrequency", default=1, type=int), request.args.get("kTail", type=int)
+
+def prefix_automaton_view(event_log: EventLog, state_id: str | None):
+    levels = request.args.get("levels", default=3, type=int)
+    top_k = request.args.get("topK", type=int)
+    # Number of the most frequent transitions of the state that were already shown, see the "skip" of a placeholder
+    skip = request.args.get("skip", default=0, type=int)
+    if levels < 0 or (top_k is not None and top_k < 1) or skip < 0:
+        return "levels and skip must be non-negative and topK positive", 400
+    try:
+        automaton = cached_compact_prefix_automaton(event_log.file_path, event_log.type.value, *prefix_automaton_bounds(), column_mapping=event_log.column_mapping)
+    except ValueError as error:
+        return str(error), 400
+
+    root = None
+    if state_id is not None:
+        root = automaton.state_index(state_id)
+        if root < 0:
+            return "State not found", 404
+    return jsonify(encode_prefix_automaton_view(automaton, root, levels, top_k, skip))
+
+@app.route("/event-logs/<uuid:id>/prefix-automaton/states/<string:state_id>", methods=["GET"])
+def prefix_automaton_state(id, state_id):
+    # Expands the subtree of a (collapsed) state, with the same levels, topK and bounds as the initial view.
+    # A "/more" placeholder is expanded with its "skip", so the view starts at the transitions it hid
+    event_log = db.get_or_404(EventLog, id)
+    require_ingested(event_log)
+    return prefix_automaton_view(event_log, state_id)
+
 @shared_task
-def process_translucent_log_from_prefix_automaton(file_path, states, transitions, threshold, selected_columns, method, translucent_log_id, translucent_log_file_path):
-    prefix_automaton = decode_prefix_automaton(states, transitions)
-    df = translucify_prefix_automaton(file_path, prefix_automaton, selected_columns, method, threshold)
+def process_translucent_log_from_prefix_automaton(file_path, states, transitions, threshold, selected_columns, method, translucent_log_id, translucent_log_file_path, training_workers=1, evaluate=True, compact_prefix_automaton=None, training_mode="transition", column_mapping=None):
+    metrics = RunMetrics("prefix_automaton")
+    with metrics.stage("decode_prefix_automaton"):
+        if compact_prefix_automaton is not None:
+            prefix_automaton = decode_compact_prefix_automaton(compact_prefix_automaton)
+        else:
+            prefix_automaton = decode_prefix_automaton(states, transitions)
+    df = translucify_prefix_automaton(file_path, prefix_automaton, selected_columns, method, threshold, training_workers, evaluate, probabilities_path(translucent_log_file_path), metrics, training_mode, column_mapping)
 
     # Save the translucent log to file system
-    df.to_csv(translucent_log_file_path, sep=";", index=False)
+    with metrics.stage("write_log"):
+        df.to_csv(translucent_log_file_path, sep=";", index=False)
 
     translucent_log = db.get_or_404(TranslucentEventLog, translucent_log_id)
 
     # Edit the database entry to mark it as ready
     translucent_log.is_ready = True
+    translucent_log.metrics = metrics.to_dict()
     db.session.commit()
 
     return df.to_json()
@@ -318,18 +587,24 @@ def event_log_petri_net(id):
     data_columns = body.get("columns")
     threshold: float = body.get("threshold")
     method = body.get("method")
+    # Number of processes used to align the variants of the log
+    workers: int = body.get("workers", 1)
+    # Number of models trained concurrently and whether to compute their held-out accuracy
+    training_workers: int = body.get("trainingWorkers", 1)
+    evaluate: bool = body.get("evaluate", True)
 
     event_log = db.get_or_404(EventLog, id)
-    base_name, extension = os.path.splitext(event_log.file_path)
-    file_path = os.path.join(base_name + "_translucent_petri_net" + extension)
+    require_ingested(event_log)
+    translucent_log_id = uuid.uuid4()
+    file_path = translucent_log_path(event_log, "petri_net", translucent_log_id)
 
     # Save to database first
-    translucent_log = TranslucentEventLog(name=event_log.name + "_translucent_petri_net", type=EventLogType.CSV, file_path=file_path, is_ready=False, event_log_id=event_log.id)
+    translucent_log = TranslucentEventLog(id=translucent_log_id, name=event_log.name + "_translucent_petri_net", type=EventLogType.CSV, file_path=file_path, is_ready=False, event_log_id=event_log.id)
 
     db.session.add(translucent_log)
     db.session.commit()
 
-    process_translucent_log_from_petri_net.delay(event_log.file_path, data_columns, threshold, method, translucent_log.id, translucent_log.file_path)
+    process_translucent_log_from_petri_net.delay(event_log.file_path, data_columns, threshold, method, translucent_log.id, translucent_log.file_path, workers=workers, training_workers=training_workers, evaluate=evaluate, column_mapping=event_log.column_mapping)
 
     return jsonify({
         "message": "Translucent Petri Net generation in progress",
@@ -337,31 +612,79 @@ def event_log_petri_net(id):
     }), 202
 
 @shared_task
-def process_translucent_log_from_petri_net(file_path, data_columns, threshold, method, translucent_log_id, translucent_log_file_path):
+def process_translucent_log_from_petri_net(file_path, data_columns, threshold, method, translucent_log_id, translucent_log_file_path, workers=1, training_workers=1, evaluate=True, column_mapping=None):
 
     # Perform the long-running task
-    df = translucify_petri_net(file_path, data_columns, method, threshold)
+    metrics = RunMetrics("petri_net")
+    df = translucify_petri_net(file_path, data_columns, method, threshold, workers, training_workers, evaluate, probabilities_path(translucent_log_file_path), metrics, column_mapping)
 
     # Save the translucent log to file system
-    df.to_csv(translucent_log_file_path, sep=";", index=False)
+    with metrics.stage("write_log"):
+        df.to_csv(translucent_log_file_path, sep=";", index=False)
 
     # Mark the translucent log as ready in the database
     translucent_log = db.get_or_404(TranslucentEventLog, translucent_log_id)
     translucent_log.is_ready = True
+    translucent_log.metrics = metrics.to_dict()
     db.session.commit()
 
     return translucent_log.id
 
+
+@app.route("/event-logs/<uuid:id>/alignments", methods=["POST"])
+def event_log_alignments(id):
+    body = request.json or {}
+    # Number of processes used to align the variants of the log
+    workers: int = body.get("workers", 1)
+
+    event_log = db.get_or_404(EventLog, id)
+    require_ingested(event_log)
+    translucent_log_id = uuid.uuid4()
+    file_path = translucent_log_path(event_log, "alignments", translucent_log_id)
+
+    # Save to database first
+    translucent_log = TranslucentEventLog(id=translucent_log_id, name=event_log.name + "_translucent_alignments", type=EventLogType.CSV, file_path=file_path, is_ready=False, event_log_id=event_log.id)
+
+    db.session.add(translucent_log)
+    db.session.commit()
+
+    process_translucent_log_from_alignments.delay(event_log.file_path, translucent_log.id, translucent_log.file_path, workers=workers, column_mapping=event_log.column_mapping)
+
+    return jsonify({
+        "message": "Alignment-based translucent log generation in progress",
+        "translucent_log_id": translucent_log.id
+    }), 202
+
+@shared_task
+def process_translucent_log_from_alignments(file_path, translucent_log_id, translucent_log_file_path, workers=1, column_mapping=None):
+
+    # Perform the long-running task
+    metrics = RunMetrics("alignments")
+    df = translucify_alignments(file_path, workers, metrics, column_mapping)
+    df = df.rename(columns={"enabled__activities": "enabled_activities"})
+
+    # Save the translucent log to file system
+    with metrics.stage("write_log"):
+        df.to_csv(translucent_log_file_path, sep=";", index=False)
+
+    # Mark the translucent log as ready in the database
+    translucent_log = db.get_or_404(TranslucentEventLog, translucent_log_id)
+    translucent_log.is_ready = True
+    translucent_log.metrics = metrics.to_dict()
+    db.session.commit()
+
+    return translucent_log.id
     
 @app.route("/event-logs/<uuid:id>/transformer", methods=["POST"])
 def event_log_transformer(id):
 
     event_log = db.get_or_404(EventLog, id)
-    base_name, extension = os.path.splitext(event_log.file_path)
-    file_path = os.path.join(base_name + "_translucent_transformer" + extension)
+    require_ingested(event_log)
+    translucent_log_id = uuid.uuid4()
+    file_path = translucent_log_path(event_log, "transformer", translucent_log_id)
 
     # Save to database first
-    translucent_log = TranslucentEventLog(name=event_log.name + "_translucent_transformer", type=EventLogType.CSV, file_path=file_path, is_ready=False, event_log_id=event_log.id)
+    translucent_log = TranslucentEventLog(id=translucent_log_id, name=event_log.name + "_translucent_transformer", type=EventLogType.CSV, file_path=file_path, is_ready=False, event_log_id=event_log.id)
 
     
     db.session.add(translucent_log)
@@ -377,8 +700,12 @@ def event_log_transformer(id):
     # Forward the request to the transformer microservice with:
     # ssh -L 3000:localhost:5000 geonho@137.226.117.2
 
-    # Get csv file
-    with open(event_log.file_path, 'rb') as file:
+    # Get csv file, the microservice expects the XES column names, so mapped logs are sent from their typed copy
+    if event_log.column_mapping:
+        log_file = io.BytesIO(fetch_dataframe(event_log.file_path, event_log.type.value, column_mapping=event_log.column_mapping).to_csv(sep=";", index=False).encode())
+    else:
+        log_file = open(event_log.file_path, 'rb')
+    with log_file as file:
         # Create the payload with the file object
         files = {'file': file}
         print("Sending request...")
@@ -395,14 +722,10 @@ def transformer_callback(id):
     translucent_log_entity = db.get_or_404(TranslucentEventLog, id)
 
     print("translucnet log entity file path: ", translucent_log_entity.file_path)
-    event_log = db.get_or_404(EventLog, translucent_log_entity.event_log_id)
-
-    base_name, extension = os.path.splitext(event_log.file_path)
-    file_path = os.path.join(base_name + "_translucent_transformer" + extension)
 
     file = request.files.get("file")
 
-    file.save(file_path)
+    file.save(translucent_log_entity.file_path)
     
     # Set is_ready to True
 
@@ -435,6 +758,81 @@ def translucent_log(id):
         return send_file(file_path, as_attachment=True)
     elif request.method == "DELETE":
         translucent_log = db.get_or_404(TranslucentEventLog, id)
+        # Every run has its own files, remove them with the entry
+        for file_path in (translucent_log.file_path, probabilities_path(translucent_log.file_path)):
+            if os.path.isfile(file_path):
+                os.remove(file_path)
         db.session.delete(translucent_log)
         db.session.commit()
         return "Deleted translucent log"
+
+@app.route("/translucent-event-logs/<uuid:id>/threshold", methods=["POST"])
+def translucent_log_threshold(id):
+    # Re-threshold a translucent log from its stored probabilities instead of rerunning the whole pipeline
+    body = request.get_json(silent=True) or {}
+    try:
+        thresholds = None if body.get("thresholds") is None else [float(threshold) for threshold in body.get("thresholds")]
+        threshold = float(body["threshold"]) if thresholds is None else None
+    except (KeyError, TypeError, ValueError):
+        return "Provide a numeric threshold or a list of numeric thresholds", 400
+    translucent_log = db.get_or_404(TranslucentEventLog, id)
+    if not translucent_log.is_ready:
+        return "Translucent log is not ready yet", 409
+
+    file_path = probabilities_path(translucent_log.file_path)
+    if not os.path.isfile(file_path):
+        return "No probabilities stored for this translucent log", 404
+    enabled_probabilities = EnabledProbabilities.load(file_path)
+    df = pd.read_csv(translucent_log.file_path, sep=";")
+    base_name, _ = os.path.splitext(os.path.basename(translucent_log.file_path))
+
+    # A single threshold returns one CSV file, a sweep of thresholds returns one CSV file per threshold in a zip archive
+    if thresholds is None:
+        df["enabled_activities"] = enabled_probabilities.enabled_activities(threshold)
+        return send_file(io.BytesIO(df.to_csv(sep=";", index=False).encode()), mimetype="text/csv", as_attachment=True, download_name=f"{base_name}_{threshold}.csv")
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for threshold, enabled_activities in enabled_probabilities.sweep(thresholds).items():
+            df["enabled_activities"] = enabled_activities
+            zip_file.writestr(f"{base_name}_{threshold}.csv", df.to_csv(sep=";", index=False))
+    archive.seek(0)
+    return send_file(archive, mimetype="application/zip", as_attachment=True, download_name=f"{base_name}_thresholds.zip")
+
+@app.route("/translucent-event-logs/<uuid:id>/metrics", methods=["GET"])
+def translucent_log_metrics(id):
+    translucent_log = db.get_or_404(TranslucentEventLog, id)
+    if translucent_log.metrics is None:
+        return "No metrics recorded for this translucent log", 404
+    return jsonify(translucent_log.metrics)
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    # Stage latency histograms over all recorded runs in the Prometheus text format
+    runs = db.session.execute(db.select(TranslucentEventLog.metrics).filter(TranslucentEventLog.metrics.is_not(None))).scalars()
+    return format_prometheus_metrics(list(runs)), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+@app.route("/artifacts", methods=["GET", "DELETE"])
+def artifacts():
+    if request.method == "GET":
+        # Cached nets, alignments and models per log content, most recently used first
+        return jsonify(list_artifacts())
+    elif request.method == "DELETE":
+        deleted = purge_artifacts()
+        return jsonify({"deleted": deleted})
+
+@app.route("/dataframe-cache", methods=["GET", "DELETE"])
+def dataframe_cache_stats():
+    if request.method == "GET":
+        # Hits, misses and the parsed logs held in memory by this process, most recently used first
+        return jsonify(dataframe_cache.stats())
+    elif request.method == "DELETE":
+        dataframe_cache.clear()
+        return jsonify(dataframe_cache.stats())
+
+@app.route("/artifacts/<string:key>", methods=["DELETE"])
+def artifact(key):
+    deleted = purge_artifacts(key)
+    if deleted == 0:
+        return "Artifact not found", 404
+    return jsonify({"deleted": deleted})
@@ -0,0 +1,20 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from algorithms.translucify_prefix_automaton import fill_enabled_activities, generate_prefix_automaton
+
+
+@pytest.fixture
+def log() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    rows = [(f"c{case}", activity) for case in range(200) for activity in rng.choice(list("abcd"), size=rng.integers(2, 8))]
+    return pd.DataFrame(rows, columns=["case:concept:name", "concept:name"])
+
+
+@pytest.mark.parametrize("bounds", [{}, {"max_depth": 2}, {"min_frequency": 10}, {"k_tail": 1}, {"k_tail": 2, "min_frequency": 5}])
+def test_row_wise_and_vectorized_modes_agree(log, bounds):
+    prefix_automaton = generate_prefix_automaton(log, **bounds)
+    row_wise = fill_enabled_activities(log.copy(), prefix_automaton, 0.2)
+    vectorized = fill_enabled_activities(log.copy(), prefix_automaton, 0.2, vectorized=True)
+    assert row_wise["enabled_activities"].tolist() == vectorized["enabled_activities"].tolist()
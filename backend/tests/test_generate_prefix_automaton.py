@@ -0,0 +1,15 @@
+import pandas as pd
+
+from algorithms.translucify_prefix_automaton import generate_prefix_automaton
+
+
+def test_k_tail_frequencies_count_cases_not_visits():
+    log = pd.DataFrame([("c1", "a"), ("c1", "a"), ("c1", "a"), ("c2", "a"), ("c2", "b")], columns=["case:concept:name", "concept:name"])
+    prefix_automaton = generate_prefix_automaton(log, k_tail=1)
+    frequency = dict(zip(prefix_automaton.names(), prefix_automaton.state_frequency.tolist()))
+    assert frequency == {"<>": 2, "<*,a>": 2, "<*,b>": 1}
+    loop = prefix_automaton.find_edges([prefix_automaton.names().index("<*,a>")], [prefix_automaton.activity_code("a")])[0]
+    assert prefix_automaton.edge_frequency[loop] == 1
+
+    # A node visited three times by one case is still reached by fewer than two cases
+    assert "<*,a>" not in generate_prefix_automaton(log[log["case:concept:name"] == "c1"], min_frequency=2, k_tail=1).names()
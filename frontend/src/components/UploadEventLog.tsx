@@ -9,13 +9,14 @@ import {
     Stack,
     Group,
     Checkbox,
+    Loader,
 } from "@mantine/core";
 import { useDisclosure } from "@mantine/hooks";
-import { useMutation, useQueryClient } from "@tanstack/react-query";
+import { useMutation, useQuery, useQueryClient } from "@tanstack/react-query";
 import { useState } from "react";
-import { patchColumns, postEventLog } from "@lib/queries";
+import { getEventLogStatus, patchColumns, postEventLog } from "@lib/queries";
 import { Link } from "@tanstack/react-router";
-import { EventLogType } from "@lib/types";
+import { EventLogType, IngestionStatus } from "@lib/types";
 
 export default function UploadEventLogButton({
     children,
@@ -70,6 +71,19 @@ export default function UploadEventLogButton({
         },
     });
 
+    // The log is converted and typed in the background, poll its status until it can be viewed
+    const { data: ingestion } = useQuery({
+        queryKey: ["event-logs", fileMutation.data?.id, "status"],
+        queryFn: () => getEventLogStatus(fileMutation.data?.id!),
+        enabled: !!fileMutation.data?.id && (columnMutation.isSuccess || !file?.name.endsWith(".csv")),
+        refetchInterval: (query) =>
+            query.state.data?.status === IngestionStatus.READY ||
+            query.state.data?.status === IngestionStatus.FAILED
+                ? false
+                : 1000,
+    });
+    const ingested = ingestion?.status === IngestionStatus.READY;
+
     return (
         <>
             <Button onClick={open}>{children}</Button>
@@ -181,7 +195,16 @@ export default function UploadEventLogButton({
 
                     <Stepper.Completed>
                         <Stack>
-                            Event Log ready to be translucified!
+                            {ingested ? (
+                                "Event Log ready to be translucified!"
+                            ) : ingestion?.status === IngestionStatus.FAILED ? (
+                                `Event Log could not be processed: ${ingestion.message}`
+                            ) : (
+                                <Group>
+                                    <Loader size="sm" />
+                                    Processing Event Log...
+                                </Group>
+                            )}
                             <Group justify="end">
                                 <Button
                                     onClick={() => {
@@ -198,7 +221,9 @@ export default function UploadEventLogButton({
                                         eventLogId: fileMutation.data?.id!,
                                     }}
                                 >
-                                    <Button>View Event Log</Button>
+                                    <Button disabled={!ingested}>
+                                        View Event Log
+                                    </Button>
                                 </Link>
                             </Group>
                         </Stack>
@@ -1,6 +1,6 @@
 import { ColumnDefinition } from "src/routes/_layout/event-logs/$eventLogId/petri-net";
 import axios from "./axios";
-import { EventLog } from "./types";
+import { EventLog, EventLogStatus } from "./types";
 import { UUID } from "crypto";
 
 export async function getEventLogs() {
@@ -15,6 +15,11 @@ export async function getEventLogMetadata(eventLogId: UUID) {
     return (await axios.get(`/event-logs/${eventLogId}/metadata`)).data;
 }
 
+export async function getEventLogStatus(eventLogId: UUID) {
+    return (await axios.get<EventLogStatus>(`/event-logs/${eventLogId}/status`))
+        .data;
+}
+
 export async function postEventLog(eventLog: EventLog) {
     const formData = new FormData();
     formData.append("name", eventLog.name);
@@ -24,6 +24,20 @@ export interface TranslucentEventLog {
     event_log_id: number;
 }
 
+export enum IngestionStatus {
+    PENDING = "PENDING",
+    PROCESSING = "PROCESSING",
+    READY = "READY",
+    FAILED = "FAILED",
+}
+
+export interface EventLogStatus {
+    id: UUID;
+    status: IngestionStatus;
+    message: string | null;
+    columns: string[] | null;
+}
+
 export enum EventLogType {
     CSV = "CSV",
     XES = "XES",